@@ -3,20 +3,2325 @@
 """
 ANALIZADOR DE ARCHIVOS BINARIOS DTC1B
 Código para leer, analizar y extraer datos de archivos binarios desencriptados
+
+Dependencias opcionales en requirements-analizador.txt (NumPy).
 """
 
-import os
-import re
-import struct
-import binascii
-from collections import defaultdict, Counter
-import json
-from datetime import datetime
+import os
+import re
+import argparse
+import fnmatch
+import math
+import random
+import struct
+from re import _parser as sre_parse
+from array import array
+import binascii
+from collections import defaultdict, Counter, OrderedDict, deque
+import itertools
+import json
+import time
+import hashlib
+import sqlite3
+import pickle
+import tempfile
+import base64
+import zlib
+import gzip
+import bz2
+import lzma
+import zipfile
+import io
+import contextlib
+import functools
+import sys
+import mmap
+import threading
+import queue
+import multiprocessing
+from datetime import datetime
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usan histogramas en Python puro
+    np = None
+
+# Tamaño de ventana y solape por defecto del modo streaming
+DEFAULT_WINDOW_SIZE = 4 * 1024 * 1024
+DEFAULT_OVERLAP = 4096
+
+# Bloque de escaneo para datos en memoria (cabe en caché)
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+# Prefiltro de tramos candidatos: tramos separados por menos de
+# PREFILTER_GAP bytes se escanean juntos, y si hay más de una racha por
+# PREFILTER_MIN_SPAN_BYTES bytes de buffer se escanea el buffer entero
+PREFILTER_GAP = 64
+PREFILTER_MIN_SPAN_BYTES = 4096
+
+# Bloque por defecto del mapa de entropía
+ENTROPY_BLOCK_SIZE = 64 * 1024
+
+# Modos de muestreo de coincidencias
+SAMPLING_MODES = ('first', 'reservoir')
+
+# Versión del formato de resultados (incluida en la clave de la caché)
+RESULT_FORMAT_VERSION = 3
+
+# Tamaño máximo por defecto de la caché de resultados
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Bloques muestreados por defecto en el triaje y entropía (bits por byte)
+# a partir de la cual un bloque se considera cifrado o comprimido
+TRIAGE_SAMPLES = 64
+ENCRYPTED_ENTROPY = 7.5
+
+# Puerto y tamaño máximo de subida por defecto del modo servidor
+DEFAULT_SERVER_PORT = 8765
+DEFAULT_MAX_UPLOAD = 512 * 1024 * 1024
+
+# Bytes mágicos de los formatos comprimidos que se leen en flujo (ver
+# open_input) y sufijos con que se buscan los chunks comprimidos
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'PK\x03\x04', 'zip'),
+)
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zip')
+
+# Ventana de las búsquedas con parada anticipada (ver DTCAnalyzer.find_matches):
+# pequeña para dejar de leer poco después de reunir las coincidencias
+QUERY_WINDOW_SIZE = 64 * 1024
+
+# Bytes del principio y del final de lo ya escaneado con que un punto de
+# control comprueba que el archivo solo ha crecido (ver ScanCheckpoints)
+CHECKPOINT_PROBE = 64 * 1024
+
+# Ventanas o chunks que se leen por delante del escaneo (ver prefetched)
+DEFAULT_PREFETCH = 2
+
+# Escaneo en paralelo de un archivo (ver split_ranges): rangos por proceso,
+# tamaño mínimo de rango y bytes tras cada frontera nominal en los que se
+# busca un byte de corte
+PARALLEL_RANGES_PER_JOB = 4
+PARALLEL_MIN_RANGE = 4 * 1024 * 1024
+PARALLEL_ALIGN_LIMIT = 1024 * 1024
+
+# Sketches por patrón (ver PatternSketch): 2**SKETCH_PRECISION registros
+# HyperLogLog (~2.3 % de error), Count-Min de SKETCH_DEPTH x SKETCH_WIDTH
+# contadores y SKETCH_CANDIDATES candidatos Misra-Gries; el resumen muestra
+# los SKETCH_TOP valores más frecuentes
+SKETCH_PRECISION = 11
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 1024
+SKETCH_CANDIDATES = 64
+SKETCH_TOP = 10
+
+# Validación de candidatos (ver validate_values): comprobación por patrón,
+# longitudes admitidas de un IBAN y lote a partir del cual se usa NumPy
+VALIDATED_PATTERNS = {
+    'iban_patterns': 'iban',
+    'account_numbers': 'luhn',
+    'swift_codes': 'swift',
+}
+IBAN_MIN_LENGTH = 15
+IBAN_MAX_LENGTH = 34
+VALIDATION_MIN_BATCH = 32
+
+# Códigos de país ISO 3166-1 alfa-2 (más XK, que usan los BIC de Kosovo)
+ISO_COUNTRY_CODES = '''
+AD AE AF AG AI AL AM AO AQ AR AS AT AU AW AX AZ BA BB BD BE BF BG BH BI BJ BL
+BM BN BO BQ BR BS BT BV BW BY BZ CA CC CD CF CG CH CI CK CL CM CN CO CR CU CV
+CW CX CY CZ DE DJ DK DM DO DZ EC EE EG EH ER ES ET FI FJ FK FM FO FR GA GB GD
+GE GF GG GH GI GL GM GN GP GQ GR GS GT GU GW GY HK HM HN HR HT HU ID IE IL IM
+IN IO IQ IR IS IT JE JM JO JP KE KG KH KI KM KN KP KR KW KY KZ LA LB LC LI LK
+LR LS LT LU LV LY MA MC MD ME MF MG MH MK ML MM MN MO MP MQ MR MS MT MU MV MW
+MX MY MZ NA NC NE NF NG NI NL NO NP NR NU NZ OM PA PE PF PG PH PK PL PM PN PR
+PS PT PW PY QA RE RO RS RU RW SA SB SC SD SE SG SH SI SJ SK SL SM SN SO SR SS
+ST SV SX SY SZ TC TD TF TG TH TJ TK TL TM TN TO TR TT TV TW TZ UA UG UM US UY
+UZ VA VC VE VG VI VN VU WF WS XK YE YT ZA ZM ZW
+'''
+
+def min_overlap(patterns):
+    """Solape mínimo seguro: la coincidencia acotada más larga de los patrones
+
+    Los patrones sin longitud máxima aportan su longitud mínima; sus
+    coincidencias solo son exactas hasta window_size + overlap bytes.
+    """
+    longest = 0
+    for pattern in patterns.values():
+        shortest, widest = sre_parse.parse(pattern.pattern).getwidth()
+        longest = max(longest, widest if widest < sre_parse.MAXREPEAT else shortest)
+    return longest
+
+
+# Bytes por llamada a bincount (acota la copia temporal a intp)
+_HISTOGRAM_STEP = 256 * 1024
+
+
+def byte_histogram(data, counts=None):
+    """Acumular en counts el histograma de 256 posiciones de los bytes de data"""
+    if np is not None:
+        if counts is None:
+            counts = np.zeros(256, dtype=np.int64)
+        values = np.frombuffer(data, dtype=np.uint8)
+        for start in range(0, len(values), _HISTOGRAM_STEP):
+            counts += np.bincount(values[start:start + _HISTOGRAM_STEP], minlength=256)
+        return counts
+
+    if counts is None:
+        counts = [0] * 256
+    for byte, count in Counter(data).items():
+        counts[byte] += count
+    return counts
+
+
+def shannon_entropy(counts, total):
+    """Entropía de Shannon (bits por byte, 0-8) a partir de un histograma de bytes"""
+    if total == 0:
+        return 0
+
+    if np is not None:
+        p = np.asarray(counts, dtype=np.float64)
+        p = p[p > 0] / total
+        return float(-(p * np.log2(p)).sum())
+
+    entropy = 0
+    for count in counts:
+        if count:
+            p = count / total
+            entropy -= p * math.log2(p)
+    return entropy
+
+
+def _block_entropies(data, block_size):
+    """Entropía de cada bloque completo de data, vectorizada por filas"""
+    values = np.frombuffer(data, dtype=np.uint8)
+    n_blocks = len(values) // block_size
+    # Agrupar filas para que la matriz temporal de índices quede acotada
+    rows_per_step = max(1, _HISTOGRAM_STEP // block_size)
+    entropies = []
+
+    for first in range(0, n_blocks, rows_per_step):
+        rows = min(rows_per_step, n_blocks - first)
+        block = values[first * block_size:(first + rows) * block_size].reshape(rows, block_size)
+        # Desplazar cada fila 256 posiciones para un único bincount
+        index = block + (np.arange(rows, dtype=np.int64) * 256)[:, None]
+        counts = np.bincount(index.ravel(), minlength=rows * 256).reshape(rows, 256)
+        p = counts / block_size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(p > 0, p * np.log2(p), 0.0)
+        entropies.extend((-terms.sum(axis=1)).tolist())
+
+    return entropies
+
+
+# Bytes de cada categoría de clase (\d, \s, \w) en patrones de bytes
+_CATEGORY_BYTES = {
+    sre_parse.CATEGORY_DIGIT: b'0123456789',
+    sre_parse.CATEGORY_SPACE: b' \t\n\r\x0b\x0c',
+    sre_parse.CATEGORY_WORD: b'0123456789_ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz',
+}
+
+
+def _add_alphabet(items, alphabet):
+    """Añadir a alphabet los bytes que puede consumir el patrón analizado items
+
+    Devuelve False si no se puede acotar ('.', clases negadas, lookarounds...)
+    o si depende de bytes vecinos (anclas como \\b o ^).
+    """
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            alphabet.add(av)
+        elif op is sre_parse.IN:
+            for item_op, item in av:
+                if item_op is sre_parse.LITERAL:
+                    alphabet.add(item)
+                elif item_op is sre_parse.RANGE:
+                    alphabet.update(range(item[0], item[1] + 1))
+                elif item_op is sre_parse.CATEGORY and item in _CATEGORY_BYTES:
+                    alphabet.update(_CATEGORY_BYTES[item])
+                else:
+                    return False
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT):
+            if not _add_alphabet(av[2], alphabet):
+                return False
+        elif op is sre_parse.SUBPATTERN:
+            if not _add_alphabet(av[3], alphabet):
+                return False
+        elif op is sre_parse.BRANCH:
+            if not all(_add_alphabet(branch, alphabet) for branch in av[1]):
+                return False
+        else:
+            return False
+    return True
+
+
+def prefilter_table(pattern):
+    """(tabla de 256 bytes con 1 en los que puede contener una coincidencia, longitud mínima)
+
+    Toda coincidencia de pattern cae dentro de una racha de bytes de la
+    tabla de al menos esa longitud. None si el patrón no se puede acotar
+    así (ver _add_alphabet) o admite coincidencias vacías.
+    """
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    alphabet = set()
+    if not _add_alphabet(parsed, alphabet):
+        return None
+    if pattern.flags & re.IGNORECASE:
+        alphabet.update(bytes(alphabet).swapcase())
+    min_width = parsed.getwidth()[0]
+    if min_width < 1:
+        return None
+    return bytes(1 if byte in alphabet else 0 for byte in range(256)), min_width
+
+
+def block_breakers(patterns, words):
+    """Tabla de 256 bytes: 1 para los bytes que ninguna coincidencia puede contener
+
+    Ni los patrones ni las palabras (en cualquier grafía) cruzan esos
+    bytes, así que los datos pueden cortarse tras ellos y escanearse por
+    partes con el mismo resultado. None si algún patrón no se puede acotar.
+    """
+    alphabet = set()
+    for pattern in patterns.values():
+        if not _add_alphabet(sre_parse.parse(pattern.pattern, pattern.flags), alphabet):
+            return None
+        if pattern.flags & re.IGNORECASE:
+            alphabet.update(bytes(alphabet).swapcase())
+    for word in words:
+        for variant in KeywordAutomaton._variants(word):
+            alphabet.update(variant)
+            alphabet.update(variant.upper())
+    return bytes(0 if byte in alphabet else 1 for byte in range(256))
+
+
+def split_ranges(data, parts, breakers, align_limit=PARALLEL_ALIGN_LIMIT):
+    """Dividir data en hasta parts rangos [inicio, fin) que terminan justo tras un byte de corte
+
+    Cada frontera nominal (len(data) * i / parts) se desplaza tras el primer
+    byte de corte (ver block_breakers) de los align_limit bytes siguientes;
+    si no hay ninguno, esa frontera se descarta y su rango se une al
+    siguiente. Con breakers=None (patrones sin acotar) se devuelve un solo
+    rango.
+    """
+    size = len(data)
+    if breakers is None or parts <= 1 or not any(breakers):
+        return [(0, size)]
+    finder = re.compile(b'[' + b''.join(re.escape(bytes([byte])) for byte in range(256) if breakers[byte]) + b']')
+    cuts = [0]
+    for i in range(1, parts):
+        nominal = max(size * i // parts, cuts[-1])
+        found = finder.search(data, nominal, min(nominal + align_limit, size))
+        if found is not None and found.end() < size:
+            cuts.append(found.end())
+    cuts.append(size)
+    return list(zip(cuts, cuts[1:]))
+
+
+# Bloques definidos por contenido de la deduplicación: tamaño mínimo,
+# tamaño a partir del cual se fuerza el corte y bits del hash gear que
+# deben ser cero para cortar (un corte cada ~16 KiB de bytes de corte)
+DEDUP_MIN_BLOCK = 8 * 1024
+DEDUP_MAX_BLOCK = 128 * 1024
+DEDUP_CUT_MASK = 0xFFFC0000
+
+# Resultados de bloque recordados por analizador (LRU)
+DEDUP_BLOCK_TABLE = 4096
+
+# Valor aleatorio fijo por byte del hash gear
+_GEAR = list(array('I', random.Random(0xD7C1B).randbytes(4 * 256)))
+
+
+def content_blocks(data, breakers, min_size=DEDUP_MIN_BLOCK, max_size=DEDUP_MAX_BLOCK,
+                   mask=DEDUP_CUT_MASK):
+    """Cortar data en bloques definidos por su contenido: [(inicio, fin), ...]
+
+    Hash gear de 32 bits (ventana de 32 bytes): se corta tras un byte de
+    corte (breakers, ver block_breakers) cuyo hash tiene a cero los bits de
+    mask, de modo que un mismo contenido produce los mismos bloques aunque
+    esté desplazado. Un bloque que supera max_size se corta en el primer
+    byte de corte siguiente; si no hay ninguno, sigue hasta el final.
+    """
+    size = len(data)
+    if size <= min_size:
+        return [(0, size)]
+
+    if np is not None:
+        values = np.frombuffer(data, dtype=np.uint8)
+        is_breaker = np.frombuffer(breakers, dtype=np.uint8)[values].astype(bool)
+        # h[i] = sum(gear[x[i-j]] << j, j < 32) mod 2**32, por duplicación de ventana
+        hashes = np.array(_GEAR, dtype=np.uint32)[values]
+        width = 1
+        while width < 32:
+            shifted = np.zeros_like(hashes)
+            shifted[width:] = hashes[:-width] << np.uint32(width)
+            hashes += shifted
+            width *= 2
+        cuts = (np.flatnonzero(is_breaker & ((hashes & np.uint32(mask)) == 0)) + 1).tolist()
+    else:
+        cuts = []
+        rolling = 0
+        for position, byte in enumerate(data):
+            rolling = ((rolling << 1) + _GEAR[byte]) & 0xFFFFFFFF
+            if breakers[byte] and not rolling & mask:
+                cuts.append(position + 1)
+
+    stop = re.compile(b'[' + b''.join(re.escape(bytes([byte])) for byte in range(256) if breakers[byte]) + b']') \
+        if any(breakers) else None
+
+    def forced(start):
+        match = stop.search(data, start + max_size) if stop is not None else None
+        return match.end() if match is not None else None
+
+    blocks = []
+    start = 0
+    for cut in cuts + [size]:
+        if cut <= start or (cut - start < min_size and cut < size):
+            continue
+        while cut - start > max_size:
+            end = forced(start)
+            if end is None or end >= cut:
+                break
+            blocks.append((start, end))
+            start = end
+        if cut - start >= min_size or cut == size:
+            blocks.append((start, cut))
+            start = cut
+    return blocks
+
+
+def compression_format(source):
+    """Formato de compresión de source ('gzip', 'bz2', 'xz', 'zip') según sus bytes mágicos, o None
+
+    source es una ruta o un archivo binario con seek, que se deja donde estaba.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            head = f.read(8)
+    else:
+        position = source.tell()
+        head = source.read(8)
+        source.seek(position)
+    for magic, name in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def zip_members(source):
+    """Miembros (archivos, no directorios) de un zip por orden natural de nombre"""
+    with zipfile.ZipFile(source) as archive:
+        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    return sorted(names, key=_natural_key)
+
+
+@contextlib.contextmanager
+def open_input(source, member=None):
+    """Archivo binario con el contenido descomprimido de source (ruta o archivo con seek)
+
+    gzip, bz2 y xz se descomprimen en flujo con la biblioteca estándar, así
+    que la memoria no depende del tamaño del archivo. De un zip se lee
+    member o, si no se indica, su único miembro (con varios, ValueError: ver
+    DTCAnalyzer.analyze_archive). Sin compresión se lee tal cual.
+    """
+    fmt = compression_format(source)
+    if fmt == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            if member is None:
+                members = [info.filename for info in archive.infolist() if not info.is_dir()]
+                if len(members) != 1:
+                    raise ValueError(f"el zip contiene {len(members)} miembros: "
+                                     f"analízalo con analyze_archive")
+                member = members[0]
+            with archive.open(member) as f:
+                yield f
+    elif fmt is not None:
+        opener = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}[fmt]
+        with opener(source, 'rb') as f:
+            yield f
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield f
+    else:
+        yield source
+
+
+def prefetched(iterable, depth=DEFAULT_PREFETCH):
+    """Iterar iterable desde un hilo que va hasta depth elementos por delante
+
+    El hilo consume iterable (lecturas de disco o descompresión, que
+    liberan el GIL) mientras el llamador procesa el elemento anterior; la
+    cola acotada a depth elementos frena al hilo si el llamador va más lento.
+    Las excepciones del hilo se relanzan en el llamador. Con depth <= 0 se
+    itera sin hilo. Cerrar el generador detiene el hilo.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((True, end))
+        except BaseException as e:
+            put((False, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                raise item
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _mean_interval(values, z, fpc=1.0):
+    """Media e intervalo normal (z) de values; fpc es la corrección por población finita"""
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, mean, mean
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    margin = z * math.sqrt(variance / n * fpc)
+    return mean, mean - margin, mean + margin
+
+
+def _wilson_interval(successes, n, z):
+    """Proporción e intervalo de Wilson (acotado a [0, 1] también con pocas muestras)"""
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return p, max(0.0, center - margin), min(1.0, center + margin)
+
+
+class KeywordAutomaton:
+    """Autómata de palabras sobre bytes, sin distinguir mayúsculas
+
+    Las palabras se guardan en un trie sobre su codificación UTF-8 en
+    minúsculas (con las variantes mayúscula/minúscula de los caracteres no
+    ASCII) y el trie se compila en una única expresión regular de bytes:
+    cada nodo final lleva un grupo vacío, de modo que una búsqueda en una
+    posición recorre la rama más profunda que coincide y `lastindex`
+    identifica todas las palabras que empiezan allí. Así todas las palabras
+    se buscan en una sola pasada en C sobre los datos sin decodificarlos;
+    basta con plegar las mayúsculas ASCII con fold().
+    """
+
+    def __init__(self, words):
+        self.words = list(words)
+        trie = {}
+        for index, word in enumerate(self.words):
+            for variant in self._variants(word):
+                node = trie
+                for byte in variant:
+                    node = node.setdefault(byte, {})
+                node.setdefault(None, []).append(index)
+
+        # terminals[grupo] = [(índices de palabra, longitud en bytes), ...]
+        # del nodo final y de todos sus antecesores finales
+        self.terminals = [None]
+        self.max_length = 0
+        source = self._compile_node(trie, 0, [])
+        self.regex = re.compile(source) if source else None
+
+    @staticmethod
+    def _variants(word):
+        """Codificaciones UTF-8 de word en minúsculas, con ambas grafías de los caracteres no ASCII"""
+        variants = [b'']
+        for char in word.lower():
+            options = {char} if char.isascii() else {char.lower(), char.upper()}
+            encoded = sorted({option.encode('utf-8').lower() for option in options})
+            variants = [prefix + piece for prefix in variants for piece in encoded]
+        return variants
+
+    def _compile_node(self, node, depth, path):
+        """Expresión regular del subárbol; los grupos se numeran en orden de aparición"""
+        mark = b''
+        if None in node:
+            path = path + [(tuple(node[None]), depth)]
+            self.terminals.append(path)
+            self.max_length = max(self.max_length, depth)
+            mark = b'()'
+
+        branches = [re.escape(bytes([byte])) + self._compile_node(child, depth + 1, path)
+                    for byte, child in sorted((k, v) for k, v in node.items() if k is not None)]
+        if not branches:
+            return mark
+        body = b'|'.join(branches)
+        if mark:
+            return mark + b'(?:' + body + b')?'
+        return body if len(branches) == 1 else b'(?:' + body + b')'
+
+    @staticmethod
+    def fold(data):
+        """Plegar mayúsculas ASCII (una copia del bloque, sin decodificar)"""
+        return (data if isinstance(data, bytes) else bytes(data)).lower()
+
+    def finditer(self, folded, start=0):
+        """(posición, [(índices de palabra, longitud), ...]) de cada posición con apariciones"""
+        if self.regex is None:
+            return
+        search = self.regex.search
+        terminals = self.terminals
+        match = search(folded, start)
+        while match is not None:
+            position = match.start()
+            yield position, terminals[match.lastindex]
+            match = search(folded, position + 1)
+
+
+class _FirstSampler:
+    """Muestra de las primeras k coincidencias"""
+
+    def __init__(self, k):
+        self.k = k
+        self.items = []
+        # Índice global de la próxima coincidencia que interesa (None = ninguna)
+        self.target = 0 if k > 0 else None
+
+    def offer(self, index, value):
+        self.items.append((index, value))
+        self.target = index + 1 if len(self.items) < self.k else None
+
+    def replace(self, index, value):
+        self.items = [(i, value if i == index else v) for i, v in self.items]
+
+    def state(self):
+        return list(self.items), self.target
+
+    def restore(self, state):
+        self.items, self.target = list(state[0]), state[1]
+
+    def values(self):
+        return [value for _, value in self.items]
+
+
+class _ReservoirSampler(_FirstSampler):
+    """Muestreo de reservorio (algoritmo L) de k coincidencias
+
+    Tras llenar el reservorio calcula directamente cuántas coincidencias
+    saltar hasta la siguiente que entra, así que solo O(k log(n/k))
+    coincidencias se examinan desde Python.
+    """
+
+    def __init__(self, k, rng):
+        super().__init__(k)
+        self.rng = rng
+        self.w = 1.0
+
+    def _uniform(self):
+        u = self.rng.random()
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def _next_target(self, index):
+        self.w *= math.exp(math.log(self._uniform()) / self.k)
+        if self.w >= 1.0:
+            return index + 1
+        return index + 1 + int(math.floor(math.log(self._uniform()) / math.log1p(-self.w)))
+
+    def offer(self, index, value):
+        if len(self.items) < self.k:
+            self.items.append((index, value))
+            self.target = index + 1 if len(self.items) < self.k else self._next_target(index)
+        else:
+            self.items[self.rng.randrange(self.k)] = (index, value)
+            self.target = self._next_target(index)
+
+    def state(self):
+        return list(self.items), self.target, self.w, self.rng.getstate()
+
+    def restore(self, state):
+        self.items, self.target, self.w = list(state[0]), state[1], state[2]
+        self.rng.setstate(state[3])
+
+    def values(self):
+        # Orden de aparición en el archivo
+        return [value for _, value in sorted(self.items, key=lambda item: item[0])]
+
+
+def _mb_per_s(nbytes, seconds):
+    return nbytes / (1024 * 1024) / seconds if seconds > 0 else 0.0
+
+
+class ScanMetrics:
+    """Instrumentación opcional del escaneo
+
+    Acumula por etapa (lectura, regex, decodificación UTF-8, palabras clave,
+    instituciones, histograma) y por patrón el tiempo de pared, los bytes
+    procesados y las coincidencias. Con metrics=None el escáner no consulta
+    el reloj, así que desactivada no añade coste.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.patterns = {}
+
+    def add_stage(self, stage, seconds, nbytes=0, calls=1):
+        entry = self.stages.setdefault(stage, {'seconds': 0.0, 'bytes': 0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['bytes'] += nbytes
+        entry['calls'] += calls
+
+    def lap(self, stage, started, nbytes=0):
+        """Registrar la etapa iniciada en started y devolver el instante actual"""
+        now = time.perf_counter()
+        self.add_stage(stage, now - started, nbytes)
+        return now
+
+    def add_pattern(self, name, seconds, nbytes, matches):
+        entry = self.patterns.setdefault(name, {'seconds': 0.0, 'bytes': 0, 'matches': 0})
+        entry['seconds'] += seconds
+        entry['bytes'] += nbytes
+        entry['matches'] += matches
+
+    def merge(self, metrics):
+        """Sumar las métricas de otro resultado (dict de as_dict)"""
+        for stage, entry in metrics['stages'].items():
+            self.add_stage(stage, entry['seconds'], entry['bytes'], entry['calls'])
+        for name, entry in metrics['patterns'].items():
+            self.add_pattern(name, entry['seconds'], entry['bytes'], entry['matches'])
+
+    def as_dict(self, seconds, nbytes):
+        """Métricas serializables con el rendimiento (MB/s) de cada etapa"""
+        return {
+            'seconds': seconds,
+            'bytes': nbytes,
+            'mb_per_s': _mb_per_s(nbytes, seconds),
+            'stages': {stage: dict(entry, mb_per_s=_mb_per_s(entry['bytes'], entry['seconds']))
+                       for stage, entry in self.stages.items()},
+            'patterns': {name: dict(entry, mb_per_s=_mb_per_s(entry['bytes'], entry['seconds']))
+                         for name, entry in self.patterns.items()}
+        }
+
+
+def _pack_counters(values, typecode):
+    """array de contadores -> texto base64 (little-endian y comprimido)"""
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(zlib.compress(values.tobytes())).decode('ascii')
+
+
+def _unpack_counters(text, typecode):
+    """Inversa de _pack_counters"""
+    values = array(typecode, zlib.decompress(base64.b64decode(text)))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class PatternSketch:
+    """Resumen combinable de los valores de un patrón
+
+    HyperLogLog estima cuántos valores distintos hay, Count-Min la
+    frecuencia de un valor y Misra-Gries conserva los candidatos más
+    frecuentes. Los tres se combinan con merge() sin volver a leer los
+    datos (máximo por registro, suma de contadores y fusión de candidatos),
+    así que los sketches de cada chunk se agregan entre procesos y entre
+    ejecuciones (caché, NDJSON). La memoria es fija: unos 2 KB de registros,
+    32 KB de contadores y SKETCH_CANDIDATES valores.
+    """
+
+    __slots__ = ('total', 'registers', 'counters', 'candidates')
+
+    def __init__(self, total=0, registers=None, counters=None, candidates=None):
+        self.total = total
+        self.registers = registers if registers is not None else bytearray(1 << SKETCH_PRECISION)
+        self.counters = counters if counters is not None else array('q', bytes(8 * SKETCH_DEPTH * SKETCH_WIDTH))
+        self.candidates = candidates if candidates is not None else {}
+
+    @staticmethod
+    def _hash(value):
+        """(índice de registro, rango, filas de Count-Min) de un valor"""
+        digest = hashlib.blake2b(value, digest_size=16).digest()
+        low = int.from_bytes(digest[:8], 'little')
+        rest = low >> SKETCH_PRECISION
+        rank = 64 - SKETCH_PRECISION - rest.bit_length() + 1
+        high = int.from_bytes(digest[8:], 'little')
+        columns = [row * SKETCH_WIDTH + (high >> (16 * row)) % SKETCH_WIDTH for row in range(SKETCH_DEPTH)]
+        return low & ((1 << SKETCH_PRECISION) - 1), rank, columns
+
+    def add(self, value, count=1):
+        """Contar count apariciones de value (bytes)"""
+        index, rank, columns = self._hash(value)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+        counters = self.counters
+        for column in columns:
+            counters[column] += count
+        self.total += count
+
+        # Misra-Gries: sin hueco, restar a todos el menor de los contadores
+        candidates = self.candidates
+        key = value.decode('utf-8', errors='ignore')
+        candidates[key] = candidates.get(key, 0) + count
+        if len(candidates) > SKETCH_CANDIDATES:
+            cut = min(candidates.values())
+            for other in list(candidates):
+                candidates[other] -= cut
+                if not candidates[other]:
+                    del candidates[other]
+
+    def merge(self, other):
+        """Acumular otro sketch en este y devolverlo"""
+        self.total += other.total
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        if np is not None:
+            counters = np.frombuffer(self.counters, dtype=np.int64) + np.frombuffer(other.counters, dtype=np.int64)
+            self.counters = array('q', counters.tobytes())
+        else:
+            self.counters = array('q', map(int.__add__, self.counters, other.counters))
+
+        # Fusión de resúmenes Misra-Gries: sumar y restar el contador que
+        # queda fuera de los SKETCH_CANDIDATES mayores
+        candidates = Counter(self.candidates)
+        candidates.update(other.candidates)
+        if len(candidates) > SKETCH_CANDIDATES:
+            cut = sorted(candidates.values(), reverse=True)[SKETCH_CANDIDATES]
+            candidates = {key: count - cut for key, count in candidates.items() if count > cut}
+        self.candidates = dict(candidates)
+        return self
+
+    def estimate(self, value):
+        """Frecuencia estimada de value (cota superior de Count-Min)"""
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        _, _, columns = self._hash(value)
+        return min(self.counters[column] for column in columns)
+
+    def distinct(self):
+        """Número estimado de valores distintos"""
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Pocos valores: conteo lineal de registros vacíos
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def top(self, limit=SKETCH_TOP):
+        """[(valor, frecuencia estimada)] de los candidatos más frecuentes"""
+        ranked = sorted(((key, self.estimate(key)) for key in self.candidates),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def summary(self, limit=SKETCH_TOP):
+        """Forma del resumen de analyze_all_chunks"""
+        return {'values': self.total, 'distinct': self.distinct(),
+                'top': [[key, count] for key, count in self.top(limit)]}
+
+    def to_dict(self):
+        """Forma serializable en JSON (caché y NDJSON)"""
+        return {'total': self.total,
+                'hll': _pack_counters(self.registers, 'B'),
+                'cm': _pack_counters(self.counters, 'q'),
+                'candidates': self.candidates}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['total'], bytearray(_unpack_counters(data['hll'], 'B')),
+                   _unpack_counters(data['cm'], 'q'), dict(data['candidates']))
+
+
+def _merge_sketches(total, sketches):
+    """Acumular {patrón: PatternSketch} en total sin modificar los de entrada"""
+    for name, sketch in sketches.items():
+        total.setdefault(name, PatternSketch()).merge(sketch)
+
+
+def _country_table(codes):
+    """Tabla de 26*26 booleanos indexada por las dos letras de un código de país"""
+    table = bytearray(26 * 26)
+    for code in codes.split():
+        table[(ord(code[0]) - 65) * 26 + ord(code[1]) - 65] = 1
+    return bytes(table)
+
+
+_COUNTRIES = _country_table(ISO_COUNTRY_CODES)
+
+
+def _char_matrix(values, width, fill, right=False):
+    """Valores (bytes) como matriz uint8 de len(values) x width, rellenos con fill"""
+    pad = bytes.rjust if right else bytes.ljust
+    joined = b''.join(pad(value[:width], width, fill) for value in values)
+    return np.frombuffer(joined, dtype=np.uint8).reshape(len(values), width)
+
+
+def _country_ok(value, position):
+    first, second = value[position] - 65, value[position + 1] - 65
+    return 0 <= first < 26 and 0 <= second < 26 and _COUNTRIES[first * 26 + second] == 1
+
+
+def _iban_ok(value):
+    """Longitud, país y dígitos de control (mod 97) de un IBAN"""
+    if not IBAN_MIN_LENGTH <= len(value) <= IBAN_MAX_LENGTH or not _country_ok(value, 0):
+        return False
+    remainder = 0
+    for byte in value[4:] + value[:4]:
+        if 48 <= byte <= 57:
+            remainder = (remainder * 10 + byte - 48) % 97
+        else:
+            remainder = (remainder * 100 + byte - 55) % 97
+    return remainder == 1
+
+
+def _luhn_ok(value):
+    """Dígito de control Luhn de un número de cuenta"""
+    total = 0
+    for position, byte in enumerate(reversed(value)):
+        digit = byte - 48
+        if position % 2:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        total += digit
+    return total % 10 == 0
+
+
+def _swift_ok(value):
+    """Código de país (posiciones 5-6) de un BIC"""
+    return len(value) >= 6 and _country_ok(value, 4)
+
+
+def _iban_batch(values):
+    matrix = _char_matrix([value[4:] + value[:4] for value in values], IBAN_MAX_LENGTH, b'\0')
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    remainder = np.zeros(len(values), dtype=np.int64)
+    # Una columna por carácter: dígitos ×10, letras (A=10 ... Z=35) ×100, relleno sin cambio
+    for column in matrix.T.astype(np.int64):
+        digit = (column >= 48) & (column <= 57)
+        letter = column >= 65
+        remainder = np.where(digit, (remainder * 10 + column - 48) % 97,
+                             np.where(letter, (remainder * 100 + column - 55) % 97, remainder))
+    return (remainder == 1) & _countries_batch(values, 0) \
+        & (lengths >= IBAN_MIN_LENGTH) & (lengths <= IBAN_MAX_LENGTH)
+
+
+def _luhn_batch(values):
+    width = max(map(len, values))
+    # Alineados a la derecha: los ceros de relleno no cambian la suma
+    digits = _char_matrix(values, width, b'0', right=True)[:, ::-1].astype(np.int64) - 48
+    doubled = digits[:, 1::2] * 2
+    total = digits[:, ::2].sum(axis=1) + (doubled - 9 * (doubled > 9)).sum(axis=1)
+    return total % 10 == 0
+
+
+def _countries_batch(values, position):
+    country = _char_matrix(values, position + 2, b'\0')[:, position:].astype(np.int64) - 65
+    inside = ((country >= 0) & (country < 26)).all(axis=1)
+    index = np.clip(country[:, 0] * 26 + country[:, 1], 0, 26 * 26 - 1)
+    return inside & (np.frombuffer(_COUNTRIES, dtype=np.uint8)[index] == 1)
+
+
+def _swift_batch(values):
+    return _countries_batch(values, 4)
+
+
+# Comprobación de cada tipo: (una coincidencia, lote NumPy)
+_CHECKS = {
+    'iban': (_iban_ok, _iban_batch),
+    'luhn': (_luhn_ok, _luhn_batch),
+    'swift': (_swift_ok, _swift_batch),
+}
+
+
+def validate_values(check, values):
+    """Lista de booleanos: qué valores (bytes) superan la comprobación check
+
+    check es una de las de VALIDATED_PATTERNS ('iban', 'luhn', 'swift').
+    Con NumPy el lote se comprueba columna a columna sobre una matriz de
+    bytes; sin NumPy, valor a valor en Python puro, con el mismo resultado.
+    """
+    single, batch = _CHECKS[check]
+    if np is None or len(values) < VALIDATION_MIN_BATCH:
+        return [single(value) for value in values]
+    return batch(values).tolist()
+
+
+def _merge_validation(total, validation):
+    """Acumular {patrón: {'valid', 'invalid'}} en total"""
+    for name, counts in validation.items():
+        entry = total.setdefault(name, {'valid': 0, 'invalid': 0})
+        entry['valid'] += counts['valid']
+        entry['invalid'] += counts['invalid']
+
+
+class ResultLayout:
+    """Orden fijo de patrones y palabras clave: el id de cada uno es su posición
+
+    Se comparte entre todos los ChunkResult de un analizador, también tras
+    pasar por pickle (ver result_layout).
+    """
+
+    __slots__ = ('patterns', 'keywords', 'pattern_ids')
+
+    def __init__(self, patterns, keywords):
+        self.patterns = tuple(patterns)
+        self.keywords = tuple(keywords)
+        self.pattern_ids = {name: index for index, name in enumerate(self.patterns)}
+
+    def __reduce__(self):
+        return result_layout, (self.patterns, self.keywords)
+
+
+_LAYOUTS = {}
+
+
+def result_layout(patterns, keywords):
+    """ResultLayout compartido para estos patrones y palabras clave"""
+    key = (tuple(patterns), tuple(keywords))
+    layout = _LAYOUTS.get(key)
+    if layout is None:
+        layout = _LAYOUTS[key] = ResultLayout(*key)
+    return layout
+
+
+# (clave en structured_data, patrón, número de muestras)
+STRUCTURED_SAMPLES = (
+    ('bank_codes', 'bank_codes', 10),
+    ('account_numbers', 'account_numbers', 10),
+    ('swift_codes', 'swift_codes', 5),
+    ('currency_amounts', 'currency_patterns', 5),
+)
+
+
+class ChunkResult:
+    """Resultado compacto de un chunk
+
+    Los contadores por patrón y por palabra clave son arrays indexados por
+    el id del ResultLayout y las muestras una tupla por patrón, en lugar de
+    diccionarios anidados con claves de texto. to_dict() y from_dict()
+    convierten a y desde la forma de analyze_patterns/extract_structured_data
+    que usan el reporte, la caché y la salida NDJSON.
+    """
+
+    __slots__ = ('layout', 'chunk_number', 'filename', 'file_size', 'counts', 'samples',
+                 'keyword_counts', 'institutions', 'head', 'tail', 'entropy', 'metrics', 'dedup',
+                 'records', 'sketches', 'validation')
+
+    def __init__(self, layout, chunk_number, filename, file_size, counts, samples,
+                 keyword_counts, institutions, head, tail, entropy, metrics=None, dedup=None,
+                 records=None, sketches=None, validation=None):
+        self.layout = layout
+        self.chunk_number = chunk_number
+        self.filename = filename
+        self.file_size = file_size
+        self.counts = counts                  # array('q') por id de patrón
+        self.samples = samples                # tupla de muestras (str) por id de patrón
+        self.keyword_counts = keyword_counts  # array('q') por id de palabra clave
+        self.institutions = institutions
+        self.head = head
+        self.tail = tail
+        self.entropy = entropy
+        self.metrics = metrics
+        # Bloques y bytes escaneados con deduplicación de bloques (solo de esta ejecución)
+        self.dedup = dedup
+        # Registros de formato conocido (ver DTCAnalyzer.parse_records) o None
+        self.records = records
+        # {patrón: PatternSketch} si el analizador se creó con sketches=True
+        self.sketches = sketches
+        # {patrón: {'valid', 'invalid'}} si el analizador se creó con validate=True
+        self.validation = validation
+
+    def relabel(self, chunk_number, filename):
+        """El mismo resultado para otro chunk de idéntico contenido"""
+        return ChunkResult(self.layout, chunk_number, filename, self.file_size, self.counts,
+                           self.samples, self.keyword_counts, self.institutions, self.head,
+                           self.tail, self.entropy, records=self.records, sketches=self.sketches,
+                           validation=self.validation)
+
+    def pattern_counts(self):
+        """Contadores distintos de cero por nombre de patrón"""
+        return {name: count for name, count in zip(self.layout.patterns, self.counts) if count}
+
+    def analysis_dict(self):
+        """Forma de analyze_patterns"""
+        patterns_found = {}
+        for name, count, samples in zip(self.layout.patterns, self.counts, self.samples):
+            if count:
+                patterns_found[name] = {
+                    'count': count,
+                    'samples': [sample[:50] for sample in samples[:5]]
+                }
+
+        results = {
+            'filename': self.filename,
+            'file_size': self.file_size,
+            'patterns_found': patterns_found,
+            'potential_data': {}
+        }
+        found_keywords = {keyword: count for keyword, count in zip(self.layout.keywords, self.keyword_counts)
+                          if count}
+        if found_keywords:
+            results['potential_data']['financial_keywords'] = found_keywords
+        return results
+
+    def structured_dict(self):
+        """Forma de extract_structured_data"""
+        ids = self.layout.pattern_ids
+        structured = {key: list(self.samples[ids[name]][:limit]) for key, name, limit in STRUCTURED_SAMPLES}
+        if self.records is not None:
+            # Los campos decodificados de un formato conocido sustituyen a las
+            # muestras de las expresiones regulares
+            limits = {key: limit for key, _, limit in STRUCTURED_SAMPLES}
+            for key, values in self.records['fields'].items():
+                structured[key] = list(values[:limits[key]])
+        structured['institutions'] = list(self.institutions)
+        structured['metadata'] = {
+            'file_size': self.file_size,
+            'first_bytes': binascii.hexlify(self.head).decode(),
+            'last_bytes': binascii.hexlify(self.tail).decode(),
+            'entropy_score': self.entropy
+        }
+        if self.records is not None:
+            structured['records'] = {'formats': list(self.records['formats']),
+                                     'count': self.records['count'],
+                                     'fields': list(self.records['fields'])}
+        if self.validation is not None:
+            structured['validation'] = {name: dict(counts) for name, counts in self.validation.items()}
+        return structured
+
+    def to_dict(self):
+        """Forma de analyze_chunk (la de la caché, el NDJSON y el reporte)"""
+        result = {
+            'chunk_number': self.chunk_number,
+            'analysis': self.analysis_dict(),
+            'structured_data': self.structured_dict()
+        }
+        if self.metrics is not None:
+            result['metrics'] = self.metrics
+        if self.sketches is not None:
+            result['sketches'] = {name: sketch.to_dict() for name, sketch in self.sketches.items()}
+        return result
+
+    @classmethod
+    def from_dict(cls, result, layout):
+        """Reconstruir un ChunkResult a partir de to_dict()"""
+        analysis = result['analysis']
+        structured = result['structured_data']
+        counts = array('q', bytes(8 * len(layout.patterns)))
+        samples = [()] * len(layout.patterns)
+        for name, found in analysis['patterns_found'].items():
+            counts[layout.pattern_ids[name]] = found['count']
+            samples[layout.pattern_ids[name]] = tuple(found['samples'])
+        records = structured.get('records')
+        decoded = records['fields'] if records is not None else ()
+        # Las muestras completas de extract_structured_data sustituyen a las
+        # recortadas, salvo en los campos que vienen de registros decodificados
+        for key, name, _ in STRUCTURED_SAMPLES:
+            if structured[key] and key not in decoded:
+                samples[layout.pattern_ids[name]] = tuple(structured[key])
+        if records is not None:
+            records = {'formats': tuple(records['formats']), 'count': records['count'],
+                       'fields': {key: tuple(structured[key]) for key in decoded}}
+
+        sketches = result.get('sketches')
+        if sketches is not None:
+            sketches = {name: PatternSketch.from_dict(sketch) for name, sketch in sketches.items()}
+
+        keywords = analysis['potential_data'].get('financial_keywords', {})
+        metadata = structured['metadata']
+        return cls(layout, result['chunk_number'], analysis['filename'], analysis['file_size'],
+                   counts, tuple(samples), array('q', [keywords.get(k, 0) for k in layout.keywords]),
+                   tuple(structured['institutions']), bytes.fromhex(metadata['first_bytes']),
+                   bytes.fromhex(metadata['last_bytes']), metadata['entropy_score'],
+                   result.get('metrics'), records=records, sketches=sketches,
+                   validation=structured.get('validation'))
+
+
+class RecordField:
+    """Campo de un registro de ancho fijo
+
+    fmt es un código de struct ('6s', 'Q', '117x' para relleno). Los campos
+    con target alimentan esa clave de extract_structured_data; check, si se
+    indica, es una expresión regular que el valor debe cumplir entero.
+    """
+
+    __slots__ = ('name', 'fmt', 'target', 'check')
+
+    def __init__(self, name, fmt, target=None, check=None):
+        self.name = name
+        self.fmt = fmt
+        self.target = target
+        self.check = re.compile(check) if check is not None else None
+
+
+class RecordLayout:
+    """Formato declarativo de registros DTC1B de ancho fijo
+
+    Los campos se decodifican con un único struct.Struct sobre un
+    memoryview, sin copiar los datos: una cabecera (count=1) con
+    unpack_from y una serie de registros consecutivos con iter_unpack, que
+    termina en el primer registro cuyos campos no cumplen su check. Con
+    magic solo se aplica a datos que empiezan por esos bytes. derived
+    añade valores calculados a partir del registro: {target: función(campos)}.
+    """
+
+    def __init__(self, name, byte_order, fields, magic=None, offset=0, count=None, derived=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.magic = magic
+        self.offset = offset
+        self.count = count
+        self.derived = derived or {}
+        self.struct = struct.Struct(byte_order + ''.join(field.fmt for field in self.fields))
+        # Los campos de relleno no producen valor en el struct
+        self.values = tuple(field for field in self.fields if not field.fmt.endswith('x'))
+
+    def decode(self, values):
+        """Campos de un registro ({nombre: valor}) o None si alguno no es válido"""
+        record = {}
+        for field, value in zip(self.values, values):
+            if isinstance(value, bytes):
+                if field.check is not None and not field.check.fullmatch(value):
+                    return None
+                value = value.rstrip(b'\x00 ').decode('ascii', errors='ignore')
+            record[field.name] = value
+        return record
+
+    def iter_records(self, view):
+        """Registros válidos decodificados a partir de offset"""
+        if self.magic is not None and view[:len(self.magic)] != self.magic:
+            return
+        size = self.struct.size
+        available = max(len(view) - self.offset, 0) // size
+        count = available if self.count is None else min(self.count, available)
+        if count == 1:
+            rows = (self.struct.unpack_from(view, self.offset),)
+        else:
+            rows = self.struct.iter_unpack(view[self.offset:self.offset + count * size])
+        for values in rows:
+            record = self.decode(values)
+            if record is None:
+                break
+            yield record
+
+    def targets(self, record):
+        """(clave de extract_structured_data, valor) de un registro decodificado"""
+        for field in self.values:
+            if field.target is not None:
+                yield field.target, record[field.name]
+        for target, derive in self.derived.items():
+            yield target, derive(record)
+
+
+# Formatos conocidos: la cabecera DTC1B (ver crear_archivo_prueba) y los
+# registros de saldo de 128 bytes (divisa + importe en céntimos big-endian)
+DTC1B_RECORD_LAYOUTS = (
+    RecordLayout('dtc1b_header', '<', (
+        RecordField('magic', '5s'),
+        RecordField('bank_code_1', '6s', 'bank_codes', rb'[A-Z]{6}'),
+        RecordField('bank_code_2', '6s', 'bank_codes', rb'[A-Z]{6}'),
+        RecordField('account_1', '16s', 'account_numbers', rb'\d{16}'),
+        RecordField('account_2', '16s', 'account_numbers', rb'\d{16}'),
+        RecordField('swift_1', '8s', 'swift_codes', rb'[A-Z]{6}[A-Z0-9]{2}'),
+        RecordField('swift_2', '8s', 'swift_codes', rb'[A-Z]{6}[A-Z0-9]{2}'),
+    ), magic=b'DTC1B', count=1),
+    RecordLayout('balance_records', '>', (
+        RecordField('currency', '3s', check=rb'USD|EUR|GBP'),
+        RecordField('amount', 'Q'),
+        RecordField(None, '117x'),
+    ), derived={'currency_amounts': lambda r: f"{r['currency']}: {r['amount'] // 100}.{r['amount'] % 100:02d}"}),
+)
+
+
+class RecordDecoder:
+    """Decodificación incremental de formatos de registro sobre datos por trozos
+
+    feed() recibe los bytes en orden y decodifica los registros completos
+    de cada formato; solo se guarda la cola que aún no forma un registro, así
+    que la memoria no depende del tamaño de los datos (sirve para flujos
+    descomprimidos). result() devuelve lo mismo que DTCAnalyzer.parse_records
+    sobre los datos completos.
+    """
+
+    def __init__(self, layouts):
+        self.layouts = list(layouts)
+        self.limits = {key: limit for key, _, limit in STRUCTURED_SAMPLES}
+        self.next = [layout.offset for layout in self.layouts]
+        self.found = [0] * len(self.layouts)
+        self.active = [True] * len(self.layouts)
+        # Primeros valores distintos por formato; con 2 * límite hay
+        # suficientes para combinarlos en orden de formato (ver result)
+        self.values = [{} for _ in self.layouts]
+        self.pending = b''
+        self.base = 0
+
+    def feed(self, data):
+        """Decodificar los registros completos disponibles tras añadir data"""
+        if self.pending:
+            data = self.pending + bytes(data)
+        end = self.base + len(data)
+        with memoryview(data) as view:
+            for index, layout in enumerate(self.layouts):
+                if self.active[index]:
+                    self._decode(index, layout, view, end)
+
+            # Conservar desde el primer byte que algún formato aún necesita
+            keep = end
+            for index, layout in enumerate(self.layouts):
+                if self.active[index]:
+                    keep = min(keep, 0 if layout.magic is not None and not self.found[index]
+                               else self.next[index])
+            self.pending = bytes(view[max(keep, self.base) - self.base:])
+        self.base = max(keep, self.base)
+
+    def _decode(self, index, layout, view, end):
+        if layout.magic is not None and not self.found[index]:
+            if end < len(layout.magic):
+                return
+            if self.base > 0 or view[:len(layout.magic)] != layout.magic:
+                self.active[index] = False
+                return
+
+        size = layout.struct.size
+        start = self.next[index]
+        available = max(end - start, 0) // size
+        if layout.count is not None:
+            available = min(available, layout.count - self.found[index])
+        values = self.values[index]
+        offset = start - self.base
+        for row in layout.struct.iter_unpack(view[offset:offset + available * size]):
+            record = layout.decode(row)
+            if record is None:
+                self.active[index] = False
+                return
+            self.found[index] += 1
+            self.next[index] += size
+            for target, value in layout.targets(record):
+                seen = values.setdefault(target, [])
+                if len(seen) < 2 * self.limits[target] and value not in seen:
+                    seen.append(value)
+        if layout.count is not None and self.found[index] >= layout.count:
+            self.active[index] = False
+
+    def result(self):
+        """{'formats', 'count', 'fields'} como parse_records, o None si ningún formato coincide"""
+        formats = [layout.name for layout, found in zip(self.layouts, self.found) if found]
+        if not formats:
+            return None
+        fields = {}
+        for layout_values in self.values:
+            for target, values in layout_values.items():
+                merged = fields.setdefault(target, [])
+                for value in values:
+                    if len(merged) < self.limits[target] and value not in merged:
+                        merged.append(value)
+        return {'formats': tuple(formats), 'count': sum(self.found),
+                'fields': {key: tuple(values) for key, values in fields.items()}}
+
+
+class PatternScanner:
+    """Motor de escaneo de una sola pasada sobre un archivo DTC1B
+
+    Recorre los datos una vez, bloque a bloque, ejecutando todos los patrones
+    sobre cada bloque mientras está en caché y etiquetando cada coincidencia
+    con el nombre de su patrón. El mismo resultado alimenta analyze_patterns y
+    extract_structured_data.
+
+    Cada bloque se escanea como buffer = arrastre + bytes nuevos. Solo se
+    aceptan las coincidencias que empiezan en la región propia del bloque
+    (todo menos los últimos `overlap` bytes), así que ninguna coincidencia se
+    cuenta dos veces. Una coincidencia que toca el final del buffer se aplaza
+    al bloque siguiente (o, con los datos completos en memoria, se resuelve
+    sobre ellos) para no perder su continuación. Por eso overlap debe ser al
+    menos min_overlap(patrones) (34 bytes con los patrones por defecto, por
+    los IBAN); con menos se perderían coincidencias en las fronteras.
+
+    Por patrón solo se guardan el contador y una muestra de tamaño fijo
+    (las primeras coincidencias o, con sampling='reservoir', una muestra
+    uniforme), así que la memoria no crece con el número de coincidencias.
+    """
+
+    # Muestras por patrón por defecto
+    SAMPLE_LIMIT = 10
+
+    def __init__(self, analyzer, window_size, overlap, sample_limit=SAMPLE_LIMIT, on_match=None,
+                 metrics=None, progress=None, on_keyword=None, records=False):
+        if window_size <= 0:
+            raise ValueError("window_size debe ser positivo")
+        required = analyzer.min_overlap()
+        if overlap < required:
+            raise ValueError(f"overlap debe ser al menos {required} bytes "
+                             f"(la coincidencia acotada más larga)")
+
+        self.analyzer = analyzer
+        self.patterns = analyzer.patterns
+        self.keywords = analyzer.financial_keywords
+        self.institutions = analyzer.institutions
+        self.automaton = analyzer.keyword_automaton()
+        self.window_size = window_size
+        self.overlap = overlap
+        self.max_pending = window_size + overlap
+        self.sample_limit = sample_limit
+        self.on_match = on_match
+        self.on_keyword = on_keyword
+        self.metrics = metrics
+        self.progress = progress
+
+        # Prefiltro: tabla de bytes y longitud mínima por patrón
+        self.prefilter = analyzer.prefilter_tables() if analyzer.prefilter else {}
+        self._runs = {}
+
+        self.resume = {name: 0 for name in self.patterns}
+        self.counts = {name: 0 for name in self.patterns}
+        self.samplers = {name: analyzer._make_sampler(name, sample_limit) for name in self.patterns}
+        self.sketches = {name: PatternSketch() for name in self.patterns} if analyzer.sketches else None
+        # Con validate=True las coincidencias de VALIDATED_PATTERNS se
+        # comprueban por lotes y solo las válidas se muestrean y se entregan
+        self.checks = {name: VALIDATED_PATTERNS[name] for name in self.patterns
+                       if name in VALIDATED_PATTERNS} if analyzer.validate else {}
+        self.valid_counts = {name: 0 for name in self.checks}
+        self.valid_samplers = {name: analyzer._make_sampler(name, sample_limit) for name in self.checks}
+        # Con records=True los registros de formato conocido se decodifican
+        # sobre los mismos bytes (para flujos que no se pueden releer)
+        self.record_decoder = RecordDecoder(analyzer.record_layouts) if records else None
+
+        # Palabras clave e instituciones: un solo autómata sobre los bytes,
+        # con un arrastre de cola para las apariciones partidas entre bloques
+        self.keyword_carry_len = max(self.automaton.max_length - 1, 0)
+        self.keyword_carry = b''
+        self.keyword_base = 0
+        word_count = len(self.automaton.words)
+        self.keyword_counts = [0] * word_count
+        self.keyword_next = [0] * word_count
+        self.institutions_found = set()
+
+        self.byte_counts = None
+        self.consumed = 0
+        self.head = b''
+        self.tail = b''
+
+    def scan_fileobj(self, f):
+        """Recorrer un archivo abierto ventana a ventana
+
+        Las ventanas siguientes se leen en un hilo mientras se escanea la
+        actual (hasta analyzer.prefetch por delante, ver prefetched); con
+        métricas, 'read' mide entonces solo la espera por el disco.
+        """
+        self.finish(*self.scan_windows(f))
+
+    def scan_windows(self, f, carry=b'', buf_start=0):
+        """Escanear las ventanas de f sin cerrar el recorrido: devuelve (arrastre, su offset)
+
+        El arrastre son los bytes aún no resueltos (región de solape y
+        coincidencias aplazadas); finish() los procesa como final de los
+        datos, o se pasan a una llamada posterior si los datos continúan
+        (ver checkpoint).
+        """
+        metrics = self.metrics
+        windows = prefetched(iter(functools.partial(f.read, self.window_size), b''),
+                             self.analyzer.prefetch)
+        try:
+            while True:
+                if metrics is not None:
+                    started = time.perf_counter()
+                chunk = next(windows, b'')
+                if metrics is not None:
+                    metrics.lap('read', started, len(chunk))
+                if not chunk:
+                    break
+                buffer = carry + chunk if carry else chunk
+                next_start = self._scan_buffer(buffer, buf_start, eof=False)
+                carry = buffer[next_start - buf_start:]
+                buf_start = next_start
+        finally:
+            windows.close()
+        return carry, buf_start
+
+    def finish(self, carry, buf_start):
+        """Procesar el arrastre como final de los datos"""
+        self._scan_buffer(carry, buf_start, eof=True)
+
+    # Estado del recorrido que guarda checkpoint(); el resto es configuración
+    _CHECKPOINT_FIELDS = ('resume', 'counts', 'samplers', 'sketches', 'valid_counts', 'valid_samplers',
+                          'keyword_carry', 'keyword_base', 'keyword_counts', 'keyword_next',
+                          'institutions_found', 'byte_counts', 'consumed', 'head', 'tail')
+    _DECODER_FIELDS = ('next', 'found', 'active', 'values', 'pending', 'base')
+
+    def checkpoint(self, carry, buf_start):
+        """Estado serializado tras scan_windows, para continuar más tarde con restore()"""
+        state = {field: getattr(self, field) for field in self._CHECKPOINT_FIELDS}
+        if self.record_decoder is not None:
+            state['record_decoder'] = {field: getattr(self.record_decoder, field)
+                                       for field in self._DECODER_FIELDS}
+        state['carry'] = bytes(carry)
+        state['buf_start'] = buf_start
+        return pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, checkpoint):
+        """Recuperar el estado de checkpoint(); devuelve (arrastre, su offset) para scan_windows"""
+        state = pickle.loads(checkpoint)
+        for field in self._CHECKPOINT_FIELDS:
+            setattr(self, field, state[field])
+        if self.record_decoder is not None and 'record_decoder' in state:
+            for field, value in state['record_decoder'].items():
+                setattr(self.record_decoder, field, value)
+        return state['carry'], state['buf_start']
+
+    def scan_buffer(self, data):
+        """Recorrer datos ya cargados en memoria por bloques, sin copiarlos"""
+        view = memoryview(data)
+        size = len(view)
+        buf_start = 0
+        read_end = 0
+
+        while True:
+            read_end = min(read_end + self.window_size, size)
+            eof = read_end >= size
+            next_start = self._scan_buffer(view[buf_start:read_end], buf_start, eof, full=view)
+            if eof:
+                break
+            buf_start = next_start
+
+    def _scan_buffer(self, buffer, buf_start, eof, full=None):
+        """Escanear un buffer y devolver el offset absoluto desde el que arrastrar"""
+        size = len(buffer)
+        owned_end = buf_start + size if eof else max(buf_start, buf_start + size - self.overlap)
+        owned_rel = owned_end - buf_start
+        # Con eof no hay región de solape ni coincidencias que aplazar
+        stop = size + 1 if eof else owned_rel
+        touch = size + 1 if eof else size
+        carry_start = owned_end
+        # Los sketches y on_match necesitan el valor de cada coincidencia; la
+        # validación, solo el de los patrones que comprueba
+        every = bool(self.on_match) or self.sketches is not None
+        hits = [] if every or self.checks else None
+
+        # Buffer traducido por tabla de bytes (ver _candidate_spans)
+        self._runs = {}
+
+        metrics = self.metrics
+        if metrics is not None:
+            new_bytes = owned_end - self.consumed
+            regex_started = time.perf_counter()
+
+        for name, pattern in self.patterns.items():
+            if metrics is not None:
+                started = time.perf_counter()
+                before = self.counts[name]
+            if hits is None or not (every or name in self.checks):
+                deferred, last_end = self._scan_pattern(name, pattern, buffer, buf_start, stop, touch, full)
+            else:
+                deferred, last_end = self._scan_pattern_hits(name, pattern, buffer, buf_start, stop, touch, full, hits)
+            if metrics is not None:
+                metrics.add_pattern(name, time.perf_counter() - started, new_bytes,
+                                    self.counts[name] - before)
+
+            if deferred is not None:
+                self.resume[name] = buf_start + deferred
+                carry_start = min(carry_start, buf_start + deferred)
+            else:
+                self.resume[name] = max(buf_start + last_end, owned_end)
+
+        if hits and self.checks:
+            if metrics is not None:
+                started = time.perf_counter()
+            hits = self._validate(hits)
+            if metrics is not None:
+                # La validación no cuenta como tiempo de 'regex'
+                regex_started += metrics.lap('validation', started, new_bytes) - started
+        if hits and self.sketches is not None:
+            # Cada valor distinto del buffer se resume una sola vez
+            for (name, value), count in Counter((hit[2], hit[3]) for hit in hits).items():
+                self.sketches[name].add(value, count)
+        if hits and self.on_match:
+            hits.sort(key=lambda hit: hit[0])
+            for start, end, name, value in hits:
+                self.on_match(name, start, end, value)
+
+        if metrics is not None:
+            metrics.lap('regex', regex_started, new_bytes)
+
+        self._consume(buffer[self.consumed - buf_start:owned_rel])
+        if self.progress is not None:
+            self.progress({'event': 'window', 'bytes': self.consumed})
+        return carry_start
+
+    def _validate(self, hits):
+        """Descartar las coincidencias de patrones validados que no superan su comprobación
+
+        Los valores de cada patrón se comprueban en un solo lote (ver
+        validate_values); las válidas se cuentan, alimentan la muestra del
+        patrón y siguen hacia los sketches y on_match.
+        """
+        groups = defaultdict(list)
+        for position, hit in enumerate(hits):
+            if hit[2] in self.checks:
+                groups[hit[2]].append(position)
+        if not groups:
+            return hits
+
+        keep = [True] * len(hits)
+        for name, positions in groups.items():
+            valid = validate_values(self.checks[name], [hits[position][3] for position in positions])
+            sampler = self.valid_samplers[name]
+            index = self.valid_counts[name]
+            for position, ok in zip(positions, valid):
+                if not ok:
+                    keep[position] = False
+                    continue
+                if index == sampler.target:
+                    sampler.offer(index, hits[position][3])
+                index += 1
+            self.valid_counts[name] = index
+        return list(itertools.compress(hits, keep))
+
+    def _candidate_spans(self, name, buffer):
+        """Tramos [inicio, fin) del buffer que pueden contener coincidencias del patrón
+
+        El buffer se traduce con la tabla del patrón (1 en sus bytes, 0 en
+        el resto) una vez por tabla, y las rachas de al menos su longitud
+        mínima se localizan con find, ambos en C. Tramos separados por menos
+        de PREFILTER_GAP bytes se unen. None si el patrón no tiene prefiltro
+        o hay tantas rachas que no compensa.
+        """
+        prefilter = self.prefilter.get(name)
+        if prefilter is None:
+            return None
+        table, min_width = prefilter
+
+        classes = self._runs.get(table)
+        if classes is None:
+            classes = self._runs[table] = bytes(buffer).translate(table)
+        find = classes.find
+        needle = b'\x01' * min_width
+        limit = len(buffer) // PREFILTER_MIN_SPAN_BYTES + 1
+        spans = []
+        pos = 0
+        for _ in range(limit + 1):
+            hit = find(needle, pos)
+            if hit < 0:
+                break
+            start = classes.rfind(b'\x00', pos, hit) + 1
+            end = find(b'\x00', hit + min_width)
+            if end < 0:
+                end = len(classes)
+            if spans and start - spans[-1][1] < PREFILTER_GAP:
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+            pos = end
+        else:
+            # Demasiadas rachas: escanear el buffer entero
+            return None
+        return spans
+
+    def _finditer(self, name, pattern, buffer, pos):
+        """pattern.finditer(buffer, pos), ejecutado solo sobre los tramos candidatos
+
+        Ninguna coincidencia sale de su racha, así que el resultado (y los
+        offsets, relativos a buffer) es el mismo que sobre el buffer entero.
+        """
+        spans = self._candidate_spans(name, buffer)
+        if spans is None:
+            return pattern.finditer(buffer, pos)
+        return itertools.chain.from_iterable(pattern.finditer(buffer, max(start, pos), end)
+                                             for start, end in spans if end > pos)
+
+    def _resolve_touching(self, pattern, match, buf_start, size, full):
+        """Coincidencia que toca el final del buffer: (match definitivo, aplazar)"""
+        if full is not None:
+            # Datos completos disponibles: resolver la coincidencia sobre ellos
+            return pattern.match(full, buf_start + match.start()), False
+        if size - match.start() <= self.max_pending:
+            # Puede continuar en la ventana siguiente: reintentar allí
+            return match, True
+        return match, False
+
+    def _scan_pattern(self, name, pattern, buffer, buf_start, stop, touch, full):
+        """Contar las coincidencias de un patrón en el buffer sin bucle Python por coincidencia
+
+        Solo las coincidencias que pide el muestreador y la cola de la ventana
+        (región de solape) se examinan una a una; el resto se consume en C.
+        Devuelve (inicio aplazado o None, fin relativo de la última aceptada).
+        """
+        sampler = self.samplers[name]
+        size = len(buffer)
+        last_end = self.resume[name] - buf_start
+        first_index = self.counts[name]
+
+        pairs = zip(self._finditer(name, pattern, buffer, last_end), itertools.count(first_index))
+        # Las coincidencias que empiezan en el solape son como mucho `overlap`
+        tail = deque(maxlen=self.overlap + 2)
+        candidates = []
+        index = first_index
+        while sampler.target is not None:
+            tail.extend(itertools.islice(pairs, sampler.target - index))
+            item = next(pairs, None)
+            if item is None:
+                break
+            tail.append(item)
+            candidates.append((item[1], sampler.state()))
+            sampler.offer(item[1], item[0].group())
+            index = item[1] + 1
+        else:
+            tail.extend(pairs)
+
+        total = tail[-1][1] + 1 - first_index if tail else 0
+        seq = [match for match, _ in tail]
+
+        # Descartar la cola que pertenece a la ventana siguiente
+        idx = len(seq) - 1
+        while idx >= 0 and seq[idx].start() >= stop:
+            idx -= 1
+            total -= 1
+
+        deferred = None
+        if idx >= 0:
+            last_end = seq[idx].end()
+            if last_end >= touch:
+                match, defer = self._resolve_touching(pattern, seq[idx], buf_start, size, full)
+                if defer:
+                    deferred = match.start()
+                    total -= 1
+                elif match is not seq[idx]:
+                    sampler.replace(first_index + total - 1, match.group())
+                    last_end = match.end() - buf_start
+
+        # Deshacer las muestras tomadas de coincidencias no aceptadas
+        for candidate_index, state in candidates:
+            if candidate_index >= first_index + total:
+                sampler.restore(state)
+                break
+
+        self.counts[name] += total
+        return deferred, last_end
+
+    def _scan_pattern_hits(self, name, pattern, buffer, buf_start, stop, touch, full, hits):
+        """Igual que _scan_pattern pero entregando cada coincidencia etiquetada"""
+        sampler = self.samplers[name]
+        size = len(buffer)
+        last_end = self.resume[name] - buf_start
+
+        for match in self._finditer(name, pattern, buffer, last_end):
+            start, end = match.span()
+            if start >= stop:
+                break
+            if end >= touch:
+                match, defer = self._resolve_touching(pattern, match, buf_start, size, full)
+                if defer:
+                    return start, last_end
+                if match.string is not buffer:
+                    end = match.end() - buf_start
+            if self.counts[name] == sampler.target:
+                sampler.offer(self.counts[name], match.group())
+            self.counts[name] += 1
+            hits.append((buf_start + start, buf_start + end, name, match.group()))
+            last_end = end
+
+        return None, last_end
+
+    def _consume(self, data):
+        """Procesar bytes propios exactamente una vez y en orden"""
+        if not data:
+            return
+
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+
+        self.byte_counts = byte_histogram(data, self.byte_counts)
+        if len(self.head) < 16:
+            self.head += bytes(data[:16 - len(self.head)])
+        self.tail = (self.tail + bytes(data[-16:]))[-16:]
+        self.consumed += len(data)
+        if metrics is not None:
+            started = metrics.lap('histogram', started, len(data))
+
+        if self.record_decoder is not None:
+            self.record_decoder.feed(data)
+            if metrics is not None:
+                started = metrics.lap('records', started, len(data))
+
+        folded = self.automaton.fold(data)
+        if metrics is not None:
+            started = metrics.lap('fold', started, len(data))
+
+        # Las apariciones ya vistas en el arrastre no se vuelven a contar:
+        # keyword_next solo avanza
+        buffer = self.keyword_carry + folded
+        base = self.keyword_base
+        counts = self.keyword_counts
+        next_start = self.keyword_next
+        keyword_total = len(self.keywords)
+        on_keyword = self.on_keyword
+        for position, found in self.automaton.finditer(buffer):
+            position += base
+            for indexes, length in found:
+                for index in indexes:
+                    if position < next_start[index]:
+                        continue
+                    next_start[index] = position + length
+                    if index < keyword_total:
+                        counts[index] += 1
+                        if on_keyword is not None:
+                            on_keyword('financial_keywords', position, position + length, self.keywords[index])
+                    else:
+                        institution = self.institutions[index - keyword_total]
+                        self.institutions_found.add(institution)
+                        if on_keyword is not None:
+                            on_keyword('institutions', position, position + length, institution)
+        if metrics is not None:
+            metrics.lap('keywords', started, len(data))
+
+        carry = buffer[-self.keyword_carry_len:] if self.keyword_carry_len else b''
+        self.keyword_base += len(buffer) - len(carry)
+        self.keyword_carry = carry
+
+    def entropy(self):
+        """Entropía de Shannon de los bytes escaneados"""
+        return shannon_entropy(self.byte_counts, self.consumed)
+
+    def record(self, filename, chunk_number=None, metrics=None):
+        """ChunkResult compacto con lo escaneado"""
+        layout = self.analyzer.result_layout()
+        samplers = dict(self.samplers, **self.valid_samplers)
+        samples = tuple(tuple(match.decode('utf-8', errors='ignore') for match in samplers[name].values())
+                        for name in layout.patterns)
+        validation = None
+        if self.checks:
+            validation = {name: {'valid': valid, 'invalid': self.counts[name] - valid}
+                          for name, valid in self.valid_counts.items()}
+        return ChunkResult(layout, chunk_number, filename, self.consumed,
+                           array('q', [self.counts[name] for name in layout.patterns]), samples,
+                           array('q', self.keyword_counts[:len(self.keywords)]),
+                           tuple(inst for inst in self.institutions if inst in self.institutions_found),
+                           self.head, self.tail, self.entropy(), metrics,
+                           records=self.record_decoder.result() if self.record_decoder is not None else None,
+                           sketches=self.sketches, validation=validation)
+
+    def analysis(self, filename):
+        """Resultado con la misma forma que analyze_patterns"""
+        return self.record(filename).analysis_dict()
+
+    def structured(self):
+        """Resultado con la misma forma que extract_structured_data"""
+        return self.record(None).structured_dict()
+
+
+class _QueryDone(Exception):
+    """Todas las búsquedas de un QueryScanner han alcanzado su límite"""
+
+
+class QueryScanner(PatternScanner):
+    """PatternScanner que busca solo unos patrones hasta reunir sus límites
+
+    No calcula histograma, palabras clave ni instituciones. Tras cada
+    ventana deja de ejecutar los patrones que ya tienen sus limits[nombre]
+    coincidencias (None: sin límite) y, cuando no queda ninguno, corta el
+    recorrido con _QueryDone, de modo que no se lee el resto de los datos.
+    """
+
+    def __init__(self, analyzer, limits, window_size=QUERY_WINDOW_SIZE, overlap=DEFAULT_OVERLAP):
+        super().__init__(analyzer, window_size, overlap, on_match=self._collect)
+        self.limits = dict(limits)
+        self.found = {name: [] for name in self.limits}
+        self.patterns = {name: analyzer.patterns[name] for name in self.limits if not self._satisfied(name)}
+
+    def _satisfied(self, name):
+        limit = self.limits[name]
+        return limit is not None and len(self.found[name]) >= limit
+
+    def _collect(self, name, start, end, value):
+        if not self._satisfied(name):
+            self.found[name].append((start, value))
+
+    def _consume(self, data):
+        self.consumed += len(data)
+
+    def _scan_buffer(self, buffer, buf_start, eof, full=None):
+        if not self.patterns:
+            raise _QueryDone
+        carry_start = super()._scan_buffer(buffer, buf_start, eof, full)
+        self.patterns = {name: pattern for name, pattern in self.patterns.items()
+                         if not self._satisfied(name)}
+        if not self.patterns:
+            raise _QueryDone
+        return carry_start
+
+
+# Resultado guardado en la caché para un chunk vacío
+EMPTY_RESULT = {'empty': True}
+
+
+class ResultCache:
+    """Caché persistente en disco (SQLite) de los resultados por chunk
+
+    Un resultado se identifica por el hash del contenido y la versión del
+    conjunto de patrones. Para no volver a leer archivos sin cambios, cada
+    ruta guarda su tamaño y mtime: si coinciden se reutiliza el hash ya
+    calculado. El tamaño total se acota con expulsión LRU.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                digest TEXT NOT NULL,
+                version TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (digest, version)
+            );
+        """)
+
+    @staticmethod
+    def file_digest(filepath, block_size=1024 * 1024):
+        """Hash BLAKE2b del contenido de un archivo"""
+        digest = hashlib.blake2b(digest_size=20)
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _key(self, filepath):
+        """(ruta, tamaño, mtime, hash) del archivo, reutilizando el hash si no cambió"""
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?",
+                                (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            digest = row[2]
+        else:
+            digest = self.file_digest(path)
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                              (path, stat.st_size, stat.st_mtime_ns, digest))
+        return path, stat.st_size, stat.st_mtime_ns, digest
+
+    def lookup(self, filepath, version):
+        """Devolver (resultado o None, clave para store)"""
+        key = self._key(filepath)
+        row = self.conn.execute("SELECT payload FROM results WHERE digest = ? AND version = ?",
+                                (key[3], version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None, key
+
+        self.hits += 1
+        self.conn.execute("UPDATE results SET last_used = ? WHERE digest = ? AND version = ?",
+                          (time.time(), key[3], version))
+        return json.loads(row[0]), key
+
+    def probe(self, filepath, version):
+        """Como lookup pero sin cargar el resultado: (hay acierto, clave)
+
+        El resultado se lee después con fetch, justo cuando hace falta.
+        """
+        key = self._key(filepath)
+        row = self.conn.execute("SELECT 1 FROM results WHERE digest = ? AND version = ?",
+                                (key[3], version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, key
+
+        self.hits += 1
+        self.conn.execute("UPDATE results SET last_used = ? WHERE digest = ? AND version = ?",
+                          (time.time(), key[3], version))
+        return True, key
+
+    def fetch(self, key, version):
+        """Resultado guardado para una clave de probe, o None si ya fue expulsado"""
+        row = self.conn.execute("SELECT payload FROM results WHERE digest = ? AND version = ?",
+                                (key[3], version)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def store(self, key, version, result):
+        """Guardar un resultado y expulsar los menos usados si se supera max_bytes
+
+        result=None (chunk vacío) se guarda como EMPTY_RESULT para que un
+        archivo vacío sin cambios también sea un acierto.
+        """
+        payload = json.dumps(EMPTY_RESULT if result is None else result, ensure_ascii=False)
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                          (key[3], version, payload, len(payload), time.time()))
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self.conn.execute("SELECT digest, version, nbytes FROM results ORDER BY last_used").fetchall()
+        for digest, version, nbytes in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM results WHERE digest = ? AND version = ?", (digest, version))
+            total -= nbytes
+
+    def snapshot(self):
+        """Contadores actuales, para medir una ejecución con stats(since=...)"""
+        return self.hits, self.misses
+
+    def stats(self, since=(0, 0)):
+        """Resumen de aciertos y fallos desde el snapshot since"""
+        hits = self.hits - since[0]
+        misses = self.misses - since[1]
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': (hits / lookups * 100) if lookups else 0
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class ScanCheckpoints:
+    """Puntos de control persistentes (SQLite) de archivos que crecen por el final
+
+    Por ruta se guarda hasta dónde se leyó el archivo, el estado del
+    PatternScanner en ese punto (contadores, muestras, histograma, palabras
+    clave y arrastre de la frontera, ver PatternScanner.checkpoint) y un
+    hash de los primeros y los últimos CHECKPOINT_PROBE bytes leídos. Si el
+    archivo no ha encogido y el hash coincide se da por ampliado solo al
+    final y el escaneo continúa desde ahí (ver DTCAnalyzer.scan_appended);
+    una reescritura que conserve esos bytes no se detecta.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.resumed = 0
+        self.rescanned = 0
+        self.bytes_skipped = 0
+        self.bytes_scanned = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                path TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                probe TEXT NOT NULL,
+                state BLOB NOT NULL
+            );
+        """)
+
+    @staticmethod
+    def probe(f, offset):
+        """Hash de los primeros y los últimos CHECKPOINT_PROBE bytes de f[:offset]"""
+        digest = hashlib.blake2b(digest_size=20)
+        for start in sorted({0, max(offset - CHECKPOINT_PROBE, 0)}):
+            f.seek(start)
+            digest.update(f.read(min(CHECKPOINT_PROBE, offset - start)))
+        return digest.hexdigest()
+
+    def load(self, filepath, version, f):
+        """Estado guardado para filepath (abierto como f) si solo ha crecido, o None"""
+        row = self.conn.execute("SELECT version, offset, probe, state FROM checkpoints WHERE path = ?",
+                                (os.path.abspath(filepath),)).fetchone()
+        if row is None or row[0] != version or os.fstat(f.fileno()).st_size < row[1] \
+                or self.probe(f, row[1]) != row[2]:
+            self.rescanned += 1
+            return None
+        self.resumed += 1
+        return row[3]
+
+    def save(self, filepath, version, f, offset, state):
+        """Guardar el estado tras leer offset bytes de filepath (abierto como f)"""
+        self.conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                          (os.path.abspath(filepath), version, offset, self.probe(f, offset), state))
+        self.conn.commit()
+
+    def stats(self):
+        """Archivos retomados o escaneados desde el principio y bytes ahorrados"""
+        total = self.bytes_skipped + self.bytes_scanned
+        return {
+            'resumed': self.resumed,
+            'rescanned': self.rescanned,
+            'bytes_skipped': self.bytes_skipped,
+            'bytes_scanned': self.bytes_scanned,
+            'saved_pct': (self.bytes_skipped / total * 100) if total else 0
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class MatchIndex:
+    """Índice persistente (SQLite) de todas las coincidencias por chunk
+
+    Guarda cada coincidencia como (chunk, patrón, offset, longitud, valor),
+    incluidas las palabras clave ('financial_keywords') y las instituciones
+    ('institutions'), de modo que las consultas por patrón, valor, chunk o
+    rango de offsets se responden sin volver a leer los binarios. Cada chunk
+    recuerda tamaño, mtime y versión de patrones para saber si está al día.
+
+    Durante el escaneo las filas se acumulan en un archivo temporal propio
+    de cada proceso, sin tocar la base de datos; end_chunk las vuelca en una
+    única transacción corta (borrado, inserciones y fila del chunk). Con WAL
+    las lecturas no esperan a los escritores, así que varios procesos pueden
+    indexar a la vez y solo se serializan esos volcados.
+    """
+
+    # Filas por lote en el archivo temporal y por executemany
+    BATCH_ROWS = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_number INTEGER PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                version TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS matches (
+                chunk_number INTEGER NOT NULL,
+                pattern TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                value BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS matches_by_pattern ON matches (pattern, value);
+            CREATE INDEX IF NOT EXISTS matches_by_value ON matches (value);
+            CREATE INDEX IF NOT EXISTS matches_by_offset ON matches (chunk_number, offset);
+        """)
+        self._pending = []
+        self._spool = None
+        self._chunk = None
+        self._chunk_row = None
+
+    def is_current(self, chunk_number, filepath, version):
+        """True si el chunk ya está indexado con este contenido y estos patrones"""
+        stat = os.stat(filepath)
+        row = self.conn.execute("SELECT size, mtime_ns, version FROM chunks WHERE chunk_number = ?",
+                                (chunk_number,)).fetchone()
+        return row == (stat.st_size, stat.st_mtime_ns, version)
+
+    def begin_chunk(self, chunk_number, filepath, version):
+        """Empezar a (re)indexar un chunk; lo anterior se sustituye en end_chunk"""
+        stat = os.stat(filepath)
+        self._chunk = chunk_number
+        self._chunk_row = (chunk_number, os.path.abspath(filepath), stat.st_size,
+                           stat.st_mtime_ns, version)
+        self._pending = []
+        self._spool = tempfile.TemporaryFile()
+
+    def add(self, name, start, end, value):
+        """Registrar una coincidencia (firma de on_match/on_keyword)"""
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self._pending.append((self._chunk, name, start, end - start, value))
+        if len(self._pending) >= self.BATCH_ROWS:
+            pickle.dump(self._pending, self._spool, pickle.HIGHEST_PROTOCOL)
+            self._pending = []
+
+    def _spooled_batches(self):
+        self._spool.seek(0)
+        while True:
+            try:
+                yield pickle.load(self._spool)
+            except EOFError:
+                break
+        yield self._pending
+
+    def end_chunk(self):
+        """Sustituir las coincidencias del chunk en una sola transacción corta"""
+        try:
+            with self.conn:
+                self.conn.execute("DELETE FROM matches WHERE chunk_number = ?", (self._chunk,))
+                for batch in self._spooled_batches():
+                    self.conn.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?)", batch)
+                self.conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", self._chunk_row)
+        finally:
+            self.abort_chunk()
+
+    def abort_chunk(self):
+        """Descartar el chunk en curso sin tocar lo ya indexado"""
+        self._pending = []
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self._chunk = None
+        self._chunk_row = None
+
+    def remove_chunk(self, chunk_number):
+        """Olvidar un chunk que ya no existe"""
+        self.conn.execute("DELETE FROM matches WHERE chunk_number = ?", (chunk_number,))
+        self.conn.execute("DELETE FROM chunks WHERE chunk_number = ?", (chunk_number,))
+        self.conn.commit()
+
+    def copy_chunk(self, source, chunk_number, filepath, version):
+        """Indexar un chunk con las coincidencias ya indexadas de otro de idéntico contenido"""
+        stat = os.stat(filepath)
+        with self.conn:
+            self.conn.execute("DELETE FROM matches WHERE chunk_number = ?", (chunk_number,))
+            self.conn.execute("INSERT INTO matches SELECT ?, pattern, offset, length, value "
+                              "FROM matches WHERE chunk_number = ?", (chunk_number, source))
+            self.conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                              (chunk_number, os.path.abspath(filepath), stat.st_size,
+                               stat.st_mtime_ns, version))
+
+    def query(self, pattern=None, value=None, chunk=None, start=None, end=None, limit=None):
+        """Coincidencias que cumplen todos los filtros, en orden de chunk y offset
+
+        value puede ser str o bytes; start/end acotan el offset (end excluido).
+        """
+        conditions = []
+        params = []
+        if pattern is not None:
+            conditions.append("pattern = ?")
+            params.append(pattern)
+        if value is not None:
+            conditions.append("value = ?")
+            params.append(value.encode('utf-8') if isinstance(value, str) else value)
+        if chunk is not None:
+            conditions.append("chunk_number = ?")
+            params.append(chunk)
+        if start is not None:
+            conditions.append("offset >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("offset < ?")
+            params.append(end)
+
+        sql = "SELECT chunk_number, pattern, offset, length, value FROM matches"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY chunk_number, offset"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return [{'chunk_number': row[0], 'pattern': row[1], 'offset': row[2], 'length': row[3],
+                 'value': row[4].decode('utf-8', errors='ignore')}
+                for row in self.conn.execute(sql, params)]
+
+    def chunks_with(self, pattern=None, value=None):
+        """Números de chunk con alguna coincidencia del patrón y/o valor"""
+        conditions = []
+        params = []
+        if pattern is not None:
+            conditions.append("pattern = ?")
+            params.append(pattern)
+        if value is not None:
+            conditions.append("value = ?")
+            params.append(value.encode('utf-8') if isinstance(value, str) else value)
+        sql = "SELECT DISTINCT chunk_number FROM matches"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [row[0] for row in self.conn.execute(sql + " ORDER BY chunk_number", params)]
+
+    def counts(self, chunk=None):
+        """Coincidencias indexadas por patrón, de todo el índice o de un chunk"""
+        if chunk is None:
+            rows = self.conn.execute("SELECT pattern, COUNT(*) FROM matches GROUP BY pattern")
+        else:
+            rows = self.conn.execute("SELECT pattern, COUNT(*) FROM matches WHERE chunk_number = ? "
+                                     "GROUP BY pattern", (chunk,))
+        return dict(rows.fetchall())
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+# Analizador de cada proceso del pool de analyze_all_chunks
+_worker_analyzer = None
+
+
+def _init_chunk_worker(analyzer):
+    global _worker_analyzer
+    _worker_analyzer = analyzer
+
+
+def _analyze_chunk_worker(chunk):
+    return _worker_analyzer.analyze_chunk(*chunk, compact=True)
+
+
+def _analyze_member_worker(chunk):
+    return _worker_analyzer.analyze_member(*chunk)
+
+
+def _scan_range_worker(task):
+    return _worker_analyzer._scan_range(*task)
+
 
 class DTCAnalyzer:
     """Analizador avanzado de archivos DTC1B"""
 
-    def __init__(self):
+    def __init__(self, sampling='first', sample_seed=None, instrument=False,
+                 financial_keywords=None, institutions=None, block_dedup=False,
+                 record_layouts=None, prefilter=True, sketches=False, prefetch=DEFAULT_PREFETCH,
+                 validate=False):
+        if sampling not in SAMPLING_MODES:
+            raise ValueError(f"sampling debe ser uno de {SAMPLING_MODES}")
+        if block_dedup and sampling != 'first':
+            raise ValueError("block_dedup solo admite sampling='first'")
+
+        # Con block_dedup=True los chunks en memoria se escanean por bloques
+        # definidos por contenido y cada bloque repetido se analiza una vez
+        self.block_dedup = block_dedup
+        self._block_results = OrderedDict()
+        self._breakers = None
+        self._breakers_key = None
+
+        # Con instrument=True cada chunk incluye tiempos por etapa y patrón
+        self.instrument = instrument
+
+        # Ventanas (o chunks, en serie) que se leen en un hilo por delante
+        # del escaneo; 0 lee sin hilo (ver prefetched)
+        self.prefetch = prefetch
+
+        # Con sketches=True cada chunk incluye un PatternSketch por patrón y
+        # el resumen los valores distintos y más frecuentes de todo el corpus
+        self.sketches = sketches
+
+        # Con validate=True los IBAN, cuentas y BIC candidatos se comprueban
+        # (dígitos de control, país) y solo los válidos llegan a las muestras,
+        # los sketches y el índice; cada chunk cuenta válidos e inválidos
+        self.validate = validate
+
+        # Muestras por patrón: primeras coincidencias o reservorio uniforme
+        self.sampling = sampling
+        self.sample_seed = sample_seed
+
         self.patterns = {
             # Patrones de datos bancarios
             'bank_codes': re.compile(rb'[A-Z]{6}'),
@@ -35,11 +2340,89 @@ class DTCAnalyzer:
         }
 
         # Palabras clave para filtrar datos financieros tradicionales
-        self.financial_keywords = [
-            'bank', 'account', 'balance', 'transaction', 'transfer',
-            'usd', 'eur', 'gbp', 'amount', 'value', 'total',
-            'hsbc', 'citibank', 'federal', 'reserve', 'ecb'
-        ]
+        if financial_keywords is None:
+            financial_keywords = [
+                'bank', 'account', 'balance', 'transaction', 'transfer',
+                'usd', 'eur', 'gbp', 'amount', 'value', 'total',
+                'hsbc', 'citibank', 'federal', 'reserve', 'ecb'
+            ]
+        self.financial_keywords = list(financial_keywords)
+
+        # Instituciones financieras reconocidas en el texto
+        if institutions is None:
+            institutions = ['HSBC', 'Citibank', 'Federal Reserve', 'ECB', 'Banco de España']
+        self.institutions = list(institutions)
+
+        # Cada patrón solo se ejecuta sobre los tramos que pueden contener
+        # coincidencias (ver prefilter_table); el resultado no cambia
+        self.prefilter = prefilter
+        self._prefilter_tables = None
+        self._prefilter_key = None
+
+        # Formatos de registro conocidos que se decodifican con struct (ver parse_records)
+        if record_layouts is None:
+            record_layouts = DTC1B_RECORD_LAYOUTS
+        self.record_layouts = list(record_layouts)
+
+        # Autómata compilado de palabras clave e instituciones (ver keyword_automaton)
+        self._automaton = None
+        self._automaton_words = None
+        self._min_overlap = None
+        self._min_overlap_key = None
+
+    def keyword_automaton(self):
+        """Autómata de palabras clave seguidas de instituciones, compilado una vez
+
+        Se reconstruye solo si financial_keywords o institutions cambian.
+        """
+        words = tuple(self.financial_keywords) + tuple(self.institutions)
+        if self._automaton_words != words:
+            self._automaton = KeywordAutomaton(words)
+            self._automaton_words = words
+        return self._automaton
+
+    def min_overlap(self):
+        """Solape mínimo entre ventanas para estos patrones (ver min_overlap)"""
+        key = tuple(self.patterns.values())
+        if self._min_overlap_key != key:
+            self._min_overlap = min_overlap(self.patterns)
+            self._min_overlap_key = key
+        return self._min_overlap
+
+    def result_layout(self):
+        """ResultLayout (ids de patrón y palabra clave) de los ChunkResult de este analizador"""
+        return result_layout(self.patterns, self.financial_keywords)
+
+    def prefilter_tables(self):
+        """{patrón: (tabla de bytes, longitud mínima)} de los patrones con prefiltro"""
+        key = tuple(self.patterns.values())
+        if self._prefilter_key != key:
+            tables = {name: prefilter_table(pattern) for name, pattern in self.patterns.items()}
+            self._prefilter_tables = {name: table for name, table in tables.items() if table is not None}
+            self._prefilter_key = key
+        return self._prefilter_tables
+
+    def block_breakers(self):
+        """Tabla de bytes de corte para estos patrones y palabras (ver block_breakers)"""
+        key = (tuple(self.patterns.values()), tuple(self.financial_keywords), tuple(self.institutions))
+        if self._breakers_key != key:
+            self._breakers = block_breakers(self.patterns, self.financial_keywords + self.institutions)
+            self._breakers_key = key
+            self._block_results.clear()
+        return self._breakers
+
+    def __getstate__(self):
+        # Los resultados de bloque no viajan a los procesos del pool
+        state = self.__dict__.copy()
+        state['_block_results'] = OrderedDict()
+        return state
+
+    def _make_sampler(self, pattern_name, k):
+        """Muestreador de coincidencias según el modo configurado"""
+        if self.sampling == 'reservoir':
+            seed = None if self.sample_seed is None else f"{self.sample_seed}:{pattern_name}"
+            return _ReservoirSampler(k, random.Random(seed))
+        return _FirstSampler(k)
 
     def read_binary_file(self, filepath):
         """Leer archivo binario completo"""
@@ -53,149 +2436,1101 @@ class DTCAnalyzer:
             print(f"❌ Error leyendo archivo {filepath}: {e}")
             return None
 
-    def analyze_patterns(self, data, filename):
+    def scan_data(self, data, window_size=SCAN_BLOCK_SIZE, overlap=DEFAULT_OVERLAP, on_match=None,
+                  metrics=None, on_keyword=None):
+        """Escanear datos en memoria en una sola pasada
+
+        Devuelve un PatternScanner reutilizable por analyze_patterns y
+        extract_structured_data (parámetro scan=), de modo que ambos métodos
+        comparten el mismo recorrido. on_match(nombre, inicio, fin, valor)
+        recibe cada coincidencia etiquetada en orden de offset; on_keyword,
+        con la misma firma, cada palabra clave o institución contada ('financial_keywords'
+        o 'institutions' y la palabra configurada). metrics (un ScanMetrics)
+        registra tiempos por etapa y patrón.
+        """
+        scanner = PatternScanner(self, window_size, overlap, on_match=on_match, metrics=metrics,
+                                 on_keyword=on_keyword)
+        scanner.scan_buffer(data)
+        return scanner
+
+    def analyze_patterns(self, data, filename, scan=None):
         """Analizar patrones en datos binarios"""
-        results = {
-            'filename': filename,
-            'file_size': len(data),
-            'patterns_found': {},
-            'potential_data': {}
+        if scan is None:
+            scan = self.scan_data(data)
+        return scan.analysis(filename)
+
+    def extract_structured_data(self, data, filename, scan=None):
+        """Extraer datos estructurados del binario
+
+        Los campos de los registros de formato conocido (parse_records)
+        sustituyen a las muestras de las expresiones regulares. Con validate
+        en el analizador las muestras de VALIDATED_PATTERNS son solo de
+        candidatos válidos y 'validation' cuenta válidos e inválidos.
+        """
+        if scan is None:
+            scan = self.scan_data(data)
+        record = scan.record(filename)
+        record.records = self.parse_records(data)
+        return record.structured_dict()
+
+    def parse_records(self, data):
+        """Decodificar los registros de formato conocido (record_layouts) sin copiar data
+
+        Devuelve {'formats', 'count', 'fields': {clave: valores}} con los
+        valores de cada clave de extract_structured_data, o None si ningún
+        formato coincide.
+        """
+        decoder = RecordDecoder(self.record_layouts)
+        decoder.feed(data)
+        return decoder.result()
+
+    def parse_file_records(self, filepath):
+        """parse_records sobre el archivo proyectado en memoria (mmap), sin leerlo entero"""
+        try:
+            with open(filepath, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return self.parse_records(mapped)
+        except OSError:
+            return None
+
+    def calculate_entropy(self, data):
+        """Calcular entropía de Shannon (bits por byte) para detectar datos encriptados"""
+        if len(data) == 0:
+            return 0
+
+        # Calcular frecuencia de bytes
+        return shannon_entropy(byte_histogram(data), len(data))
+
+    def calculate_entropy_map(self, data, block_size=ENTROPY_BLOCK_SIZE, base_offset=0):
+        """Entropía por bloques: lista de (offset, entropía)
+
+        Permite localizar regiones encriptadas o comprimidas dentro de un
+        archivo grande. El último bloque puede ser más corto.
+        """
+        if block_size <= 0:
+            raise ValueError("block_size debe ser positivo")
+
+        view = memoryview(data)
+        full_blocks = len(view) // block_size
+
+        if np is not None:
+            entropies = _block_entropies(view[:full_blocks * block_size], block_size)
+        else:
+            entropies = [self.calculate_entropy(view[i * block_size:(i + 1) * block_size])
+                         for i in range(full_blocks)]
+
+        entropy_map = [(base_offset + i * block_size, entropy) for i, entropy in enumerate(entropies)]
+        if len(view) % block_size:
+            offset = full_blocks * block_size
+            entropy_map.append((base_offset + offset, self.calculate_entropy(view[offset:])))
+
+        return entropy_map
+
+    def calculate_file_entropy_map(self, filepath, block_size=ENTROPY_BLOCK_SIZE,
+                                   window_size=DEFAULT_WINDOW_SIZE):
+        """Mapa de entropía de un archivo leído por ventanas (memoria acotada)"""
+        # Ventanas múltiplo del bloque para que ningún bloque quede partido
+        window_size = max(block_size, window_size - window_size % block_size)
+        entropy_map = []
+        offset = 0
+
+        with open(filepath, 'rb') as f:
+            while True:
+                window = f.read(window_size)
+                if not window:
+                    break
+                entropy_map.extend(self.calculate_entropy_map(window, block_size, base_offset=offset))
+                offset += len(window)
+
+        return entropy_map
+
+    def find_matches(self, source, limits, window_size=QUERY_WINDOW_SIZE, overlap=DEFAULT_OVERLAP):
+        """Primeras coincidencias de unos patrones, dejando de leer en cuanto se reúnen
+
+        limits es {patrón: máximo de coincidencias} (None: todas). Solo se
+        ejecutan esos patrones y el recorrido se detiene cuando todos
+        alcanzan su límite (ver QueryScanner), así que el coste depende de
+        dónde aparecen las coincidencias y no del tamaño de los datos.
+        source es una ruta (también comprimida) o datos en memoria. Devuelve
+        {'matches': {patrón: [{'offset', 'value'}]}, 'complete' (todos los
+        límites alcanzados), 'bytes_scanned', 'seconds'}.
+        """
+        unknown = [name for name in limits if name not in self.patterns]
+        if unknown:
+            raise ValueError(f"patrones desconocidos: {', '.join(unknown)}")
+
+        started = time.perf_counter()
+        scanner = QueryScanner(self, limits, window_size, overlap)
+        try:
+            if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+                scanner.scan_buffer(source)
+            else:
+                with open_input(source) as f:
+                    scanner.scan_fileobj(f)
+        except _QueryDone:
+            pass
+        return {
+            'matches': {name: [{'offset': offset, 'value': value.decode('utf-8', errors='ignore')}
+                               for offset, value in found]
+                        for name, found in scanner.found.items()},
+            'complete': all(scanner._satisfied(name) for name in scanner.limits),
+            'bytes_scanned': scanner.consumed,
+            'seconds': time.perf_counter() - started
         }
 
-        # Buscar todos los patrones
-        for pattern_name, pattern in self.patterns.items():
-            matches = pattern.findall(data)
-            if matches:
-                results['patterns_found'][pattern_name] = {
-                    'count': len(matches),
-                    'samples': [match.decode('utf-8', errors='ignore')[:50] for match in matches[:5]]
-                }
+    def triage(self, filepath, samples=TRIAGE_SAMPLES, block_size=ENTROPY_BLOCK_SIZE, seed=None,
+               confidence=0.95):
+        """Estimación rápida de un archivo a partir de bloques muestreados
+
+        El archivo se divide en samples estratos iguales y de cada uno se lee
+        un bloque de block_size bytes en una posición aleatoria (seed la hace
+        reproducible). Con los bloques se estiman, con intervalos al nivel
+        confidence: la entropía media y la proporción de bloques cifrados
+        (entropía >= ENCRYPTED_ENTROPY), la densidad de cada patrón
+        (coincidencias por MB y total estimado) y la proporción de bloques
+        con cada palabra clave o institución. Si el archivo cabe en los
+        bloques pedidos se escanea entero y las estimaciones son exactas.
+        Las coincidencias que cruzan el borde de un bloque no se cuentan.
+        El archivo debe estar sin comprimir: los bloques se leen por posición.
+        """
+        started = time.perf_counter()
+        size = os.path.getsize(filepath)
+        if size == 0:
+            return None
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        rng = random.Random(seed)
 
-        # Buscar palabras clave financieras
-        text_content = data.decode('utf-8', errors='ignore').lower()
-        found_keywords = {}
+        if size <= samples * block_size:
+            # Muestra exhaustiva: bloques consecutivos de todo el archivo
+            offsets = list(range(0, size, block_size))
+        else:
+            stratum = size / samples
+            offsets = [int(i * stratum) + rng.randrange(max(1, int(stratum) - block_size + 1))
+                       for i in range(samples)]
+        population = math.ceil(size / block_size)
+        fpc = max(0.0, 1 - len(offsets) / population)
 
-        for keyword in self.financial_keywords:
-            count = text_content.count(keyword.lower())
-            if count > 0:
-                found_keywords[keyword] = count
+        entropies = []
+        densities = {name: [] for name in self.patterns}
+        keyword_blocks = Counter()
+        institution_blocks = Counter()
+        bytes_read = 0
+        with open(filepath, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                block = f.read(block_size)
+                if not block:
+                    continue
+                bytes_read += len(block)
+                record = self.scan_data(block).record(filepath)
+                entropies.append(record.entropy)
+                megabytes = len(block) / (1024 * 1024)
+                for name, count in zip(record.layout.patterns, record.counts):
+                    densities[name].append(count / megabytes)
+                keyword_blocks.update(k for k, count in zip(record.layout.keywords, record.keyword_counts)
+                                      if count)
+                institution_blocks.update(record.institutions)
 
-        if found_keywords:
-            results['potential_data']['financial_keywords'] = found_keywords
+        n = len(entropies)
+        file_mb = size / (1024 * 1024)
+        entropy = _mean_interval(entropies, z, fpc)
+        encrypted = _wilson_interval(sum(1 for e in entropies if e >= ENCRYPTED_ENTROPY), n, z)
+        patterns = {}
+        for name, values in densities.items():
+            mean, low, high = _mean_interval(values, z, fpc)
+            patterns[name] = {
+                'per_mb': mean,
+                'per_mb_interval': [max(0.0, low), high],
+                'estimated_total': round(mean * file_mb),
+                'blocks_with_matches': sum(1 for value in values if value)
+            }
 
-        return results
+        def presence(counter, words):
+            return {word: dict(zip(('fraction', 'low', 'high'), _wilson_interval(counter[word], n, z)))
+                    for word in words if counter[word]}
 
-    def extract_structured_data(self, data, filename):
-        """Extraer datos estructurados del binario"""
-        extracted_data = {
-            'bank_codes': [],
-            'account_numbers': [],
-            'swift_codes': [],
-            'currency_amounts': [],
-            'institutions': [],
-            'metadata': {}
+        keywords = presence(keyword_blocks, self.financial_keywords)
+        financial = [name for name in ('financial_structures', 'currency_patterns', 'iban_patterns',
+                                       'swift_codes') if patterns.get(name, {}).get('per_mb')]
+        return {
+            'filename': filepath,
+            'file_size': size,
+            'blocks': n,
+            'block_size': block_size,
+            'bytes_read': bytes_read,
+            'sampled_fraction': bytes_read / size,
+            'exact': fpc == 0.0,
+            'confidence': confidence,
+            'entropy': {'mean': entropy[0], 'interval': [entropy[1], entropy[2]]},
+            'encrypted_fraction': {'estimate': encrypted[0], 'interval': [encrypted[1], encrypted[2]]},
+            'mostly_encrypted': encrypted[1] > 0.5,
+            'patterns': patterns,
+            'keywords': keywords,
+            'institutions': presence(institution_blocks, self.institutions),
+            'financial_indicators': financial + sorted(keywords),
+            'seconds': time.perf_counter() - started
         }
 
-        # Extraer códigos bancarios
-        bank_codes = self.patterns['bank_codes'].findall(data)
-        extracted_data['bank_codes'] = [code.decode('utf-8', errors='ignore') for code in bank_codes[:10]]
+    def format_triage(self, triage):
+        """Texto del triaje para la consola"""
+        entropy = triage['entropy']
+        encrypted = triage['encrypted_fraction']
+        level = f"{triage['confidence'] * 100:.0f}%"
+        text = (f"\n🩺 TRIAJE DE {triage['filename']}: {triage['blocks']} bloques de {triage['block_size']} bytes "
+                f"({triage['sampled_fraction'] * 100:.2f}% del archivo, {triage['seconds']:.3f} s)\n"
+                f"• Entropía media: {entropy['mean']:.3f} [{entropy['interval'][0]:.3f}, "
+                f"{entropy['interval'][1]:.3f}] ({level})\n"
+                f"• Bloques cifrados: {encrypted['estimate'] * 100:.1f}% [{encrypted['interval'][0] * 100:.1f}%, "
+                f"{encrypted['interval'][1] * 100:.1f}%]"
+                f"{' → mayormente cifrado' if triage['mostly_encrypted'] else ''}\n")
+        for name, entry in sorted(triage['patterns'].items(), key=lambda x: x[1]['per_mb'], reverse=True):
+            if entry['per_mb']:
+                low, high = entry['per_mb_interval']
+                text += (f"• {name}: {entry['per_mb']:.1f}/MB [{low:.1f}, {high:.1f}], "
+                         f"~{entry['estimated_total']} en total\n")
+        for word, entry in list(triage['keywords'].items()) + list(triage['institutions'].items()):
+            text += f"• '{word}' en {entry['fraction'] * 100:.1f}% de los bloques\n"
+        if triage['financial_indicators']:
+            text += f"• Indicios financieros: {', '.join(triage['financial_indicators'])}\n"
+        return text
 
-        # Extraer números de cuenta potenciales
-        account_nums = self.patterns['account_numbers'].findall(data)
-        extracted_data['account_numbers'] = [num.decode('utf-8', errors='ignore') for num in account_nums[:10]]
+    def _scan_file(self, filepath, window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP,
+                   metrics=None, progress=None, on_match=None, on_keyword=None, member=None,
+                   records=False):
+        """Escanear un archivo por ventanas; devuelve el PatternScanner o None si falla
 
-        # Extraer códigos SWIFT
-        swift_codes = self.patterns['swift_codes'].findall(data)
-        extracted_data['swift_codes'] = [code.decode('utf-8', errors='ignore') for code in swift_codes[:5]]
+        Los archivos comprimidos se escanean descomprimidos en flujo (ver
+        open_input); member elige el miembro de un zip. Con records=True los
+        registros de formato conocido se decodifican en el mismo recorrido.
+        """
+        scanner = PatternScanner(self, window_size, overlap, on_match=on_match, metrics=metrics,
+                                 progress=progress, on_keyword=on_keyword, records=records)
+        try:
+            with open_input(filepath, member) as f:
+                scanner.scan_fileobj(f)
+        except FileNotFoundError:
+            print(f"❌ Archivo no encontrado: {filepath}")
+            return None
+        except Exception as e:
+            print(f"❌ Error leyendo archivo {filepath}: {e}")
+            return None
+        return scanner
+
+    def analyze_file_streaming(self, filepath, filename=None,
+                               window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP, progress=None):
+        """Analizar un archivo por ventanas con memoria acotada
+
+        Devuelve (analysis, structured) con la misma forma que analyze_patterns
+        y extract_structured_data. La memoria depende de window_size + overlap,
+        no del tamaño del archivo. overlap debe ser al menos min_overlap()
+        (si no, ValueError). Los patrones sin longitud máxima
+        (encrypted_blocks, currency_patterns...) solo son exactos para
+        coincidencias de hasta window_size + overlap bytes; las más largas
+        pueden partirse. progress, si se indica, recibe un evento por ventana.
+        """
+        scanner = self._scan_file(filepath, window_size, overlap, progress=progress)
+        if scanner is None:
+            return None
+        return scanner.analysis(filename or filepath), scanner.structured()
+
+    def scan_appended(self, filepath, checkpoints, chunk_number=None, filename=None,
+                      window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP):
+        """Escanear un archivo que crece por el final leyendo solo lo añadido
+
+        checkpoints (un ScanCheckpoints) guarda el estado del escaneo por
+        ventanas al llegar al final del archivo, antes de cerrar el
+        recorrido; la siguiente llamada, si el archivo solo ha crecido,
+        lo recupera y escanea únicamente los bytes nuevos (más el arrastre
+        de la frontera), así que el coste es proporcional a lo añadido. El
+        ChunkResult es el mismo que el de un escaneo en flujo del archivo
+        completo, salvo los candidatos Misra-Gries de los sketches, que
+        dependen de cómo se agrupan los valores por ventana. Los archivos
+        comprimidos se escanean enteros. Devuelve None
+        si el archivo está vacío o no se puede leer.
+        """
+        filename = filename or filepath
+        metrics = ScanMetrics() if self.instrument else None
+        chunk_started = time.perf_counter()
+        try:
+            compressed = compression_format(filepath) is not None
+        except OSError as e:
+            print(f"❌ Error leyendo archivo {filepath}: {e}")
+            return None
+        scanned = None
+        if compressed:
+            scan = self._scan_file(filepath, window_size, overlap, metrics=metrics, records=True)
+        else:
+            # El estado depende también de la ventana y el solape
+            version = f"{self.pattern_set_version()}:{window_size}:{overlap}"
+            scan = PatternScanner(self, window_size, overlap, metrics=metrics, records=True)
+            with open(filepath, 'rb') as f:
+                carry, buf_start = b'', 0
+                state = checkpoints.load(filepath, version, f)
+                if state is not None:
+                    carry, buf_start = scan.restore(state)
+                resumed_at = buf_start + len(carry)
+                f.seek(resumed_at)
+                carry, buf_start = scan.scan_windows(f, carry, buf_start)
+                offset = buf_start + len(carry)
+                checkpoints.save(filepath, version, f, offset, scan.checkpoint(carry, buf_start))
+            scanned = offset - resumed_at
+            checkpoints.bytes_skipped += resumed_at
+            checkpoints.bytes_scanned += scanned
+            scan.finish(carry, buf_start)
+        if scan is None or not scan.consumed:
+            return None
+
+        record = scan.record(filename, chunk_number)
+        if metrics is not None:
+            # El rendimiento es el de los bytes leídos en esta llamada
+            record.metrics = metrics.as_dict(time.perf_counter() - chunk_started,
+                                             record.file_size if scanned is None else scanned)
+        return record
+
+    def analyze_chunk(self, chunk_number, filename, streaming=False,
+                      window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP, index=None,
+                      compact=False, data=None):
+        """Analizar un chunk; devuelve el resultado del chunk o None si está vacío
+
+        Con index (ruta de un MatchIndex) todas las coincidencias del chunk
+        se escriben en el índice durante el mismo escaneo. Con compact=True
+        devuelve un ChunkResult en lugar del diccionario. Un chunk comprimido
+        (gzip, bz2, xz o zip de un miembro) se escanea siempre descomprimido
+        en flujo, por ventanas; los offsets son los de los datos descomprimidos.
+        data, si se indica, es el contenido ya leído del chunk (sin comprimir).
+        """
+        metrics = ScanMetrics() if self.instrument else None
+        if metrics is not None:
+            chunk_started = time.perf_counter()
+
+        match_index = None
+        if index is not None and os.path.exists(filename):
+            match_index = MatchIndex(index)
+            match_index.begin_chunk(chunk_number, filename, self.pattern_set_version())
+        on_match = match_index.add if match_index is not None else None
+        scan = None
+        record = None
+        try:
+            compressed = data is None and compression_format(filename) is not None
+        except OSError:
+            compressed = False
+
+        try:
+            if streaming or compressed:
+                scan = self._scan_file(filename, window_size, overlap, metrics=metrics,
+                                       on_match=on_match, on_keyword=on_match, records=compressed)
+                if scan is None or not scan.consumed:
+                    return None
+                data = None
+            else:
+                if data is None:
+                    if metrics is not None:
+                        started = time.perf_counter()
+                    data = self.read_binary_file(filename)
+                    if metrics is not None:
+                        metrics.lap('read', started, len(data or b''))
+                elif metrics is not None:
+                    # Leído por adelantado (ver _run_chunks): sin espera
+                    metrics.add_stage('read', 0.0, len(data))
+                if not data:
+                    return None
+
+                # Los candidatos de los sketches dependen del orden de los
+                # valores: con sketches se escanea el chunk entero
+                if self.block_dedup and match_index is None and not self.sketches \
+                        and self.block_breakers() is not None:
+                    record = self._scan_blocks(data, filename, chunk_number, metrics)
+                else:
+                    # Análisis detallado: un único escaneo para ambos resultados
+                    scan = self.scan_data(data, metrics=metrics, on_match=on_match, on_keyword=on_match)
+        finally:
+            if match_index is not None:
+                # Un escaneo fallido no deja el chunk a medio indexar
+                if scan is not None:
+                    match_index.end_chunk()
+                else:
+                    match_index.abort_chunk()
+                match_index.close()
+
+        if record is None:
+            record = scan.record(filename, chunk_number)
+        if data is not None:
+            record.records = self.parse_records(data)
+        elif not compressed:
+            record.records = self.parse_file_records(filename)
+        if metrics is not None:
+            record.metrics = metrics.as_dict(time.perf_counter() - chunk_started, record.file_size)
+        return record if compact else record.to_dict()
+
+    def _scan_blocks(self, data, filename, chunk_number, metrics=None):
+        """Escanear data por bloques definidos por contenido, reutilizando los ya vistos
+
+        Los bloques terminan en bytes que ninguna coincidencia puede contener
+        (ver content_blocks), así que sumar contadores e histogramas y
+        concatenar las primeras muestras da el mismo ChunkResult que un
+        escaneo completo. Los resultados de bloque se recuerdan entre chunks
+        (LRU de DEDUP_BLOCK_TABLE entradas); dedup indica cuántos bloques y
+        bytes hubo que escanear.
+        """
+        if metrics is not None:
+            started = time.perf_counter()
+        blocks = content_blocks(data, self.block_breakers())
+        if metrics is not None:
+            metrics.lap('dedup', started, len(data))
+
+        view = memoryview(data)
+        dedup = {'blocks': len(blocks), 'scanned_blocks': 0, 'bytes_scanned': 0}
+
+        def parts():
+            for start, end in blocks:
+                digest = hashlib.blake2b(view[start:end], digest_size=20).digest()
+                block = self._block_results.get(digest)
+                if block is None:
+                    scan = self.scan_data(view[start:end], metrics=metrics)
+                    part = scan.record(None)
+                    block = (part.counts, part.samples, part.keyword_counts, part.institutions,
+                             scan.byte_counts, part.validation)
+                    self._block_results[digest] = block
+                    if len(self._block_results) > DEDUP_BLOCK_TABLE:
+                        self._block_results.popitem(last=False)
+                    dedup['scanned_blocks'] += 1
+                    dedup['bytes_scanned'] += end - start
+                else:
+                    self._block_results.move_to_end(digest)
+                yield block
+
+        record = self._combine_parts(parts(), filename, chunk_number, len(data),
+                                     bytes(view[:16]), bytes(view[-16:]))
+        record.dedup = dedup
+        return record
+
+    def _combine_parts(self, parts, filename, chunk_number, size, head, tail):
+        """ChunkResult de unos datos a partir de los resultados de sus tramos consecutivos
 
-        # Extraer montos en moneda
-        currency_matches = self.patterns['currency_patterns'].findall(data)
-        extracted_data['currency_amounts'] = [match.decode('utf-8', errors='ignore') for match in currency_matches[:5]]
+        Cada parte es (contadores, muestras, palabras clave, instituciones,
+        histograma, validación o None) de un tramo cuyas fronteras ninguna
+        coincidencia cruza, así que sumar contadores e histogramas y
+        concatenar las primeras muestras da lo mismo que escanear los datos
+        de una vez.
+        """
+        layout = self.result_layout()
+        counts = array('q', bytes(8 * len(layout.patterns)))
+        keyword_counts = array('q', bytes(8 * len(layout.keywords)))
+        samples = [[] for _ in layout.patterns]
+        found = set()
+        histogram = None
+        validation = {} if self.validate else None
+        sample_limit = PatternScanner.SAMPLE_LIMIT
 
-        # Buscar instituciones financieras
-        text_content = data.decode('utf-8', errors='ignore')
-        institutions = ['HSBC', 'Citibank', 'Federal Reserve', 'ECB', 'Banco de España']
+        for part_counts, part_samples, part_keywords, part_institutions, part_histogram, \
+                part_validation in parts:
+            for index, count in enumerate(part_counts):
+                counts[index] += count
+                if count and len(samples[index]) < sample_limit:
+                    samples[index].extend(part_samples[index][:sample_limit - len(samples[index])])
+            for index, count in enumerate(part_keywords):
+                keyword_counts[index] += count
+            found.update(part_institutions)
+            if validation is not None and part_validation is not None:
+                _merge_validation(validation, part_validation)
+            if histogram is None:
+                histogram = part_histogram.copy() if np is not None else list(part_histogram)
+            elif np is not None:
+                histogram += part_histogram
+            else:
+                histogram = [a + b for a, b in zip(histogram, part_histogram)]
 
-        for institution in institutions:
-            if institution.lower() in text_content.lower():
-                extracted_data['institutions'].append(institution)
+        return ChunkResult(layout, chunk_number, filename, size, counts,
+                           tuple(tuple(values) for values in samples), keyword_counts,
+                           tuple(inst for inst in self.institutions if inst in found),
+                           head, tail, shannon_entropy(histogram, size), validation=validation)
 
-        # Metadatos del archivo
-        extracted_data['metadata'] = {
-            'file_size': len(data),
-            'first_bytes': binascii.hexlify(data[:16]).decode(),
-            'last_bytes': binascii.hexlify(data[-16:]).decode(),
-            'entropy_score': self.calculate_entropy(data)
+    def _scan_range(self, filepath, start, end, window_size=SCAN_BLOCK_SIZE):
+        """Escanear el rango [start, end) del archivo proyectado en memoria
+
+        Devuelve (parte para _combine_parts, sketches, métricas o None).
+        """
+        metrics = ScanMetrics() if self.instrument else None
+        started = time.perf_counter()
+        with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                scan = self.scan_data(view[start:end], window_size, metrics=metrics)
+                part = scan.record(None)
+                histogram = scan.byte_counts
+                # Ninguna vista del mmap puede sobrevivir a su cierre
+                scan = None
+        if metrics is not None:
+            metrics = metrics.as_dict(time.perf_counter() - started, end - start)
+        return ((part.counts, part.samples, part.keyword_counts, part.institutions, histogram,
+                 part.validation), part.sketches, metrics)
+
+    def scan_file_parallel(self, filepath, jobs=0, chunk_number=None, filename=None,
+                           window_size=SCAN_BLOCK_SIZE):
+        """Escanear un único archivo repartiendo rangos de bytes entre jobs procesos
+
+        El archivo se divide en hasta jobs * PARALLEL_RANGES_PER_JOB rangos
+        (de al menos PARALLEL_MIN_RANGE bytes) con fronteras justo detrás de
+        un byte que ninguna coincidencia ni palabra clave puede contener (ver
+        split_ranges): ningún resultado cruza una frontera, así que no hace
+        falta solape ni descartar coincidencias repetidas, y la combinación
+        (ver _combine_parts) es idéntica al escaneo en serie. Cada proceso
+        proyecta el archivo con mmap y lee solo su rango. jobs <= 0 usa todos
+        los núcleos. Solo admite sampling='first'; los archivos comprimidos
+        se escanean en serie en flujo. Devuelve un ChunkResult o None si el
+        archivo está vacío.
+        """
+        if self.sampling != 'first':
+            raise ValueError("el escaneo en paralelo solo admite sampling='first'")
+        if jobs is None or jobs <= 0:
+            jobs = os.cpu_count() or 1
+        filename = filename or filepath
+        chunk_started = time.perf_counter()
+        if not os.path.exists(filepath):
+            print(f"❌ Archivo no encontrado: {filepath}")
+            return None
+
+        if compression_format(filepath) is not None:
+            scan = self._scan_file(filepath, records=True,
+                                   metrics=ScanMetrics() if self.instrument else None)
+            if scan is None or not scan.consumed:
+                return None
+            record = scan.record(filename, chunk_number)
+            if scan.metrics is not None:
+                record.metrics = scan.metrics.as_dict(time.perf_counter() - chunk_started, record.file_size)
+            return record
+
+        with open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return None
+            head = f.read(16)
+            f.seek(max(size - 16, 0))
+            tail = f.read(16)
+            parts = max(1, min(jobs * PARALLEL_RANGES_PER_JOB, size // PARALLEL_MIN_RANGE))
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                ranges = split_ranges(mapped, parts, self.block_breakers())
+        tasks = [(filepath, start, end, window_size) for start, end in ranges]
+
+        if jobs > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)),
+                                     initializer=_init_chunk_worker, initargs=(self,)) as pool:
+                results = list(pool.map(_scan_range_worker, tasks))
+        else:
+            results = [self._scan_range(*task) for task in tasks]
+
+        sketches = {} if self.sketches else None
+        metrics = ScanMetrics() if self.instrument else None
+        for _, part_sketches, part_metrics in results:
+            if sketches is not None:
+                _merge_sketches(sketches, part_sketches)
+            if metrics is not None:
+                metrics.merge(part_metrics)
+
+        record = self._combine_parts((part for part, _, _ in results), filename, chunk_number,
+                                     size, head, tail)
+        record.sketches = sketches
+        record.records = self.parse_file_records(filepath)
+        if metrics is not None:
+            record.metrics = metrics.as_dict(time.perf_counter() - chunk_started, size)
+        return record
+
+    def analyze_file_parallel(self, filepath, jobs=0, filename=None):
+        """Como analyze_file_streaming pero con scan_file_parallel: (analysis, structured) o None"""
+        record = self.scan_file_parallel(filepath, jobs, filename=filename)
+        if record is None:
+            return None
+        return record.analysis_dict(), record.structured_dict()
+
+    def pattern_set_version(self):
+        """Huella de la configuración de escaneo (patrones, palabras clave, instituciones)"""
+        config = {
+            'format': RESULT_FORMAT_VERSION,
+            'patterns': [[name, pattern.pattern.hex(), pattern.flags]
+                         for name, pattern in self.patterns.items()],
+            'keywords': self.financial_keywords,
+            'institutions': self.institutions,
+            'sampling': [self.sampling, self.sample_seed],
+            'records': [layout.name for layout in self.record_layouts]
         }
+        if self.sketches:
+            config['sketches'] = [SKETCH_PRECISION, SKETCH_DEPTH, SKETCH_WIDTH, SKETCH_CANDIDATES]
+        if self.validate:
+            config['validate'] = sorted(VALIDATED_PATTERNS.items())
+        return hashlib.sha256(json.dumps(config).encode('utf-8')).hexdigest()[:16]
 
-        return extracted_data
+    def _run_chunks(self, chunks, jobs, archive=False):
+        """Analizar chunks (o miembros de un zip) en serie o en un pool de procesos, entregándolos en orden"""
+        if jobs is not None and jobs <= 0:
+            jobs = os.cpu_count() or 1
 
-    def calculate_entropy(self, data):
-        """Calcular entropía básica para detectar datos encriptados"""
-        if len(data) == 0:
-            return 0
+        if jobs and jobs > 1 and len(chunks) > 1:
+            worker = _analyze_member_worker if archive else _analyze_chunk_worker
+            with ProcessPoolExecutor(max_workers=min(jobs, len(chunks)),
+                                     initializer=_init_chunk_worker, initargs=(self,)) as pool:
+                # map conserva el orden de envío: la combinación es determinista
+                yield from pool.map(worker, chunks)
+        elif archive:
+            for chunk in chunks:
+                yield self.analyze_member(*chunk)
+        else:
+            # Leer los chunks siguientes mientras se analiza el actual
+            loaded = prefetched(((chunk, self._preload(chunk)) for chunk in chunks), self.prefetch)
+            try:
+                for chunk, data in loaded:
+                    yield self.analyze_chunk(*chunk, compact=True, data=data)
+            finally:
+                loaded.close()
 
-        # Calcular frecuencia de bytes
-        byte_counts = Counter(data)
-        entropy = 0
+    def _preload(self, chunk):
+        """Contenido de un chunk para analyze_chunk(data=...), o None si se escanea en flujo"""
+        filename, streaming = chunk[1], chunk[2]
+        if streaming or not self.prefetch:
+            return None
+        try:
+            if compression_format(filename) is not None:
+                return None
+            with open(filename, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def analyze_member(self, chunk_number, member, archive, window_size=DEFAULT_WINDOW_SIZE,
+                       overlap=DEFAULT_OVERLAP):
+        """Analizar un miembro de un zip descomprimiéndolo en flujo (ChunkResult o None si está vacío)"""
+        metrics = ScanMetrics() if self.instrument else None
+        if metrics is not None:
+            chunk_started = time.perf_counter()
+        scan = self._scan_file(archive, window_size, overlap, metrics=metrics, member=member,
+                               records=True)
+        if scan is None or not scan.consumed:
+            return None
+        record = scan.record(f"{archive}:{member}", chunk_number)
+        if metrics is not None:
+            record.metrics = metrics.as_dict(time.perf_counter() - chunk_started, record.file_size)
+        return record
+
+    def analyze_archive(self, archive, window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP,
+                        jobs=1, progress=None, output=None, compact=False):
+        """Analizar cada miembro de un zip como un chunk, sin extraerlo a disco
 
-        for count in byte_counts.values():
-            p = count / len(data)
-            if p > 0:
-                entropy -= p * (p).bit_length()
+        Cada miembro se descomprime en flujo por ventanas, así que la memoria
+        no depende de su tamaño. El número de chunk sale del nombre del
+        miembro (decrypted_chunk_7.bin -> 7) o, si no tiene o está repetido,
+        es el siguiente libre; los chunks se entregan por número. jobs, progress, output y compact funcionan como
+        en analyze_all_chunks y el resultado tiene su mismo formato.
+        """
+        if overlap < self.min_overlap():
+            raise ValueError(f"overlap debe ser al menos {self.min_overlap()} bytes")
 
-        return entropy
+        chunks = []
+        taken = set()
+        for member in zip_members(archive):
+            digits = re.findall(r'\d+', os.path.basename(member))
+            number = int(digits[-1]) if digits else None
+            if number is None or number in taken:
+                number = max(taken | {0}) + 1
+            taken.add(number)
+            chunks.append((number, member, archive, window_size, overlap))
+        chunks.sort()
 
-    def analyze_all_chunks(self, chunk_count=50):
-        """Analizar todos los chunks disponibles"""
         all_results = {
             'summary': {},
             'detailed_analysis': [],
             'global_patterns': defaultdict(int)
         }
+        batch_started = time.perf_counter()
+        metrics = ScanMetrics() if self.instrument else None
+        sketches = {} if self.sketches else None
+        computed = iter(self._run_chunks(chunks, jobs, archive=True))
+        stream = open(output, 'w', encoding='utf-8') if output is not None else None
+        try:
+            files_with_data, bytes_done = self._collect_chunks(
+                chunks, set(), computed, None, {}, None, all_results, stream, metrics, progress,
+                batch_started, compact, sketches=sketches)
+        finally:
+            if stream is not None:
+                stream.close()
 
-        total_files = 0
-        files_with_data = 0
+        if stream is not None:
+            all_results = self.summarize_stream(output)
+        else:
+            all_results['summary'] = self._build_summary(len(chunks), files_with_data,
+                                                         all_results['global_patterns'], sketches,
+                                                         all_results.get('global_validation'))
+        if metrics is not None:
+            all_results['summary']['metrics'] = metrics.as_dict(time.perf_counter() - batch_started,
+                                                                bytes_done)
+        return all_results
+
+    def analyze_all_chunks(self, chunk_count=50, streaming=False,
+                           window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP, jobs=1,
+                           cache=None, progress=None, output=None, resume=False, index=None,
+                           compact=False, dedup=False):
+        """Analizar todos los chunks disponibles
+
+        Con streaming=True cada chunk se escanea por ventanas
+        (ver analyze_file_streaming) en lugar de cargarse entero en memoria.
+        Con jobs > 1 los chunks se reparten en un pool de procesos (jobs <= 0
+        usa todos los núcleos); los resultados se combinan en orden de chunk
+        y coinciden exactamente con la ejecución en serie.
+        Con cache (un ResultCache) solo se escanean los chunks nuevos o
+        modificados; el resumen incluye los aciertos y fallos de la caché.
+        progress(evento), si se indica, se llama al terminar cada chunk.
+        Con instrument=True el resumen incluye los tiempos agregados.
+        Con output cada chunk se escribe como una línea NDJSON en cuanto
+        termina y no se guarda en memoria; el resultado devuelto se
+        reconstruye releyendo el archivo (ver summarize_stream). Con
+        resume=True se conservan los registros ya escritos y solo se
+        analizan los chunks que faltan.
+        Con index (ruta de un MatchIndex) se indexan todas las coincidencias;
+        un resultado de la caché solo se reutiliza si el chunk ya está
+        indexado con el mismo contenido.
+        Con compact=True detailed_analysis guarda ChunkResult en lugar de
+        diccionarios (mucha menos memoria con miles de chunks); generate_report
+        acepta ambas formas.
+        Con dedup=True cada contenido distinto se analiza una sola vez (hash
+        BLAKE2b del chunk) y los chunks idénticos reutilizan su resultado; con
+        block_dedup en el analizador también se reutilizan los bloques
+        repetidos dentro y entre chunks. El resumen incluye entonces la
+        proporción de bytes que no hubo que escanear.
+        Con sketches en el analizador el resumen incluye, por patrón, los
+        valores distintos y más frecuentes estimados de todos los chunks.
+        """
+        all_results = {
+            'summary': {},
+            'detailed_analysis': [],
+            'global_patterns': defaultdict(int)
+        }
+
+        if streaming and overlap < self.min_overlap():
+            raise ValueError(f"overlap debe ser al menos {self.min_overlap()} bytes")
 
+        chunks = []
         for i in range(1, chunk_count + 1):
-            filename = f"decrypted_chunk_{i}.bin"
+            # El chunk sin comprimir o, si no existe, su versión comprimida
+            for suffix in ('',) + COMPRESSED_SUFFIXES:
+                filename = f"decrypted_chunk_{i}.bin{suffix}"
+                if os.path.exists(filename):
+                    chunks.append((i, filename, streaming, window_size, overlap, index))
+                    break
+
+        if output is not None and resume:
+            # Reanudar: saltar los chunks que ya tienen registro
+            done = self._prepare_stream(output)
+            chunks = [chunk for chunk in chunks if chunk[0] not in done]
+
+        total_files = len(chunks)
+        batch_started = time.perf_counter()
+        metrics = ScanMetrics() if self.instrument else None
+
+        # Deduplicación: los chunks con el mismo hash que uno anterior no se
+        # analizan ni se buscan en la caché, reutilizan el resultado de ese
+        duplicates = {}
+        if dedup:
+            originals = {}
+            for chunk in chunks:
+                digest = cache._key(chunk[1])[3] if cache is not None else ResultCache.file_digest(chunk[1])
+                if digest in originals:
+                    duplicates[chunk[0]] = originals[digest]
+                else:
+                    originals[digest] = chunk[0]
+        unique = [chunk for chunk in chunks if chunk[0] not in duplicates]
+        dedup_stats = {'chunks': len(chunks), 'duplicate_chunks': len(duplicates), 'blocks': 0,
+                       'duplicate_blocks': 0, 'bytes': 0, 'bytes_scanned': 0} \
+            if dedup or self.block_dedup else None
+
+        # Consultar la caché antes de repartir el trabajo. Solo se decide
+        # qué chunks son aciertos; cada resultado se lee al escribirlo, de
+        # modo que la memoria no crece con el número de aciertos
+        cache_start = cache.snapshot() if cache is not None else None
+        cached = set()
+        keys = {}
+        version = None
+        pending = unique
+        if cache is not None:
+            version = self.pattern_set_version()
+            match_index = MatchIndex(index) if index is not None else None
+            pending = []
+            for chunk in unique:
+                hit, keys[chunk[0]] = cache.probe(chunk[1], version)
+                if hit and match_index is not None \
+                        and not match_index.is_current(chunk[0], chunk[1], version) \
+                        and cache.fetch(keys[chunk[0]], version) != EMPTY_RESULT:
+                    # Hay que escanearlo igualmente para indexarlo
+                    hit = False
+                if hit:
+                    cached.add(chunk[0])
+                else:
+                    pending.append(chunk)
+            if match_index is not None:
+                match_index.close()
+
+        computed = iter(self._run_chunks(pending, jobs))
+        stream = open(output, 'a' if resume else 'w', encoding='utf-8') if output is not None else None
+        sketches = {} if self.sketches else None
+
+        try:
+            files_with_data, bytes_done = self._collect_chunks(
+                chunks, cached, computed, cache, keys, version,
+                all_results, stream, metrics, progress, batch_started, compact,
+                duplicates, dedup_stats, sketches)
+        finally:
+            if stream is not None:
+                stream.close()
+
+        if stream is not None:
+            all_results = self.summarize_stream(output)
+        else:
+            all_results['summary'] = self._build_summary(total_files, files_with_data,
+                                                         all_results['global_patterns'], sketches,
+                                                         all_results.get('global_validation'))
+
+        if cache is not None:
+            all_results['summary']['cache'] = cache.stats(cache_start)
+        if dedup_stats is not None:
+            scanned = dedup_stats['bytes_scanned']
+            dedup_stats['ratio'] = dedup_stats['bytes'] / scanned if scanned else 1.0
+            dedup_stats['saved_pct'] = (100 - scanned / dedup_stats['bytes'] * 100) \
+                if dedup_stats['bytes'] else 0
+            all_results['summary']['dedup'] = dedup_stats
+        if metrics is not None:
+            all_results['summary']['metrics'] = metrics.as_dict(time.perf_counter() - batch_started,
+                                                                bytes_done)
+
+        return all_results
+
+    def _collect_chunks(self, chunks, cached, computed, cache, keys, version,
+                        all_results, stream, metrics, progress, batch_started, compact=False,
+                        duplicates=None, dedup_stats=None, sketches=None):
+        """Combinar en orden los resultados de la caché y los recién calculados (ChunkResult)
 
-            if os.path.exists(filename):
-                total_files += 1
-                data = self.read_binary_file(filename)
+        duplicates asigna a cada chunk repetido el chunk anterior con el mismo
+        contenido; ese resultado se guarda solo hasta entregar su último
+        duplicado. dedup_stats acumula bloques y bytes escaneados y sketches
+        ({patrón: PatternSketch}) los sketches de los chunks. Los contadores
+        de validación se acumulan en all_results['global_validation'].
+        """
+        total_files = len(chunks)
+        files_with_data = 0
+        bytes_done = 0
+        duplicates = duplicates or {}
+        remaining = Counter(duplicates.values())
+        shared = {}
+        match_index = None
+        if duplicates and chunks[0][5] is not None:
+            match_index = MatchIndex(chunks[0][5])
+            version = version or self.pattern_set_version()
+
+        for completed, chunk in enumerate(chunks, 1):
+            stored = cache.fetch(keys[chunk[0]], version) if chunk[0] in cached else None
+            if chunk[0] in duplicates:
+                source = duplicates[chunk[0]]
+                chunk_result = shared[source]
+                remaining[source] -= 1
+                if not remaining[source]:
+                    del shared[source]
+                if chunk_result is not None:
+                    chunk_result = chunk_result.relabel(chunk[0], chunk[1])
+                    if match_index is not None and not match_index.is_current(chunk[0], chunk[1], version):
+                        match_index.copy_chunk(source, chunk[0], chunk[1], version)
+            elif stored is not None:
+                chunk_result = None
+                if stored != EMPTY_RESULT:
+                    chunk_result = ChunkResult.from_dict(stored, self.result_layout())
+                    chunk_result.chunk_number = chunk[0]
+                    chunk_result.filename = chunk[1]
+            elif chunk[0] in cached:
+                # Expulsado de la caché mientras tanto: analizarlo aquí
+                chunk_result = self.analyze_chunk(*chunk, compact=True)
+            else:
+                chunk_result = next(computed)
+                if cache is not None:
+                    # Las métricas son de esta ejecución: no se guardan en la caché
+                    stored = chunk_result.to_dict() if chunk_result is not None else None
+                    if stored is not None:
+                        stored.pop('metrics', None)
+                    cache.store(keys[chunk[0]], version, stored)
+
+            if remaining.get(chunk[0]):
+                shared[chunk[0]] = chunk_result
+
+            if chunk_result is not None:
+                bytes_done += chunk_result.file_size
+                if dedup_stats is not None:
+                    dedup_stats['bytes'] += chunk_result.file_size
+                    if chunk[0] not in duplicates:
+                        blocks = chunk_result.dedup
+                        if blocks is not None:
+                            dedup_stats['blocks'] += blocks['blocks']
+                            dedup_stats['duplicate_blocks'] += blocks['blocks'] - blocks['scanned_blocks']
+                        dedup_stats['bytes_scanned'] += blocks['bytes_scanned'] if blocks is not None \
+                            else chunk_result.file_size
+                if metrics is not None and chunk_result.metrics is not None:
+                    metrics.merge(chunk_result.metrics)
 
-                if data:
-                    files_with_data += 1
+            if progress is not None:
+                elapsed = time.perf_counter() - batch_started
+                progress({
+                    'event': 'chunk',
+                    'chunk_number': chunk[0],
+                    'completed': completed,
+                    'total': total_files,
+                    'bytes': chunk_result.file_size if chunk_result else 0,
+                    'cached': chunk[0] in cached,
+                    'duplicate': chunk[0] in duplicates,
+                    'elapsed': elapsed,
+                    'mb_per_s': _mb_per_s(bytes_done, elapsed)
+                })
 
-                    # Análisis detallado
-                    analysis = self.analyze_patterns(data, filename)
-                    structured = self.extract_structured_data(data, filename)
+            if stream is not None:
+                # Un registro por chunk, escrito en cuanto termina
+                if chunk_result is not None:
+                    record = chunk_result.to_dict()
+                else:
+                    record = {'chunk_number': chunk[0], 'filename': chunk[1], 'empty': True}
+                stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stream.flush()
+                continue
 
-                    chunk_result = {
-                        'chunk_number': i,
-                        'analysis': analysis,
-                        'structured_data': structured
-                    }
+            if chunk_result is None:
+                continue
 
-                    all_results['detailed_analysis'].append(chunk_result)
+            files_with_data += 1
+            all_results['detailed_analysis'].append(chunk_result if compact else chunk_result.to_dict())
 
-                    # Acumular patrones globales
-                    for pattern_type, pattern_data in analysis['patterns_found'].items():
-                        all_results['global_patterns'][pattern_type] += pattern_data['count']
+            # Acumular patrones globales
+            for pattern_type, count in chunk_result.pattern_counts().items():
+                all_results['global_patterns'][pattern_type] += count
+            if sketches is not None and chunk_result.sketches is not None:
+                _merge_sketches(sketches, chunk_result.sketches)
+            if chunk_result.validation is not None:
+                _merge_validation(all_results.setdefault('global_validation', {}), chunk_result.validation)
 
-        # Resumen final
-        all_results['summary'] = {
+        if match_index is not None:
+            match_index.close()
+        return files_with_data, bytes_done
+
+    def _build_summary(self, total_files, files_with_data, global_patterns, sketches=None,
+                       validation=None):
+        """Resumen final a partir de los contadores (sketches y validación) globales"""
+        summary = {
             'total_chunks_analyzed': total_files,
             'chunks_with_data': files_with_data,
             'success_rate': (files_with_data / total_files * 100) if total_files > 0 else 0,
-            'most_common_patterns': dict(sorted(all_results['global_patterns'].items(),
+            'most_common_patterns': dict(sorted(global_patterns.items(),
                                                key=lambda x: x[1], reverse=True)[:10])
         }
+        if sketches is not None:
+            summary['sketches'] = {name: sketches[name].summary() for name in self.patterns
+                                   if name in sketches and sketches[name].total}
+        if validation:
+            summary['validation'] = {}
+            for name in self.patterns:
+                if name in validation:
+                    counts = validation[name]
+                    checked = counts['valid'] + counts['invalid']
+                    summary['validation'][name] = dict(
+                        counts, valid_pct=counts['valid'] / checked * 100 if checked else 0)
+        return summary
+
+    @staticmethod
+    def _prepare_stream(path):
+        """Chunks ya escritos en un NDJSON; descarta una última línea incompleta"""
+        done = set()
+        if not os.path.exists(path):
+            return done
+
+        valid_end = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                done.add(record['chunk_number'])
+                valid_end += len(line)
+
+        if valid_end != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_end)
+        return done
+
+    @staticmethod
+    def iter_stream(path):
+        """Registros de un NDJSON de resultados, uno por chunk"""
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+
+    def summarize_stream(self, path, detail_limit=5):
+        """Reconstruir el resultado de analyze_all_chunks releyendo un NDJSON
+
+        Solo se guardan en memoria los detail_limit primeros chunks (los que
+        muestra el reporte) y los contadores globales. Si un chunk tiene
+        varios registros (el modo vigilancia reescribe los chunks que
+        cambian) cuenta solo el último, y un registro 'deleted' lo elimina.
+        """
+        all_results = {
+            'summary': {},
+            'detailed_analysis': [],
+            'global_patterns': defaultdict(int)
+        }
+        total_files = 0
+        files_with_data = 0
+        bytes_done = 0
+        metrics = ScanMetrics()
+        seconds = 0.0
+        sketches = {} if self.sketches else None
+        validation = {}
+
+        # Primera pasada: posición del último registro de cada chunk
+        last = {record['chunk_number']: position
+                for position, record in enumerate(self.iter_stream(path))}
+
+        for position, record in enumerate(self.iter_stream(path)):
+            if last[record['chunk_number']] != position or record.get('deleted'):
+                continue
+            total_files += 1
+            if record.get('empty'):
+                continue
 
+            files_with_data += 1
+            bytes_done += record['analysis']['file_size']
+            if len(all_results['detailed_analysis']) < detail_limit:
+                all_results['detailed_analysis'].append(record)
+            for pattern_type, pattern_data in record['analysis']['patterns_found'].items():
+                all_results['global_patterns'][pattern_type] += pattern_data['count']
+            if 'metrics' in record:
+                metrics.merge(record['metrics'])
+                seconds += record['metrics']['seconds']
+            if sketches is not None and 'sketches' in record:
+                _merge_sketches(sketches, {name: PatternSketch.from_dict(sketch)
+                                           for name, sketch in record['sketches'].items()})
+            if 'validation' in record['structured_data']:
+                _merge_validation(validation, record['structured_data']['validation'])
+
+        all_results['summary'] = self._build_summary(total_files, files_with_data,
+                                                     all_results['global_patterns'], sketches,
+                                                     validation)
+        if metrics.stages:
+            all_results['summary']['metrics'] = metrics.as_dict(seconds, bytes_done)
+        all_results['output'] = path
         return all_results
 
-    def generate_report(self, results):
-        """Generar reporte completo"""
+    def generate_report(self, results=None, stream=None):
+        """Generar reporte completo
+
+        Con stream (ruta de un NDJSON de analyze_all_chunks) el resumen se
+        reconstruye releyendo el archivo.
+        """
+        if stream is not None:
+            results = self.summarize_stream(stream)
+
         report = f"""
 {'='*80}
 REPORTE DE ANÁLISIS DTC1B - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
@@ -205,17 +3540,51 @@ REPORTE DE ANÁLISIS DTC1B - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 • Chunks totales analizados: {results['summary']['total_chunks_analyzed']}
 • Chunks con datos válidos: {results['summary']['chunks_with_data']}
 • Tasa de éxito: {results['summary']['success_rate']:.1f}%
-
-🔍 PATRONES MÁS FRECUENTES:
 """
 
+        if 'cache' in results['summary']:
+            cache_stats = results['summary']['cache']
+            report += (f"• Caché: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos "
+                       f"({cache_stats['hit_rate']:.1f}%)\n")
+
+        if 'checkpoints' in results['summary']:
+            checkpoint_stats = results['summary']['checkpoints']
+            report += (f"• Puntos de control: {checkpoint_stats['resumed']} archivos retomados, "
+                       f"{checkpoint_stats['rescanned']} desde el principio "
+                       f"({checkpoint_stats['saved_pct']:.1f}% de bytes sin releer)\n")
+
+        if 'dedup' in results['summary']:
+            dedup_stats = results['summary']['dedup']
+            report += (f"• Deduplicación: {dedup_stats['duplicate_chunks']} chunks y "
+                       f"{dedup_stats['duplicate_blocks']} bloques repetidos, "
+                       f"ratio {dedup_stats['ratio']:.2f}x ({dedup_stats['saved_pct']:.1f}% sin escanear)\n")
+
+        if 'metrics' in results['summary']:
+            report += self._format_metrics(results['summary']['metrics'])
+
+        report += "\n🔍 PATRONES MÁS FRECUENTES:\n"
+
         for pattern, count in results['summary']['most_common_patterns'].items():
             report += f"• {pattern}: {count} ocurrencias\n"
 
+        if results['summary'].get('sketches'):
+            report += "\n🧮 VALORES DISTINTOS Y MÁS FRECUENTES (estimados):\n"
+            for pattern, sketch in results['summary']['sketches'].items():
+                top = ', '.join(f"{value[:30]} ({count})" for value, count in sketch['top'][:3])
+                report += f"• {pattern}: ~{sketch['distinct']} distintos de {sketch['values']}; {top}\n"
+
+        if results['summary'].get('validation'):
+            report += "\n✅ VALIDACIÓN DE CANDIDATOS (dígitos de control y país):\n"
+            for pattern, counts in results['summary']['validation'].items():
+                report += (f"• {pattern}: {counts['valid']} válidos, {counts['invalid']} descartados "
+                           f"({counts['valid_pct']:.1f}% válidos)\n")
+
         report += f"\n{'='*80}\n"
 
         # Detalles por chunk
         for chunk_result in results['detailed_analysis'][:5]:  # Mostrar primeros 5
+            if isinstance(chunk_result, ChunkResult):
+                chunk_result = chunk_result.to_dict()
             chunk = chunk_result['chunk_number']
             analysis = chunk_result['analysis']
             structured = chunk_result['structured_data']
@@ -228,18 +3597,760 @@ CHUNK {chunk}:
 • Códigos bancarios: {', '.join(structured['bank_codes'][:3]) if structured['bank_codes'] else 'Ninguno'}
 • Códigos SWIFT: {', '.join(structured['swift_codes']) if structured['swift_codes'] else 'Ninguno'}
 """
+            if 'metrics' in chunk_result:
+                chunk_metrics = chunk_result['metrics']
+                report += f"• Rendimiento: {chunk_metrics['mb_per_s']:.2f} MB/s ({chunk_metrics['seconds']:.3f} s)\n"
 
         return report
 
-def main():
+    def _format_metrics(self, metrics):
+        """Bloque del reporte con tiempos por etapa y patrones más lentos"""
+        text = (f"\n⏱️ RENDIMIENTO: {metrics['bytes']} bytes en {metrics['seconds']:.3f} s "
+                f"({metrics['mb_per_s']:.2f} MB/s)\n")
+        for stage, entry in sorted(metrics['stages'].items(), key=lambda x: x[1]['seconds'], reverse=True):
+            text += f"• {stage}: {entry['seconds']:.3f} s, {entry['mb_per_s']:.2f} MB/s\n"
+
+        slowest = sorted(metrics['patterns'].items(), key=lambda x: x[1]['seconds'], reverse=True)[:5]
+        for name, entry in slowest:
+            text += (f"• regex {name}: {entry['seconds']:.3f} s, {entry['matches']} coincidencias, "
+                     f"{entry['mb_per_s']:.2f} MB/s\n")
+        return text
+
+class ChunkWatcher:
+    """Ingesta continua de chunks que van apareciendo en un directorio
+
+    Cada sondeo lista el directorio (solo metadatos: nombre, tamaño y
+    mtime) y analiza una única vez cada archivo que coincide con pattern
+    en cuanto está completo: su tamaño y mtime no cambian entre dos sondeos
+    o no se ha modificado en settle segundos. Los archivos ya analizados no
+    se vuelven a leer salvo que cambien; en ese caso su aportación a los
+    totales se sustituye, y un archivo borrado deja de contar. En la salida
+    NDJSON un chunk reescrito o borrado añade un registro nuevo que
+    sustituye al anterior (ver summarize_stream). Cada ruta recibe un
+    número de chunk único. Los totales globales se mantienen en marcha y
+    results() devuelve el mismo formato que analyze_all_chunks. Con index
+    (ruta de un MatchIndex) las coincidencias de cada chunk se indexan. Con
+    checkpoints (un ScanCheckpoints) un archivo que ha crecido por el final
+    se escanea solo desde donde se quedó (ver DTCAnalyzer.scan_appended), en
+    lugar de la caché, que tendría que leerlo entero para calcular su hash.
+    """
+
+    def __init__(self, analyzer, directory='.', pattern='decrypted_chunk_*.bin', settle=2.0,
+                 streaming=False, window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP,
+                 cache=None, output=None, progress=None, detail_limit=5, index=None,
+                 checkpoints=None):
+        if checkpoints is not None and index is not None:
+            raise ValueError("checkpoints no admite index: el índice necesita todas las coincidencias")
+        self.analyzer = analyzer
+        self.checkpoints = checkpoints
+        self.index = index
+        self.directory = directory
+        self.pattern = pattern
+        self.settle = settle
+        self.streaming = streaming
+        self.window_size = window_size
+        self.overlap = overlap
+        self.cache = cache
+        self.version = analyzer.pattern_set_version() if cache is not None or index is not None else None
+        self.cache_start = cache.snapshot() if cache is not None else None
+        self.progress = progress
+        self.detail_limit = detail_limit
+        self.stream = open(output, 'w', encoding='utf-8') if output is not None else None
+
+        self.seen = {}       # ruta -> (tamaño, mtime_ns) del último sondeo
+        self.processed = {}  # ruta -> (firma analizada, patrones, con datos, sketches, validación)
+        self.global_patterns = defaultdict(int)
+        self.detailed_analysis = []
+        self.chunks_analyzed = 0
+        self.bytes_done = 0
+        self.metrics = ScanMetrics() if analyzer.instrument else None
+        self.started = time.perf_counter()
+        self._next_number = 0
+        self.numbers = {}    # ruta -> número de chunk (único por ruta)
+
+    def _candidates(self):
+        """Archivos del directorio que coinciden con el patrón, por orden de nombre"""
+        with os.scandir(self.directory) as entries:
+            found = [(entry.name, entry.path, entry.stat()) for entry in entries
+                     if fnmatch.fnmatch(entry.name, self.pattern) and entry.is_file()]
+        found.sort(key=lambda item: _natural_key(item[0]))
+        return found
+
+    def _chunk_number(self, name, path):
+        """Número único del chunk de path, según su nombre si está libre (decrypted_chunk_7.bin -> 7)"""
+        number = self.numbers.get(path)
+        if number is not None:
+            return number
+
+        digits = re.findall(r'\d+', name)
+        number = int(digits[-1]) if digits else None
+        taken = set(self.numbers.values())
+        if number is None or number in taken:
+            # Sin número o ya usado por otro archivo (a_1.bin y b_1.bin)
+            number = max(taken | {self._next_number}) + 1
+            self._next_number = number
+        self.numbers[path] = number
+        return number
+
+    def poll(self):
+        """Un sondeo: analizar los chunks completos nuevos o modificados (lista de ChunkResult)"""
+        now = time.time_ns()
+        current = {}
+        ready = []
+
+        for name, path, st in self._candidates():
+            signature = (st.st_size, st.st_mtime_ns)
+            current[path] = signature
+            done = self.processed.get(path)
+            if done is not None and done[0] == signature:
+                continue
+            stable = self.seen.get(path) == signature
+            quiet = now - st.st_mtime_ns >= self.settle * 1e9
+            if stable or quiet:
+                ready.append((name, path, signature))
+
+        for path in [path for path in self.processed if path not in current]:
+            self._forget(path)
+
+        self.seen = current
+        return [self._ingest(name, path, signature) for name, path, signature in ready]
+
+    def _forget(self, path):
+        """Quitar de los totales un chunk que ya no existe"""
+        _, counts, _, _, _ = self.processed.pop(path)
+        for pattern_type, count in counts.items():
+            self.global_patterns[pattern_type] -= count
+        self.detailed_analysis = [r for r in self.detailed_analysis if r.filename != path]
+        if self.index is not None:
+            match_index = MatchIndex(self.index)
+            match_index.remove_chunk(self.numbers[path])
+            match_index.close()
+        if self.stream is not None:
+            record = {'chunk_number': self.numbers[path], 'filename': path, 'deleted': True}
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.stream.flush()
+
+    def _ingest(self, name, path, signature):
+        """Analizar un chunk completo y actualizar los totales"""
+        chunk_number = self._chunk_number(name, path)
+        cached = False
+        chunk_result = None
+        key = None
+        if self.cache is not None and self.checkpoints is None:
+            stored, key = self.cache.lookup(path, self.version)
+            if stored is not None and stored != EMPTY_RESULT and self.index is not None:
+                match_index = MatchIndex(self.index)
+                if not match_index.is_current(chunk_number, path, self.version):
+                    stored = None
+                match_index.close()
+            cached = stored is not None
+            if cached and stored != EMPTY_RESULT:
+                chunk_result = ChunkResult.from_dict(stored, self.analyzer.result_layout())
+        if self.checkpoints is not None:
+            chunk_result = self.analyzer.scan_appended(path, self.checkpoints, chunk_number,
+                                                       window_size=self.window_size, overlap=self.overlap)
+        elif not cached:
+            chunk_result = self.analyzer.analyze_chunk(chunk_number, path, self.streaming,
+                                                       self.window_size, self.overlap, self.index, True)
+            if self.cache is not None:
+                stored = chunk_result.to_dict() if chunk_result is not None else None
+                if stored is not None:
+                    stored.pop('metrics', None)
+                self.cache.store(key, self.version, stored)
+        if chunk_result is not None:
+            chunk_result.chunk_number = chunk_number
+            chunk_result.filename = path
+
+        # Sustituir la aportación anterior si el archivo ha cambiado
+        previous = self.processed.pop(path, None)
+        if previous is not None:
+            for pattern_type, count in previous[1].items():
+                self.global_patterns[pattern_type] -= count
+        else:
+            self.chunks_analyzed += 1
+
+        counts = {}
+        if chunk_result is not None:
+            counts = chunk_result.pattern_counts()
+            for pattern_type, count in counts.items():
+                self.global_patterns[pattern_type] += count
+            self.bytes_done += chunk_result.file_size
+            if self.metrics is not None and chunk_result.metrics is not None:
+                self.metrics.merge(chunk_result.metrics)
+
+        # Un chunk reescrito sustituye su entrada anterior en el detalle
+        position = next((i for i, r in enumerate(self.detailed_analysis) if r.filename == path), None)
+        if position is not None:
+            if chunk_result is not None:
+                self.detailed_analysis[position] = chunk_result
+            else:
+                del self.detailed_analysis[position]
+        elif chunk_result is not None and len(self.detailed_analysis) < self.detail_limit:
+            self.detailed_analysis.append(chunk_result)
+        self.processed[path] = (signature, counts, chunk_result is not None,
+                                chunk_result.sketches if chunk_result is not None else None,
+                                chunk_result.validation if chunk_result is not None else None)
+
+        if self.stream is not None:
+            if chunk_result is not None:
+                record = chunk_result.to_dict()
+            else:
+                record = {'chunk_number': chunk_number, 'filename': path, 'empty': True}
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.stream.flush()
+
+        if self.progress is not None:
+            elapsed = time.perf_counter() - self.started
+            self.progress({
+                'event': 'chunk',
+                'chunk_number': chunk_number,
+                'completed': self.chunks_analyzed,
+                'total': None,
+                'bytes': chunk_result.file_size if chunk_result else 0,
+                'cached': cached,
+                'elapsed': elapsed,
+                'mb_per_s': _mb_per_s(self.bytes_done, elapsed)
+            })
+        return chunk_result
+
+    def run(self, poll_interval=1.0, idle_timeout=None, max_chunks=None):
+        """Sondear hasta Ctrl+C, idle_timeout segundos sin chunks nuevos o max_chunks analizados"""
+        last_activity = time.monotonic()
+        try:
+            while True:
+                if self.poll():
+                    last_activity = time.monotonic()
+                if max_chunks is not None and self.chunks_analyzed >= max_chunks:
+                    break
+                if idle_timeout is not None and time.monotonic() - last_activity >= idle_timeout:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        return self.results()
+
+    def results(self):
+        """Totales en marcha con el formato de analyze_all_chunks"""
+        files_with_data = sum(1 for entry in self.processed.values() if entry[2])
+        global_patterns = defaultdict(int, {k: v for k, v in self.global_patterns.items() if v})
+        # Un sketch no admite restas: se combinan los de los chunks vigentes
+        sketches = None
+        if self.analyzer.sketches:
+            sketches = {}
+            for entry in self.processed.values():
+                if entry[3] is not None:
+                    _merge_sketches(sketches, entry[3])
+        validation = {}
+        for entry in self.processed.values():
+            if entry[4] is not None:
+                _merge_validation(validation, entry[4])
+        all_results = {
+            'summary': self.analyzer._build_summary(len(self.processed), files_with_data,
+                                                    global_patterns, sketches, validation),
+            'detailed_analysis': [chunk_result.to_dict() for chunk_result in self.detailed_analysis],
+            'global_patterns': global_patterns
+        }
+        if self.cache is not None and self.checkpoints is None:
+            all_results['summary']['cache'] = self.cache.stats(self.cache_start)
+        if self.checkpoints is not None:
+            all_results['summary']['checkpoints'] = self.checkpoints.stats()
+        if self.metrics is not None:
+            all_results['summary']['metrics'] = self.metrics.as_dict(time.perf_counter() - self.started,
+                                                                     self.bytes_done)
+        return all_results
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+# Cola de eventos de progreso de cada proceso del pool de AnalysisServer
+_worker_events = None
+
+
+def _init_server_worker(analyzer, events):
+    global _worker_analyzer, _worker_events
+    _worker_analyzer = analyzer
+    _worker_events = events
+    # Compilar una vez por proceso, no en cada petición
+    analyzer.keyword_automaton()
+    analyzer.min_overlap()
+
+
+def _warm_server_worker(_):
+    return os.getpid()
+
+
+def _serve_request(request_id, path, data, filename, window_size, overlap):
+    """Analizar un archivo (path) o unos bytes subidos (data) en un proceso del pool"""
+    def progress(event):
+        _worker_events.put((request_id, event))
+
+    try:
+        source = io.BytesIO(data) if data is not None else path
+        if data is not None and compression_format(source) is None:
+            scanner = PatternScanner(_worker_analyzer, window_size, overlap, progress=progress)
+            scanner.scan_buffer(data)
+            record = scanner.record(filename)
+            record.records = _worker_analyzer.parse_records(data)
+        else:
+            # Archivos y subidas comprimidas: descomprimir en flujo
+            scanner = PatternScanner(_worker_analyzer, window_size, overlap, progress=progress,
+                                     records=True)
+            with open_input(source) as f:
+                scanner.scan_fileobj(f)
+            record = scanner.record(filename)
+        return record.to_dict()
+    finally:
+        # Marca de fin: llega después de todos los eventos de esta petición
+        _worker_events.put((request_id, None))
+
+
+class _AnalysisHandler(BaseHTTPRequestHandler):
+    """Peticiones HTTP de AnalysisServer (self.server.analysis)"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self._send_json(404, {'error': 'ruta desconocida'})
+            return
+        self._send_json(200, self.server.analysis.health())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/analyze':
+            self._send_json(404, {'error': 'ruta desconocida'})
+            return
+
+        analysis = self.server.analysis
+        params = parse_qs(url.query)
+        path = params.get('path', [None])[0]
+        data = None
+        if path is not None:
+            path = analysis.resolve(path)
+            if path is None:
+                self._send_json(403, {'error': 'ruta fuera del directorio servido'})
+                return
+            if not os.path.isfile(path):
+                self._send_json(404, {'error': 'archivo no encontrado'})
+                return
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > analysis.max_upload:
+                self._send_json(413, {'error': f'máximo {analysis.max_upload} bytes por subida'})
+                return
+            data = self.rfile.read(length)
+        filename = params.get('filename', [path or 'upload.bin'])[0]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            for event in analysis.run(path, data, filename):
+                self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente se fue: la petición termina igualmente en el pool
+            pass
+
+
+class AnalysisServer:
+    """Servidor HTTP local con un DTCAnalyzer y un pool de procesos ya preparados
+
+    Evita arrancar un intérprete y compilar los patrones en cada petición
+    de los componentes web. Rutas:
+
+    - POST /analyze?path=RUTA analiza un archivo bajo root; sin path
+      analiza el cuerpo de la petición (bytes subidos, hasta max_upload).
+      filename= da nombre al resultado.
+    - GET /health devuelve el estado y el número de procesos.
+
+    /analyze responde en NDJSON en cuanto hay algo que contar: un evento
+    {'event': 'window', 'bytes': n} por ventana escaneada y al final
+    {'event': 'result', 'result': ...} (forma de analyze_chunk) o
+    {'event': 'error', 'error': ...}. Cada petición se atiende en su hilo y
+    el escaneo se hace en uno de los jobs procesos, así que varias
+    peticiones avanzan a la vez. Los archivos se escanean por ventanas
+    (memoria acotada); los bytes subidos, en memoria.
+    """
+
+    def __init__(self, analyzer, host='127.0.0.1', port=DEFAULT_SERVER_PORT, jobs=1, root='.',
+                 window_size=DEFAULT_WINDOW_SIZE, overlap=DEFAULT_OVERLAP,
+                 max_upload=DEFAULT_MAX_UPLOAD):
+        if overlap < analyzer.min_overlap():
+            raise ValueError(f"overlap debe ser al menos {analyzer.min_overlap()} bytes")
+        if jobs is None or jobs <= 0:
+            jobs = os.cpu_count() or 1
+
+        self.analyzer = analyzer
+        self.jobs = jobs
+        self.root = os.path.realpath(root)
+        self.window_size = window_size
+        self.overlap = overlap
+        self.max_upload = max_upload
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+        self._events = multiprocessing.Queue()
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_server_worker,
+                                        initargs=(analyzer, self._events))
+        # Arrancar todos los procesos antes de la primera petición
+        list(self.pool.map(_warm_server_worker, range(jobs)))
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+        self.httpd = ThreadingHTTPServer((host, port), _AnalysisHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.analysis = self
+        self._thread = None
+
+    @property
+    def address(self):
+        """(host, puerto) en el que escucha (útil con port=0)"""
+        return self.httpd.server_address[:2]
+
+    def resolve(self, path):
+        """Ruta real de path bajo root, o None si queda fuera"""
+        real = os.path.realpath(os.path.join(self.root, path))
+        return real if os.path.commonpath([real, self.root]) == self.root else None
+
+    def health(self):
+        return {'status': 'ok', 'jobs': self.jobs, 'requests': self.requests}
+
+    def _dispatch(self):
+        """Repartir los eventos de los procesos a la petición que los espera"""
+        while True:
+            item = self._events.get()
+            if item is None:
+                break
+            request_id, event = item
+            with self._lock:
+                listener = self._listeners.get(request_id)
+            if listener is not None:
+                listener.put(event)
+
+    def run(self, path, data, filename):
+        """Eventos de una petición: progreso mientras se escanea y el resultado al final"""
+        request_id = next(self._ids)
+        listener = queue.Queue()
+        with self._lock:
+            self._listeners[request_id] = listener
+            self.requests += 1
+        started = time.perf_counter()
+        try:
+            future = self.pool.submit(_serve_request, request_id, path, data, filename,
+                                      self.window_size, self.overlap)
+            # Si el proceso muere no llega la marca de fin
+            future.add_done_callback(lambda done: done.exception() is not None and listener.put(None))
+            while True:
+                event = listener.get()
+                if event is None:
+                    break
+                yield event
+
+            try:
+                result = future.result()
+            except Exception as e:
+                yield {'event': 'error', 'error': f"{type(e).__name__}: {e}"}
+            else:
+                yield {'event': 'result', 'seconds': time.perf_counter() - started, 'result': result}
+        finally:
+            with self._lock:
+                del self._listeners[request_id]
+
+    def start(self):
+        """Atender peticiones en un hilo de fondo"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+        self.pool.shutdown()
+        self._events.put(None)
+        self._dispatcher.join()
+        self._events.close()
+
+
+def _natural_key(name):
+    """Orden natural: decrypted_chunk_2 antes que decrypted_chunk_10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def print_progress(event):
+    """Mostrar el avance de analyze_all_chunks y del modo vigilancia"""
+    origin = " (caché)" if event['cached'] else ""
+    position = event['completed'] if event['total'] is None else f"{event['completed']}/{event['total']}"
+    print(f"   [{position}] chunk {event['chunk_number']}{origin}: "
+          f"{event['bytes']} bytes, {event['mb_per_s']:.2f} MB/s acumulado")
+
+def parse_args(argv=None):
+    """Argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Analizador de archivos binarios DTC1B")
+    parser.add_argument('--chunks', type=int, default=50,
+                        help="Número máximo de decrypted_chunk_N.bin a buscar")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Escanear cada chunk por ventanas con memoria acotada")
+    parser.add_argument('--window-size', type=int, default=DEFAULT_WINDOW_SIZE,
+                        help="Tamaño de ventana en bytes para --streaming")
+    parser.add_argument('--overlap', type=int, default=DEFAULT_OVERLAP,
+                        help="Solape entre ventanas en bytes para --streaming (mínimo: la "
+                             "coincidencia acotada más larga, 34 con los patrones por defecto)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Procesos en paralelo (0 = todos los núcleos)")
+    parser.add_argument('--sampling', choices=SAMPLING_MODES, default='first',
+                        help="Muestras por patrón: primeras coincidencias o reservorio uniforme")
+    parser.add_argument('--seed', type=int,
+                        help="Semilla del muestreo de reservorio (resultados reproducibles)")
+    parser.add_argument('--keywords', type=lambda value: [k for k in value.split(',') if k],
+                        help="Palabras clave financieras separadas por comas (sustituyen a las predeterminadas)")
+    parser.add_argument('--institutions', type=lambda value: [i for i in value.split(',') if i],
+                        help="Instituciones a reconocer separadas por comas")
+    parser.add_argument('--output-ndjson', metavar='RUTA',
+                        help="Escribir un registro NDJSON por chunk en cuanto termina")
+    parser.add_argument('--resume', action='store_true',
+                        help="Con --output-ndjson, continuar una ejecución interrumpida")
+    parser.add_argument('--profile', action='store_true',
+                        help="Medir tiempos por etapa y patrón y mostrar el progreso por chunk")
+    parser.add_argument('--cache', metavar='RUTA',
+                        help="Caché SQLite de resultados: solo se reanalizan chunks nuevos o modificados")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="Tamaño máximo de la caché en MB")
+    parser.add_argument('--dedup', choices=('chunks', 'blocks'),
+                        help="Analizar una sola vez cada chunk repetido (chunks) y además cada "
+                             "bloque repetido (blocks, solo con --sampling first)")
+    parser.add_argument('--sketches', action='store_true',
+                        help="Estimar por patrón los valores distintos y más frecuentes de todos "
+                             "los chunks (HyperLogLog, Count-Min y Misra-Gries)")
+    parser.add_argument('--validate', action='store_true',
+                        help="Comprobar dígitos de control (IBAN mod 97, Luhn) y país (BIC) de los "
+                             "candidatos y conservar solo los válidos")
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH,
+                        help="Ventanas o chunks leídos por delante del escaneo en un hilo (0 = sin hilo)")
+    parser.add_argument('--index', metavar='RUTA',
+                        help="Índice SQLite con todas las coincidencias (chunk, patrón, offset, valor)")
+    parser.add_argument('--query', action='store_true',
+                        help="Consultar el índice de --index en lugar de analizar")
+    parser.add_argument('--query-pattern', help="Con --query, filtrar por patrón")
+    parser.add_argument('--query-value', help="Con --query, filtrar por valor exacto")
+    parser.add_argument('--query-chunk', type=int, help="Con --query, filtrar por número de chunk")
+    parser.add_argument('--query-range', metavar='INICIO:FIN',
+                        help="Con --query, filtrar por rango de offsets (FIN excluido)")
+    parser.add_argument('--query-limit', type=int, default=100,
+                        help="Con --query, número máximo de coincidencias mostradas")
+    parser.add_argument('--find', metavar='ARCHIVO',
+                        help="Buscar solo los patrones de --find-pattern y dejar de leer al reunirlos")
+    parser.add_argument('--find-pattern', action='append', metavar='PATRÓN[:N]',
+                        help="Con --find, patrón y máximo de coincidencias (por defecto 1; "
+                             "N=0 sin límite); repetible. Sin él, una de cada patrón")
+    parser.add_argument('--serve', type=int, nargs='?', const=DEFAULT_SERVER_PORT, metavar='PUERTO',
+                        help="Servidor HTTP local con el analizador ya preparado "
+                             f"(por defecto en el puerto {DEFAULT_SERVER_PORT})")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Dirección en la que escucha --serve")
+    parser.add_argument('--root', default='.',
+                        help="Con --serve, directorio del que se pueden analizar archivos por ruta")
+    parser.add_argument('--file', metavar='ARCHIVO',
+                        help="Analizar un único archivo grande repartiendo rangos de bytes entre "
+                             "--jobs procesos")
+    parser.add_argument('--checkpoints', metavar='RUTA',
+                        help="Puntos de control SQLite: con --file o --watch los archivos que crecen "
+                             "por el final solo se escanean desde donde se quedaron")
+    parser.add_argument('--archive', metavar='ZIP',
+                        help="Analizar cada miembro de un zip como un chunk, sin extraerlo")
+    parser.add_argument('--triage', metavar='ARCHIVO',
+                        help="Estimar entropía, densidad de patrones y palabras clave de un archivo "
+                             "a partir de bloques muestreados, sin escanearlo entero")
+    parser.add_argument('--triage-samples', type=int, default=TRIAGE_SAMPLES,
+                        help="Bloques muestreados por --triage (uno por estrato)")
+    parser.add_argument('--watch', metavar='DIRECTORIO',
+                        help="Vigilar un directorio y analizar cada chunk en cuanto se termina de escribir")
+    parser.add_argument('--pattern', default='decrypted_chunk_*.bin',
+                        help="Patrón glob de los chunks vigilados con --watch "
+                             "('decrypted_chunk_*.bin*' incluye los comprimidos)")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help="Segundos entre sondeos del directorio vigilado")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Segundos sin modificaciones para dar un chunk por completo")
+    parser.add_argument('--idle-timeout', type=float,
+                        help="Terminar la vigilancia tras estos segundos sin chunks nuevos")
+    return parser.parse_args(argv)
+
+def run_query(args):
+    """Responder una consulta sobre el índice sin leer los binarios"""
+    start = end = None
+    if args.query_range:
+        first, _, last = args.query_range.partition(':')
+        start = int(first) if first else None
+        end = int(last) if last else None
+
+    match_index = MatchIndex(args.index)
+    try:
+        started = time.perf_counter()
+        matches = match_index.query(args.query_pattern, args.query_value, args.query_chunk,
+                                    start, end, limit=args.query_limit)
+        elapsed = time.perf_counter() - started
+    finally:
+        match_index.close()
+
+    for match in matches:
+        print(f"chunk {match['chunk_number']} @ {match['offset']} "
+              f"[{match['pattern']}] {match['value']}")
+    print(f"🔎 {len(matches)} coincidencias en {elapsed * 1000:.1f} ms")
+    return matches
+
+def run_find(analyzer, args):
+    """Búsqueda con parada anticipada de --find"""
+    limits = {}
+    for item in args.find_pattern or analyzer.patterns:
+        name, _, limit = item.partition(':')
+        limits[name] = int(limit) if limit else 1
+        if limits[name] <= 0:
+            limits[name] = None
+    try:
+        found = analyzer.find_matches(args.find, limits)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    for name, matches in found['matches'].items():
+        print(f"• {name}: {len(matches)} coincidencias")
+        for match in matches:
+            print(f"    @ {match['offset']} {match['value']}")
+    state = "límites alcanzados" if found['complete'] else "fin de los datos"
+    print(f"🎯 {found['bytes_scanned']} bytes escaneados en {found['seconds'] * 1000:.1f} ms ({state})")
+    return found
+
+def main(argv=None):
     """Función principal"""
+    args = parse_args(argv)
+
+    if args.query:
+        if not args.index:
+            raise SystemExit("--query necesita --index")
+        run_query(args)
+        return
+
     print("🔍 INICIANDO ANÁLISIS DE ARCHIVOS DTC1B")
     print("=" * 60)
 
-    analyzer = DTCAnalyzer()
+    analyzer = DTCAnalyzer(sampling=args.sampling, sample_seed=args.seed, instrument=args.profile,
+                           financial_keywords=args.keywords, institutions=args.institutions,
+                           block_dedup=args.dedup == 'blocks', sketches=args.sketches,
+                           prefetch=args.prefetch, validate=args.validate)
+    if args.overlap < analyzer.min_overlap():
+        raise SystemExit(f"--overlap debe ser al menos {analyzer.min_overlap()} bytes "
+                         f"(la coincidencia acotada más larga)")
+    if args.find:
+        run_find(analyzer, args)
+        return
+
+    if args.triage:
+        if compression_format(args.triage) is not None:
+            raise SystemExit("--triage necesita acceso aleatorio: descomprime el archivo primero")
+        triage = analyzer.triage(args.triage, args.triage_samples, seed=args.seed)
+        if triage is None:
+            raise SystemExit(f"{args.triage} está vacío")
+        print(analyzer.format_triage(triage))
+        return
+
+    if args.serve is not None:
+        server = AnalysisServer(analyzer, args.host, args.serve, jobs=args.jobs, root=args.root,
+                                window_size=args.window_size, overlap=args.overlap)
+        host, port = server.address
+        print(f"🌐 Servidor en http://{host}:{port} ({server.jobs} procesos)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+        return
+
+    if args.checkpoints and args.index and args.watch:
+        raise SystemExit("--checkpoints no admite --index")
+    cache = ResultCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    checkpoints = ScanCheckpoints(args.checkpoints) if args.checkpoints else None
 
-    # Analizar todos los chunks
-    results = analyzer.analyze_all_chunks()
+    try:
+        if args.watch:
+            # Ingesta continua hasta Ctrl+C o --idle-timeout
+            print(f"👀 Vigilando {os.path.join(args.watch, args.pattern)}")
+            watcher = ChunkWatcher(analyzer, args.watch, args.pattern, settle=args.settle,
+                                   streaming=args.streaming, window_size=args.window_size,
+                                   overlap=args.overlap, cache=cache, output=args.output_ndjson,
+                                   progress=print_progress, index=args.index,
+                                   checkpoints=checkpoints)
+            try:
+                results = watcher.run(args.poll_interval, idle_timeout=args.idle_timeout)
+            finally:
+                watcher.close()
+        elif args.file:
+            if checkpoints is not None:
+                record = analyzer.scan_appended(args.file, checkpoints, chunk_number=1,
+                                                window_size=args.window_size, overlap=args.overlap)
+            else:
+                record = analyzer.scan_file_parallel(args.file, args.jobs, chunk_number=1)
+            if record is None:
+                raise SystemExit(f"{args.file} está vacío o no se puede leer")
+            global_patterns = defaultdict(int, record.pattern_counts())
+            results = {
+                'summary': analyzer._build_summary(1, 1, global_patterns, record.sketches,
+                                                   record.validation),
+                'detailed_analysis': [record.to_dict()],
+                'global_patterns': global_patterns
+            }
+            if record.metrics is not None:
+                results['summary']['metrics'] = record.metrics
+            if checkpoints is not None:
+                results['summary']['checkpoints'] = checkpoints.stats()
+        elif args.archive:
+            results = analyzer.analyze_archive(args.archive, window_size=args.window_size,
+                                               overlap=args.overlap, jobs=args.jobs,
+                                               progress=print_progress if args.profile else None,
+                                               output=args.output_ndjson)
+        else:
+            # Analizar todos los chunks
+            results = analyzer.analyze_all_chunks(args.chunks, streaming=args.streaming,
+                                                  window_size=args.window_size, overlap=args.overlap,
+                                                  jobs=args.jobs, cache=cache,
+                                                  progress=print_progress if args.profile else None,
+                                                  output=args.output_ndjson, resume=args.resume,
+                                                  index=args.index, dedup=args.dedup is not None)
+    finally:
+        if cache is not None:
+            cache.close()
+        if checkpoints is not None:
+            checkpoints.close()
 
     # Generar reporte
     report = analyzer.generate_report(results)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK DEL ANALIZADOR DTC1B
+Genera corpus sintéticos reproducibles y mide rendimiento (MB/s) y memoria
+(pico de RSS) de las etapas del analizador, comparando contra una línea base
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+import queue as queue_module
+from datetime import datetime
+
+import analizador_dtc1b
+from analizador_dtc1b import DTCAnalyzer
+
+# Tamaño de bloque del generador de corpus
+CORPUS_BLOCK_SIZE = 64 * 1024
+
+# Caracteres de relleno: minúsculas y espacios (no coinciden con los patrones)
+_FILLER_ALPHABET = b'abcdefghijklmnopqrstuvwxyz      .,;\n'
+_FILLER_TABLE = bytes(_FILLER_ALPHABET[i % len(_FILLER_ALPHABET)] for i in range(256))
+
+_UPPER = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_DIGITS = '0123456789'
+_HEX = '0123456789ABCDEF'
+_COUNTRIES = ['GB', 'ES', 'DE', 'FR', 'US', 'CH', 'IT', 'NL']
+_WORDS = ['transfer', 'balance', 'account', 'amount', 'total', 'value',
+          'HSBC', 'Citibank', 'Federal Reserve', 'ECB', 'Banco de España']
+
+BENCHMARKS = ('analyze_patterns', 'extract_structured_data', 'calculate_entropy',
+              'analyze_file_streaming', 'analyze_all_chunks')
+
+
+def parse_size(text):
+    """Convertir '512K', '16M' o '2G' (unidades binarias) a bytes"""
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def _record(rng):
+    """Un registro financiero sintético que coincide con algún patrón"""
+    kind = rng.randrange(9)
+    if kind == 0:
+        return ''.join(rng.choices(_UPPER, k=4)) + rng.choice(_COUNTRIES) + '2L' + rng.choice(['', 'XXX'])
+    if kind == 1:
+        return rng.choice(_COUNTRIES) + ''.join(rng.choices(_DIGITS, k=2)) + \
+            ''.join(rng.choices(_UPPER, k=4)) + ''.join(rng.choices(_DIGITS, k=14))
+    if kind == 2:
+        return ''.join(rng.choices(_DIGITS, k=rng.randint(8, 20)))
+    if kind == 3:
+        return f"{rng.choice(['USD', 'EUR', 'GBP'])}: {rng.randint(1, 9999999):,}.{rng.randint(0, 99):02d}"
+    if kind == 4:
+        return f"{rng.choice(['BANK', 'ACCOUNT', 'BALANCE', 'TRANSACTION'])}: " + \
+            ''.join(rng.choices(_UPPER + _DIGITS, k=rng.randint(8, 16)))
+    if kind == 5:
+        return 'DTC' + ''.join(rng.choices(_DIGITS, k=rng.randint(3, 8)))
+    if kind == 6:
+        return ''.join(rng.choices(_HEX, k=rng.randint(32, 64)))
+    if kind == 7:
+        return rng.choice(_WORDS)
+    return ''.join(rng.choices(_UPPER, k=6))
+
+
+def iter_corpus_blocks(size, seed, density=0.05, entropy_fraction=0.25, zero_fraction=0.1,
+                       block_size=CORPUS_BLOCK_SIZE):
+    """Generar un corpus DTC1B sintético bloque a bloque (memoria acotada)
+
+    density es la fracción de bytes de los bloques de texto ocupada por
+    registros financieros; entropy_fraction y zero_fraction son las
+    fracciones de bloques aleatorios (encriptados) y de relleno con ceros.
+    El mismo seed produce siempre los mismos bytes.
+    """
+    rng = random.Random(seed)
+    produced = 0
+
+    while produced < size:
+        n = min(block_size, size - produced)
+        if produced == 0:
+            block = b'DTC1B' + _text_block(rng, n - 5, density) if n > 5 else b'DTC1B'[:n]
+        else:
+            roll = rng.random()
+            if roll < entropy_fraction:
+                block = rng.randbytes(n)
+            elif roll < entropy_fraction + zero_fraction:
+                block = bytes(n)
+            else:
+                block = _text_block(rng, n, density)
+        produced += len(block)
+        yield block
+
+
+def _text_block(rng, n, density):
+    """Bloque de relleno con registros intercalados"""
+    records = []
+    record_bytes = 0
+    while record_bytes < n * density:
+        record = (' ' + _record(rng) + ' ').encode('utf-8')
+        records.append(record)
+        record_bytes += len(record)
+
+    filler = rng.randbytes(max(0, n - record_bytes)).translate(_FILLER_TABLE)
+    cuts = sorted(rng.randrange(len(filler) + 1) for _ in records)
+    parts = []
+    previous = 0
+    for cut, record in zip(cuts, records):
+        parts.append(filler[previous:cut])
+        parts.append(record)
+        previous = cut
+    parts.append(filler[previous:])
+    return b''.join(parts)[:n]
+
+
+def write_corpus(path, size, seed, density=0.05, entropy_fraction=0.25, zero_fraction=0.1):
+    """Escribir un corpus sintético en path"""
+    with open(path, 'wb') as f:
+        for block in iter_corpus_blocks(size, seed, density, entropy_fraction, zero_fraction):
+            f.write(block)
+    return path
+
+
+def write_chunk_set(directory, size, chunks, seed, **corpus_options):
+    """Repartir un corpus en decrypted_chunk_1..N.bin dentro de directory"""
+    os.makedirs(directory, exist_ok=True)
+    chunk_size = -(-size // chunks)
+    for i in range(chunks):
+        write_corpus(os.path.join(directory, f"decrypted_chunk_{i + 1}.bin"),
+                     min(chunk_size, size - i * chunk_size), seed + i, **corpus_options)
+    return directory
+
+
+def _peak_rss_bytes():
+    """Pico de RSS del proceso actual (ru_maxrss está en KiB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _run_benchmark(benchmark, path, queue):
+    """Ejecutar una etapa en un proceso limpio y devolver tiempo y memoria"""
+    analyzer = DTCAnalyzer()
+    baseline_rss = _peak_rss_bytes()
+
+    if benchmark == 'analyze_all_chunks':
+        os.chdir(path)
+        start = time.perf_counter()
+        analyzer.analyze_all_chunks(chunk_count=len(os.listdir(path)))
+    elif benchmark == 'analyze_file_streaming':
+        start = time.perf_counter()
+        if analyzer.analyze_file_streaming(path) is None:
+            raise OSError(f"no se pudo leer {path}")
+    else:
+        data = analyzer.read_binary_file(path)
+        if data is None:
+            raise OSError(f"no se pudo leer {path}")
+        start = time.perf_counter()
+        if benchmark == 'calculate_entropy':
+            analyzer.calculate_entropy(data)
+        else:
+            getattr(analyzer, benchmark)(data, os.path.basename(path))
+
+    queue.put({'seconds': time.perf_counter() - start,
+               'baseline_rss_bytes': baseline_rss,
+               'peak_rss_bytes': _peak_rss_bytes()})
+
+
+def _wait_result(process, queue, timeout):
+    """Resultado del proceso hijo; None si termina sin enviarlo o se agota timeout"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            return queue.get(timeout=0.5)
+        except queue_module.Empty:
+            if not process.is_alive():
+                # Último intento: el resultado pudo llegar justo antes de salir
+                try:
+                    return queue.get(timeout=0.5)
+                except queue_module.Empty:
+                    return None
+            if deadline is not None and time.monotonic() >= deadline:
+                process.terminate()
+                return None
+
+
+def measure(benchmark, path, size, repeat=3, timeout=None):
+    """Medir una etapa repitiendo en procesos nuevos; se conserva la mejor vuelta
+
+    Si el proceso hijo falla (excepción, falta de memoria) o supera timeout
+    segundos se lanza RuntimeError en lugar de esperar indefinidamente.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_benchmark, args=(benchmark, path, queue))
+        process.start()
+        result = _wait_result(process, queue, timeout)
+        process.join()
+        if result is None or process.exitcode != 0:
+            raise RuntimeError(f"la medida de {benchmark} sobre {path} falló "
+                               f"(código de salida {process.exitcode})")
+        runs.append(result)
+
+    best = min(runs, key=lambda run: run['seconds'])
+    return {
+        'benchmark': benchmark,
+        'size': size,
+        'seconds': best['seconds'],
+        'mb_per_s': size / (1024 * 1024) / best['seconds'] if best['seconds'] > 0 else 0,
+        'peak_rss_bytes': max(run['peak_rss_bytes'] for run in runs),
+        'baseline_rss_bytes': min(run['baseline_rss_bytes'] for run in runs)
+    }
+
+
+def run_suite(sizes, seed, workdir, benchmarks=BENCHMARKS, repeat=3, chunks=8, **corpus_options):
+    """Generar (o reutilizar) los corpus y medir todas las etapas"""
+    results = []
+    for size in sizes:
+        tag = f"{size}_{seed}_{corpus_options.get('density', 0.05)}_{corpus_options.get('entropy_fraction', 0.25)}"
+        corpus = os.path.join(workdir, f"corpus_{tag}.bin")
+        if not os.path.exists(corpus):
+            print(f"🔧 Generando corpus de {size} bytes: {corpus}")
+            write_corpus(corpus, size, seed, **corpus_options)
+
+        chunk_dir = os.path.join(workdir, f"chunks_{tag}_{chunks}")
+        if 'analyze_all_chunks' in benchmarks and not os.path.isdir(chunk_dir):
+            write_chunk_set(chunk_dir, size, chunks, seed, **corpus_options)
+
+        for benchmark in benchmarks:
+            target = chunk_dir if benchmark == 'analyze_all_chunks' else corpus
+            result = measure(benchmark, target, size, repeat)
+            results.append(result)
+            print(f"   {benchmark:<26} {size:>12} bytes  {result['mb_per_s']:>9.2f} MB/s  "
+                  f"pico RSS {result['peak_rss_bytes'] / (1024 * 1024):.1f} MB")
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': analizador_dtc1b.np is not None,
+            'seed': seed,
+            'repeat': repeat,
+            'chunks': chunks,
+            'corpus_options': corpus_options
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, tolerance=0.15):
+    """Regresiones frente a una línea base: caída de MB/s o subida de memoria"""
+    previous = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    regressions = []
+
+    for result in current['results']:
+        old = previous.get((result['benchmark'], result['size']))
+        if old is None:
+            continue
+        if result['mb_per_s'] < old['mb_per_s'] * (1 - tolerance):
+            regressions.append((result['benchmark'], result['size'], 'mb_per_s',
+                                old['mb_per_s'], result['mb_per_s']))
+        if result['peak_rss_bytes'] > old['peak_rss_bytes'] * (1 + tolerance):
+            regressions.append((result['benchmark'], result['size'], 'peak_rss_bytes',
+                                old['peak_rss_bytes'], result['peak_rss_bytes']))
+
+    return regressions
+
+
+def parse_args(argv=None):
+    """Argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Benchmark reproducible del analizador DTC1B")
+    parser.add_argument('--sizes', default='1M,16M,128M',
+                        help="Tamaños de corpus separados por comas (K, M, G)")
+    parser.add_argument('--seed', type=int, default=1234, help="Semilla del generador")
+    parser.add_argument('--density', type=float, default=0.05,
+                        help="Fracción de bytes de texto ocupada por registros financieros")
+    parser.add_argument('--entropy', type=float, default=0.25,
+                        help="Fracción de bloques de alta entropía")
+    parser.add_argument('--zeros', type=float, default=0.1,
+                        help="Fracción de bloques de relleno con ceros")
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help="Etapas a medir separadas por comas")
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones por medida")
+    parser.add_argument('--chunks', type=int, default=8,
+                        help="Número de chunks para analyze_all_chunks")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'dtc1b_bench'),
+                        help="Directorio donde se generan y reutilizan los corpus")
+    parser.add_argument('--output', default='dtc1b_benchmark.json', help="Archivo JSON de resultados")
+    parser.add_argument('--baseline', help="JSON de una ejecución anterior para comparar")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Tolerancia relativa antes de considerar una regresión")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Función principal"""
+    args = parse_args(argv)
+
+    print("⏱️ BENCHMARK DEL ANALIZADOR DTC1B")
+    print("=" * 60)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    benchmarks = [name.strip() for name in args.benchmarks.split(',')]
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        print(f"❌ Etapas desconocidas: {', '.join(sorted(unknown))}")
+        return 2
+
+    results = run_suite(sizes, args.seed, args.workdir, benchmarks, args.repeat, args.chunks,
+                        density=args.density, entropy_fraction=args.entropy, zero_fraction=args.zeros)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Resultados guardados en: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("❌ REGRESIONES DETECTADAS:")
+            for benchmark, size, metric, old, new in regressions:
+                print(f"   {benchmark} ({size} bytes) {metric}: {old:.2f} -> {new:.2f}")
+            return 1
+        print("✅ Sin regresiones frente a la línea base")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
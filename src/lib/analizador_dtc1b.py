@@ -188,7 +188,7 @@ PATRONES MAS FRECUENTES:
         for pattern, count in results['summary']['most_common_patterns'].items():
             report += f'• {pattern}: {count} ocurrencias\n'
 
-        report += f'\n{'='*80}\n'
+        report += f'\n{"="*80}\n'
 
         for chunk_result in results['detailed_analysis'][:5]:
             chunk = chunk_result['chunk_number']
@@ -5,9 +5,15 @@ SCRIPT DE PRUEBA PARA EL ANALIZADOR DTC1B
 Demuestra cómo usar el analizador con archivos reales
 """
 
+import itertools
 import os
 import sys
-from analizador_dtc1b import DTCAnalyzer
+import tracemalloc
+
+import pytest
+
+import analizador_dtc1b
+from analizador_dtc1b import ChunkResult, ChunkWatcher, DTCAnalyzer, MatchIndex, ResultCache
 
 def test_con_archivo_ejemplo():
     """Probar el analizador con el archivo de ejemplo DTC1B"""
@@ -30,19 +36,22 @@ def test_con_archivo_ejemplo():
 
             # Análisis básico
             analysis = analyzer.analyze_patterns(data, test_file)
-            print("📊 Análisis básico completado:"            print(f"   - Tamaño: {analysis['file_size']} bytes")
+            print("📊 Análisis básico completado:")
+            print(f"   - Tamaño: {analysis['file_size']} bytes")
             print(f"   - Patrones encontrados: {len(analysis['patterns_found'])}")
             print(f"   - Palabras clave financieras: {len(analysis['potential_data'].get('financial_keywords', {}))}")
 
             # Extracción estructurada
             structured = analyzer.extract_structured_data(data, test_file)
-            print("🏦 Datos estructurados extraídos:"            print(f"   - Códigos bancarios: {len(structured['bank_codes'])}")
+            print("🏦 Datos estructurados extraídos:")
+            print(f"   - Códigos bancarios: {len(structured['bank_codes'])}")
             print(f"   - Números de cuenta: {len(structured['account_numbers'])}")
             print(f"   - Instituciones: {', '.join(structured['institutions']) if structured['institutions'] else 'Ninguna'}")
 
             # Metadatos
             metadata = structured['metadata']
-            print("📋 Metadatos del archivo:"            print(f"   - Entropía: {metadata['entropy_score']:.3f}")
+            print("📋 Metadatos del archivo:")
+            print(f"   - Entropía: {metadata['entropy_score']:.3f}")
             print(f"   - Seguridad: {'Encriptado' if metadata['entropy_score'] > 7 else 'Texto plano'}")
 
         else:
@@ -99,7 +108,8 @@ def crear_archivo_prueba():
     data = analyzer.read_binary_file('archivo_prueba_dtc1b.bin')
 
     if data:
-        print("🔍 Analizando archivo de prueba creado:"        analysis = analyzer.analyze_patterns(data, 'archivo_prueba_dtc1b.bin')
+        print("🔍 Analizando archivo de prueba creado:")
+        analysis = analyzer.analyze_patterns(data, 'archivo_prueba_dtc1b.bin')
         structured = analyzer.extract_structured_data(data, 'archivo_prueba_dtc1b.bin')
 
         print(f"📊 Resultados del análisis:")
@@ -139,6 +149,986 @@ def comparar_con_analisis_web():
     print("   🐍 Usa el script Python para procesamiento por lotes")
     print("   🔄 Ambos sistemas están sincronizados y usan la misma lógica")
 
+def _datos_con_cruces():
+    """Datos con coincidencias largas que cruzan fronteras de ventana"""
+    bloque = bytearray(b'DTC1B')
+    bloque.extend(b'HSBCGB2LXXX 1234567890123456 GB82WEST12345698765432 ')
+    bloque.extend(b'BANK: ABCDEFGH12345678 USD: 1,234,567.89 EUR = 500.00 ')
+    bloque.extend(b'0123456789ABCDEF' * 5 + b' DTC12345 ')
+    bloque.extend('Banco de España transfer Federal Reserve total '.encode('utf-8'))
+    bloque.extend(bytes(range(256)))
+    return bytes(bloque) * 7
+
+def _referencia_findall(analyzer, data, filename):
+    """Resultado esperado calculado con findall sobre el buffer completo"""
+    patterns_found = {}
+    for name, pattern in analyzer.patterns.items():
+        matches = pattern.findall(data)
+        if matches:
+            patterns_found[name] = {
+                'count': len(matches),
+                'samples': [m.decode('utf-8', errors='ignore')[:50] for m in matches[:5]]
+            }
+
+    text = data.decode('utf-8', errors='ignore').lower()
+    keywords = {k: text.count(k) for k in analyzer.financial_keywords if text.count(k)}
+    analysis = {'filename': filename, 'file_size': len(data),
+                'patterns_found': patterns_found,
+                'potential_data': {'financial_keywords': keywords} if keywords else {}}
+
+    def primeros(name, limit):
+        return [m.decode('utf-8', errors='ignore') for m in analyzer.patterns[name].findall(data)[:limit]]
+
+    structured = {
+        'bank_codes': primeros('bank_codes', 10),
+        'account_numbers': primeros('account_numbers', 10),
+        'swift_codes': primeros('swift_codes', 5),
+        'currency_amounts': primeros('currency_patterns', 5),
+        'institutions': [i for i in analyzer.institutions if i.lower() in text],
+        'metadata': {
+            'file_size': len(data),
+            'first_bytes': data[:16].hex(),
+            'last_bytes': data[-16:].hex(),
+            'entropy_score': analyzer.calculate_entropy(data)
+        }
+    }
+    return analysis, structured
+
+def test_escaneo_unico_equivale_a_findall():
+    """Un solo escaneo alimenta ambos métodos con el resultado de findall"""
+    data = _datos_con_cruces()
+    analyzer = DTCAnalyzer()
+    esperado = _referencia_findall(analyzer, data, 'chunk.bin')
+
+    for block in (5, 100, len(data)):
+        scan = analyzer.scan_data(data, window_size=block, overlap=64)
+        assert analyzer.analyze_patterns(data, 'chunk.bin', scan=scan) == esperado[0], block
+        assert analyzer.extract_structured_data(data, 'chunk.bin', scan=scan) == esperado[1], block
+
+    assert analyzer.analyze_patterns(data, 'chunk.bin') == esperado[0]
+    assert analyzer.extract_structured_data(data, 'chunk.bin') == esperado[1]
+
+def test_escaneo_etiqueta_coincidencias_en_orden():
+    """on_match recibe cada coincidencia etiquetada y en orden de offset"""
+    data = _datos_con_cruces()
+    analyzer = DTCAnalyzer()
+    hits = []
+    analyzer.scan_data(data, window_size=64, overlap=128,
+                       on_match=lambda name, start, end, value: hits.append((name, start, end, value)))
+
+    assert [hit[1] for hit in hits] == sorted(hit[1] for hit in hits)
+    for name, pattern in analyzer.patterns.items():
+        esperado = [(name, m.start(), m.end(), m.group()) for m in pattern.finditer(data)]
+        assert [hit for hit in hits if hit[0] == name] == esperado
+
+def test_prefiltro_no_cambia_el_resultado():
+    """Con el prefiltro de tramos el escaneo da lo mismo, también por ventanas y con on_match"""
+    import random
+    import re
+    rnd = random.Random(11)
+    cruces = _datos_con_cruces()
+    data = b''.join(rnd.randbytes(rnd.randint(20000, 60000)) + bytes(rnd.randint(0, 20000))
+                    + cruces[:rnd.randint(50, len(cruces))] for _ in range(30))
+    con = DTCAnalyzer()
+    sin = DTCAnalyzer(prefilter=False)
+    assert set(con.prefilter_tables()) == set(con.patterns)
+    assert con.prefilter_tables()['bank_codes'][1] == 6
+    # Los datos tienen tramos que saltar
+    assert analizador_dtc1b.PatternScanner(con, 8192, 64)._candidate_spans('financial_structures', data)
+
+    for window, overlap in ((analizador_dtc1b.SCAN_BLOCK_SIZE, 4096), (8192, 64)):
+        esperados = []
+        obtenidos = []
+        esperado = sin.scan_data(data, window, overlap, on_match=lambda *hit: esperados.append(hit)).record('x')
+        obtenido = con.scan_data(data, window, overlap, on_match=lambda *hit: obtenidos.append(hit)).record('x')
+        assert obtenido.to_dict() == esperado.to_dict()
+        assert obtenidos == esperados
+        assert con.scan_data(data, window, overlap).record('x').to_dict() == esperado.to_dict()
+
+    # Los patrones con anclas dependen de los bytes vecinos: sin prefiltro
+    assert analizador_dtc1b.prefilter_table(re.compile(rb'\bDTC\d+')) is None
+
+def test_automata_de_palabras_sin_decodificar():
+    """Palabras e instituciones sin distinguir mayúsculas, también partidas entre bloques"""
+    data = 'xx BANCO DE ESPAÑA bankbank Transfer\x00TRANSFER hsbc'.encode('utf-8') * 3
+    analyzer = DTCAnalyzer(financial_keywords=['bank', 'transfer', 'ban'],
+                           institutions=['HSBC', 'Banco de España', 'ECB'])
+    assert analyzer.keyword_automaton() is analyzer.keyword_automaton()
+
+    for block in (3, 7, len(data)):
+        scan = analyzer.scan_data(data, window_size=block, overlap=34)
+        keywords = scan.analysis('x')['potential_data']['financial_keywords']
+        assert keywords == {'bank': 6, 'transfer': 6, 'ban': 9}, block
+        assert scan.structured()['institutions'] == ['HSBC', 'Banco de España'], block
+
+def test_muestreo_de_reservorio_reproducible(tmp_path):
+    """Con semilla, el reservorio es el mismo para cualquier tamaño de bloque"""
+    data = b' '.join(b'%012d' % (i * 7919) for i in range(2000))
+    ruta = tmp_path / 'cuentas.bin'
+    ruta.write_bytes(data)
+
+    analyzer = DTCAnalyzer(sampling='reservoir', sample_seed=42)
+    esperado = analyzer.extract_structured_data(data, 'cuentas.bin')
+    for block in (97, 4096):
+        scan = analyzer.scan_data(data, window_size=block, overlap=64)
+        assert scan.structured() == esperado
+    _, structured = analyzer.analyze_file_streaming(str(ruta), window_size=300, overlap=64)
+    assert structured == esperado
+
+    # Muestra repartida por todo el archivo, no solo las primeras cuentas
+    primeras = DTCAnalyzer().extract_structured_data(data, 'cuentas.bin')['account_numbers']
+    assert len(esperado['account_numbers']) == 10
+    assert esperado['account_numbers'] != primeras
+    assert max(int(n) for n in esperado['account_numbers']) > 1000 * 7919
+    assert analyzer.analyze_patterns(data, 'x')['patterns_found']['account_numbers']['count'] == 2000
+
+def test_memoria_acotada_con_muchas_coincidencias():
+    """El pico de memoria no crece con el número de coincidencias"""
+    analyzer = DTCAnalyzer()
+    picos = []
+    for relleno in (b'x ', b'1 '):
+        data = relleno * (1 << 19)
+        tracemalloc.start()
+        analyzer.scan_data(data)
+        picos.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert picos[1] < picos[0] * 1.5
+
+def test_streaming_equivale_a_lectura_completa(tmp_path):
+    """El modo streaming devuelve lo mismo que el análisis en memoria"""
+    data = _datos_con_cruces()
+    ruta = tmp_path / 'chunk.bin'
+    ruta.write_bytes(data)
+
+    analyzer = DTCAnalyzer()
+    esperado = _referencia_findall(analyzer, data, 'chunk.bin')
+
+    for window_size in (1, 7, 64, 333, len(data), len(data) * 2):
+        resultado = analyzer.analyze_file_streaming(str(ruta), 'chunk.bin',
+                                                    window_size=window_size, overlap=128)
+        assert resultado == esperado, window_size
+
+def test_streaming_no_duplica_coincidencias_largas(tmp_path):
+    """Una coincidencia más larga que el solape no se parte ni se duplica"""
+    data = b'\x00' * 30 + b'A' * 40 + b'\x00' * 30
+    ruta = tmp_path / 'hex.bin'
+    ruta.write_bytes(data)
+
+    analyzer = DTCAnalyzer()
+    analysis, _ = analyzer.analyze_file_streaming(str(ruta), window_size=32, overlap=34)
+    assert analysis['patterns_found']['encrypted_blocks'] == {'count': 1, 'samples': ['A' * 40]}
+
+def test_solape_minimo_por_patrones(tmp_path):
+    """Un solape menor que la coincidencia acotada más larga se rechaza"""
+    import random
+    analyzer = DTCAnalyzer()
+    assert analyzer.min_overlap() == 34
+    with pytest.raises(ValueError):
+        analyzer.scan_data(b'HSBCGB2LXXX', window_size=7, overlap=4)
+    with pytest.raises(ValueError):
+        analyzer.analyze_all_chunks(1, streaming=True, overlap=0)
+
+    rng = random.Random(7)
+    alfabeto = b'AB09GB82 ,.:'
+    for _ in range(40):
+        data = bytes(rng.choice(alfabeto) for _ in range(rng.randrange(50, 400)))
+        esperado = _referencia_findall(analyzer, data, 'x')[0]['patterns_found']
+        for block in (3, 17):
+            scan = analyzer.scan_data(data, window_size=block, overlap=34)
+            assert scan.analysis('x')['patterns_found'] == esperado
+
+def test_registros_de_formato_conocido(tmp_path, monkeypatch):
+    """La cabecera DTC1B y los registros de saldo se decodifican con struct"""
+    import struct
+    monkeypatch.chdir(tmp_path)
+    cabecera = (b'DTC1BHSBCUKCITIGB' + b'1234567890123456' + b'9876543210987654' + b'HSBCGB2LCITIGB2L'
+                + b'\x00' * 50 + b'BANK: HSBC ACCOUNT: 123456789 BALANCE: 1000000.00 USD')
+    cabecera += bytes(512 - len(cabecera))
+    analyzer = DTCAnalyzer()
+
+    structured = analyzer.extract_structured_data(cabecera, 'cabecera.bin')
+    assert structured['bank_codes'] == ['HSBCUK', 'CITIGB']
+    assert structured['account_numbers'] == ['1234567890123456', '9876543210987654']
+    assert structured['swift_codes'] == ['HSBCGB2L', 'CITIGB2L']
+    assert structured['records'] == {'formats': ['dtc1b_header'], 'count': 1,
+                                     'fields': ['bank_codes', 'account_numbers', 'swift_codes']}
+
+    # Registros de 128 bytes hasta el primero con una divisa desconocida
+    saldos = bytearray(b'\xff' * 512)
+    for posicion, (divisa, importe) in enumerate([(b'USD', 125000), (b'EUR', 250005), (b'GBP', 7)]):
+        struct.pack_into('>3sQ', saldos, posicion * 128, divisa, importe)
+    assert analyzer.parse_records(bytes(saldos)) == {
+        'formats': ('balance_records',), 'count': 3,
+        'fields': {'currency_amounts': ('USD: 1250.00', 'EUR: 2500.05', 'GBP: 0.07')}}
+
+    # Igual por streaming (mmap) y tras pasar por la caché
+    (tmp_path / 'decrypted_chunk_1.bin').write_bytes(cabecera)
+    (tmp_path / 'decrypted_chunk_2.bin').write_bytes(bytes(saldos))
+    completo = analyzer.analyze_all_chunks(2)
+    assert analyzer.analyze_all_chunks(2, streaming=True) == completo
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    analyzer.analyze_all_chunks(2, cache=cache)
+    assert analyzer.analyze_all_chunks(2, cache=cache)['detailed_analysis'] == completo['detailed_analysis']
+    cache.close()
+    assert completo['detailed_analysis'][0]['structured_data']['swift_codes'] == ['HSBCGB2L', 'CITIGB2L']
+
+def test_entradas_comprimidas_en_flujo(tmp_path, monkeypatch):
+    """gzip, bz2, xz y zip se escanean descomprimidos en flujo con el mismo resultado"""
+    import bz2
+    import gzip
+    import lzma
+    import zipfile
+    monkeypatch.chdir(tmp_path)
+    cabecera = b'DTC1BHSBCUKCITIGB' + b'1234567890123456' + b'9876543210987654' + b'HSBCGB2LCITIGB2L'
+    data = cabecera + bytes(512 - len(cabecera)) + _datos_con_cruces() * 30
+    (tmp_path / 'plano.bin').write_bytes(data)
+    analyzer = DTCAnalyzer()
+    esperado = analyzer.analyze_chunk(1, 'plano.bin', compact=True)
+    assert esperado.records['formats'] == ('dtc1b_header',)
+
+    with zipfile.ZipFile(tmp_path / 'uno.zip', 'w', zipfile.ZIP_DEFLATED) as archivo:
+        archivo.writestr('decrypted_chunk_1.bin', data)
+    comprimidos = {'uno.zip': None, 'decrypted_chunk_1.bin.gz': gzip.compress,
+                   'b.bz2': bz2.compress, 'c.xz': lzma.compress}
+    for nombre, comprimir in comprimidos.items():
+        if comprimir is not None:
+            (tmp_path / nombre).write_bytes(comprimir(data))
+        resultado = analyzer.analyze_chunk(1, nombre, compact=True)
+        resultado.filename = 'plano.bin'
+        assert resultado.to_dict() == esperado.to_dict(), nombre
+    assert analyzer.analyze_all_chunks(1)['summary']['chunks_with_data'] == 1
+
+    # Un zip con varios chunks: cada miembro es un chunk
+    with zipfile.ZipFile(tmp_path / 'varios.zip', 'w', zipfile.ZIP_LZMA) as archivo:
+        archivo.writestr('decrypted_chunk_3.bin', data)
+        archivo.writestr('sub/decrypted_chunk_1.bin', data[:4000])
+        archivo.writestr('vacio.bin', b'')
+    resultado = analyzer.analyze_archive('varios.zip', jobs=2)
+    assert [c['chunk_number'] for c in resultado['detailed_analysis']] == [1, 3]
+    assert resultado['summary']['total_chunks_analyzed'] == 3
+    assert resultado['detailed_analysis'][1]['analysis']['patterns_found'] == \
+        esperado.to_dict()['analysis']['patterns_found']
+    assert analyzer.analyze_chunk(1, 'varios.zip') is None
+
+    # Registros decodificados por trozos y memoria acotada al descomprimir
+    decoder = analizador_dtc1b.RecordDecoder(analyzer.record_layouts)
+    for inicio in range(0, 2000, 7):
+        decoder.feed(data[inicio:inicio + 7])
+    assert decoder.result() == analyzer.parse_records(data[:2000])
+    picos = []
+    for veces in (10, 40):
+        (tmp_path / 'grande.gz').write_bytes(gzip.compress(data * veces, 1))
+        tracemalloc.start()
+        analysis, _ = analyzer.analyze_file_streaming('grande.gz', window_size=1 << 18)
+        picos.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert analysis['file_size'] == len(data) * veces
+    assert picos[1] < picos[0] * 1.2
+
+def test_triaje_por_bloques_muestreados(tmp_path):
+    """El triaje estima con intervalos y es exacto si el archivo cabe en la muestra"""
+    import random
+    rnd = random.Random(5)
+    registro = b'ACCOUNT: ABCD12345678 USD: 1,234.56 HSBC '
+    ruta = tmp_path / 'grande.bin'
+    with open(ruta, 'wb') as f:
+        for i in range(32):
+            f.write((registro * 2000)[:65536] if i % 4 == 0 else rnd.randbytes(65536))
+    analyzer = DTCAnalyzer()
+
+    triaje = analyzer.triage(str(ruta), samples=16, seed=1)
+    assert triaje == dict(analyzer.triage(str(ruta), samples=16, seed=1), seconds=triaje['seconds'])
+    assert triaje['blocks'] == 16 and triaje['sampled_fraction'] == 0.5 and not triaje['exact']
+    assert triaje['mostly_encrypted']
+    low, high = triaje['encrypted_fraction']['interval']
+    assert low <= 0.75 <= high
+    esperado = analyzer.analyze_file_streaming(str(ruta))[0]['patterns_found']['financial_structures']['count']
+    low, high = triaje['patterns']['financial_structures']['per_mb_interval']
+    assert low * 2 <= esperado <= high * 2
+    assert 'HSBC' in triaje['institutions'] and 'account' in triaje['financial_indicators']
+    assert 'Bloques cifrados' in analyzer.format_triage(triaje)
+
+    exacto = analyzer.triage(str(ruta), samples=32)
+    assert exacto['exact'] and exacto['encrypted_fraction']['estimate'] == 0.75
+    assert exacto['patterns']['financial_structures']['estimated_total'] == esperado
+
+def test_entropia_de_shannon():
+    """La entropía es la de Shannon en bits por byte"""
+    analyzer = DTCAnalyzer()
+    assert analyzer.calculate_entropy(b'') == 0
+    assert analyzer.calculate_entropy(b'\x00' * 1000) == 0
+    assert analyzer.calculate_entropy(b'ab' * 500) == pytest.approx(1.0)
+    assert analyzer.calculate_entropy(bytes(range(256)) * 40) == pytest.approx(8.0)
+    assert analyzer.calculate_entropy(os.urandom(1 << 16)) > 7
+
+def test_mapa_de_entropia_por_bloques(tmp_path):
+    """El mapa localiza la región aleatoria dentro del archivo"""
+    data = b'\x00' * 4096 + bytes(range(256)) * 16 + b'A' * 100
+    analyzer = DTCAnalyzer()
+
+    mapa = analyzer.calculate_entropy_map(data, block_size=1024)
+    assert [offset for offset, _ in mapa] == list(range(0, len(data), 1024))
+    assert [round(e, 6) for _, e in mapa] == [0.0] * 4 + [8.0] * 4 + [0.0]
+
+    ruta = tmp_path / 'mixto.bin'
+    ruta.write_bytes(data)
+    assert analyzer.calculate_file_entropy_map(str(ruta), block_size=1024, window_size=3000) == mapa
+
+def test_entropia_sin_numpy_coincide(monkeypatch):
+    """El respaldo en Python puro da los mismos resultados que NumPy"""
+    pytest.importorskip('numpy')
+    data = _datos_con_cruces() + os.urandom(5000)
+    analyzer = DTCAnalyzer()
+    con_numpy = (analyzer.calculate_entropy(data), analyzer.calculate_entropy_map(data, 512))
+
+    monkeypatch.setattr(analizador_dtc1b, 'np', None)
+    sin_numpy = (analyzer.calculate_entropy(data), analyzer.calculate_entropy_map(data, 512))
+
+    assert sin_numpy[0] == pytest.approx(con_numpy[0])
+    assert [o for o, _ in sin_numpy[1]] == [o for o, _ in con_numpy[1]]
+    assert [e for _, e in sin_numpy[1]] == pytest.approx([e for _, e in con_numpy[1]])
+
+def test_chunks_en_paralelo_igual_que_en_serie(tmp_path, monkeypatch):
+    """Con jobs > 1 el resultado coincide con la ejecución en serie y en orden"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 4, 7, 9):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 150])
+    (tmp_path / 'decrypted_chunk_3.bin').write_bytes(b'')
+
+    analyzer = DTCAnalyzer()
+    serie = analyzer.analyze_all_chunks(10)
+    paralelo = analyzer.analyze_all_chunks(10, jobs=3)
+
+    assert paralelo == serie
+    assert [c['chunk_number'] for c in paralelo['detailed_analysis']] == [1, 2, 4, 7, 9]
+    assert paralelo['summary']['total_chunks_analyzed'] == 6
+
+def test_busqueda_con_parada_anticipada(tmp_path, capsys):
+    """find_matches da las primeras coincidencias de finditer y deja de leer al reunirlas"""
+    import gzip
+    import random
+    rnd = random.Random(4)
+    data = _datos_con_cruces() + rnd.randbytes(4 << 20) + b' HSBCGB2LXXX 12345678901 '
+    analyzer = DTCAnalyzer()
+    limites = {'swift_codes': 1, 'account_numbers': 10}
+
+    encontrado = analyzer.find_matches(data, limites)
+    assert encontrado['complete'] and encontrado['bytes_scanned'] < len(data) // 8
+    for nombre, limite in limites.items():
+        esperado = [{'offset': m.start(), 'value': m.group().decode()}
+                    for m in itertools.islice(analyzer.patterns[nombre].finditer(data), limite)]
+        assert encontrado['matches'][nombre] == esperado
+
+    # Sin límite se recorre todo y coincide con finditer; también comprimido
+    ruta = tmp_path / 'datos.bin.gz'
+    ruta.write_bytes(gzip.compress(data, 1))
+    todo = analyzer.find_matches(str(ruta), {'swift_codes': None}, window_size=1 << 20)
+    assert not todo['complete'] and todo['bytes_scanned'] == len(data)
+    assert [m['offset'] for m in todo['matches']['swift_codes']] == \
+        [m.start() for m in analyzer.patterns['swift_codes'].finditer(data)]
+
+    with pytest.raises(ValueError):
+        analyzer.find_matches(data, {'no_existe': 1})
+    analizador_dtc1b.main(['--find', str(ruta), '--find-pattern', 'swift_codes:2'])
+    assert 'swift_codes: 2 coincidencias' in capsys.readouterr().out
+
+def test_lectura_anticipada_solapa_disco_y_escaneo(tmp_path, monkeypatch):
+    """Con prefetch las lecturas lentas se solapan con el escaneo sin cambiar el resultado"""
+    import io
+    import time
+    data = _datos_con_cruces() * 8
+
+    class Lento(io.BytesIO):
+        def read(self, size=-1):
+            time.sleep(0.03)
+            return super().read(size)
+
+    tiempos = {}
+    resultados = {}
+    for profundidad in (0, 2):
+        analyzer = DTCAnalyzer(prefetch=profundidad)
+        scanner = analizador_dtc1b.PatternScanner(analyzer, 4096, 128,
+                                                  progress=lambda evento: time.sleep(0.03))
+        inicio = time.perf_counter()
+        scanner.scan_fileobj(Lento(data))
+        tiempos[profundidad] = time.perf_counter() - inicio
+        resultados[profundidad] = scanner.record('lento').to_dict()
+    assert resultados[2] == resultados[0] == DTCAnalyzer().scan_data(data).record('lento').to_dict()
+    assert tiempos[2] < tiempos[0] * 0.8
+
+    # Los errores del hilo lector llegan al llamador
+    def fallido():
+        yield 1
+        raise OSError("disco")
+    with pytest.raises(OSError):
+        list(analizador_dtc1b.prefetched(fallido(), 2))
+
+    # En serie los chunks siguientes se leen por adelantado
+    monkeypatch.chdir(tmp_path)
+    for i in (1, 2, 3):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 700])
+    assert DTCAnalyzer(prefetch=2).analyze_all_chunks(3) == DTCAnalyzer(prefetch=0).analyze_all_chunks(3)
+
+def test_rangos_de_un_archivo_en_paralelo(tmp_path, monkeypatch):
+    """Un archivo repartido en rangos de bytes da el mismo resultado que el escaneo en serie"""
+    import random
+    rnd = random.Random(11)
+    data = b''.join(rnd.randbytes(rnd.randint(0, 2000)) + _datos_con_cruces()[:rnd.randint(0, 4000)]
+                    for _ in range(300))
+    ruta = tmp_path / 'grande.bin'
+    ruta.write_bytes(data)
+    monkeypatch.setattr(analizador_dtc1b, 'PARALLEL_MIN_RANGE', 4096)
+
+    analyzer = DTCAnalyzer()
+    esperado = analyzer.scan_data(data).record(str(ruta))
+    esperado.records = analyzer.parse_records(data)
+    rangos = analizador_dtc1b.split_ranges(data, 8, analyzer.block_breakers())
+    assert len(rangos) == 8 and rangos[0][0] == 0 and rangos[-1][1] == len(data)
+    assert all(analyzer.block_breakers()[data[fin - 1]] for _, fin in rangos)
+    for jobs in (1, 2):
+        assert analyzer.scan_file_parallel(str(ruta), jobs).to_dict() == esperado.to_dict()
+    analysis, structured = analyzer.analyze_file_parallel(str(ruta), 2)
+    assert analysis == esperado.analysis_dict() and structured == esperado.structured_dict()
+
+    # Sin bytes de corte no se divide: un solo rango
+    texto = b'ABCD1234' * 2000
+    assert analizador_dtc1b.split_ranges(texto, 8, analyzer.block_breakers()) == [(0, len(texto))]
+    with pytest.raises(ValueError):
+        DTCAnalyzer(sampling='reservoir').scan_file_parallel(str(ruta))
+
+def test_sketches_combinables_entre_chunks(tmp_path, monkeypatch):
+    """Los sketches por chunk se combinan igual en serie, en paralelo, desde la caché y el NDJSON"""
+    import random
+    monkeypatch.chdir(tmp_path)
+    rnd = random.Random(5)
+    for i in range(1, 4):
+        valores = [f'DTC{n}' for n in range(1000 * i, 1000 * i + 1500)] + ['DTC777'] * 300
+        rnd.shuffle(valores)
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(' '.join(valores).encode())
+
+    analyzer = DTCAnalyzer(sketches=True)
+    serie = analyzer.analyze_all_chunks(3)
+    sketch = serie['summary']['sketches']['dtc_specific']
+    assert sketch['values'] == 3 * 1800
+    # 1000-4499 más DTC777: 3501 valores distintos
+    assert abs(sketch['distinct'] - 3501) < 0.06 * 3501
+    # Count-Min da una cota superior de la frecuencia
+    assert sketch['top'][0][0] == 'DTC777' and 900 <= sketch['top'][0][1] < 920
+
+    assert analyzer.analyze_all_chunks(3, jobs=2)['summary'] == serie['summary']
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    analyzer.analyze_all_chunks(3, cache=cache)
+    assert analyzer.analyze_all_chunks(3, cache=cache)['summary']['sketches'] == serie['summary']['sketches']
+    cache.close()
+    ndjson = analyzer.analyze_all_chunks(3, output=str(tmp_path / 'r.ndjson'))
+    assert ndjson['summary']['sketches'] == serie['summary']['sketches']
+    assert 'VALORES DISTINTOS' in analyzer.generate_report(serie)
+
+    # HyperLogLog y Count-Min combinados son exactamente los del conjunto
+    partes = [analizador_dtc1b.PatternSketch() for _ in range(2)]
+    junto = analizador_dtc1b.PatternSketch()
+    for n in range(5000):
+        valor = str(n % 700).encode()
+        partes[n % 2].add(valor)
+        junto.add(valor)
+    combinado = partes[0].merge(partes[1])
+    assert combinado.registers == junto.registers and combinado.counters == junto.counters
+    assert DTCAnalyzer().pattern_set_version() != analyzer.pattern_set_version()
+
+def test_validacion_de_candidatos_por_lotes(tmp_path, monkeypatch):
+    """Solo los IBAN, cuentas y BIC válidos llegan a muestras e índice, con y sin NumPy"""
+    import random
+    monkeypatch.chdir(tmp_path)
+    rnd = random.Random(11)
+    valores = ['GB82WEST12345698765432', 'GB82WEST12345698765433', 'DE89370400440532013000',
+               '79927398713', '79927398710', 'HSBCGB2LXXX', 'ABCDQQ2LXXX']
+    data = ' '.join(rnd.choice(valores) + ' ' + str(rnd.randrange(10 ** 12)) for _ in range(40000)).encode()
+    (tmp_path / 'decrypted_chunk_1.bin').write_bytes(data)
+
+    analyzer = DTCAnalyzer(validate=True)
+    checks = analizador_dtc1b.VALIDATED_PATTERNS
+    record = analyzer.analyze_chunk(1, 'decrypted_chunk_1.bin', compact=True)
+    for name, check in checks.items():
+        candidatos = analyzer.patterns[name].findall(data)
+        validos = [valor for valor in candidatos if analizador_dtc1b._CHECKS[check][0](valor)]
+        assert record.validation[name] == {'valid': len(validos), 'invalid': len(candidatos) - len(validos)}
+        assert record.validation[name]['invalid'] > 0
+        assert list(record.samples[record.layout.pattern_ids[name]]) == [v.decode() for v in validos[:10]]
+
+    # El lote NumPy, el escaneo en flujo, por bloques y por rangos coinciden
+    monkeypatch.setattr(analizador_dtc1b, 'np', None)
+    sin_numpy = analyzer.analyze_chunk(1, 'decrypted_chunk_1.bin', compact=True)
+    assert sin_numpy.validation == record.validation
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    assert analyzer.analyze_chunk(1, 'decrypted_chunk_1.bin', streaming=True,
+                                  window_size=4096, overlap=128) == record.to_dict()
+    bloques = DTCAnalyzer(validate=True, block_dedup=True).analyze_all_chunks(1)
+    assert bloques['detailed_analysis'] == [record.to_dict()]
+    rangos = analyzer.scan_file_parallel('decrypted_chunk_1.bin', jobs=1, chunk_number=1)
+    assert rangos.validation == record.validation and rangos.samples == record.samples
+
+    # El índice solo recibe los candidatos válidos
+    ruta = str(tmp_path / 'indice.sqlite')
+    resultado = analyzer.analyze_all_chunks(1, index=ruta)
+    index = MatchIndex(ruta)
+    assert index.counts()['swift_codes'] == record.validation['swift_codes']['valid']
+    assert {fila['value'] for fila in index.query('iban_patterns')} == \
+        {'GB82WEST12345698765432', 'DE89370400440532013000'}
+    index.close()
+    resumen = resultado['summary']['validation']
+    assert resumen['account_numbers']['valid'] == record.validation['account_numbers']['valid']
+    ndjson = analyzer.analyze_all_chunks(1, output=str(tmp_path / 'r.ndjson'))
+    assert ndjson['summary']['validation'] == resumen
+    assert 'VALIDACIÓN DE CANDIDATOS' in analyzer.generate_report(resultado)
+    assert DTCAnalyzer().pattern_set_version() != analyzer.pattern_set_version()
+
+def test_deduplicacion_de_chunks_y_bloques(tmp_path, monkeypatch):
+    """Los chunks y bloques repetidos se analizan una vez con el mismo resultado"""
+    import random
+    monkeypatch.chdir(tmp_path)
+    rnd = random.Random(7)
+    registro = 'HSBC Banco de España ACCOUNT: ABCD12345678 USD: 1,234.56 DE89370400440532013000 '.encode()
+    base = b''.join(rnd.randbytes(rnd.randint(0, 300)) + registro * rnd.randint(0, 2) for _ in range(2500))
+    contenidos = {1: base, 2: rnd.randbytes(100) + base + bytes(5000), 3: base, 4: base[:1000]}
+    for i, contenido in contenidos.items():
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(contenido)
+
+    esperado = DTCAnalyzer().analyze_all_chunks(5)
+    llamadas = []
+    analyzer = DTCAnalyzer(block_dedup=True)
+    original = analyzer.analyze_chunk
+    monkeypatch.setattr(analyzer, 'analyze_chunk', lambda *a, **k: llamadas.append(a[0]) or original(*a, **k))
+    ruta = str(tmp_path / 'indice.sqlite')
+    resultado = analyzer.analyze_all_chunks(5, dedup=True, index=ruta)
+
+    assert resultado['detailed_analysis'] == esperado['detailed_analysis']
+    assert llamadas == [1, 2, 4]
+    dedup = resultado['summary']['dedup']
+    assert dedup['duplicate_chunks'] == 1 and dedup['bytes'] == sum(map(len, contenidos.values()))
+
+    # Sin índice el chunk 2 reutiliza los bloques del chunk 1
+    analyzer = DTCAnalyzer(block_dedup=True)
+    resultado = analyzer.analyze_all_chunks(5, dedup=True)
+    assert resultado['detailed_analysis'] == esperado['detailed_analysis']
+    dedup = resultado['summary']['dedup']
+    assert dedup['duplicate_blocks'] > 0 and dedup['ratio'] > 2
+    assert 'Deduplicación: 1 chunks' in analyzer.generate_report(resultado)
+
+    indice = MatchIndex(ruta)
+    assert indice.query(chunk=3) == [dict(m, chunk_number=3) for m in indice.query(chunk=1)]
+    indice.close()
+
+    with pytest.raises(ValueError):
+        DTCAnalyzer(sampling='reservoir', block_dedup=True)
+
+def test_cortes_por_contenido_sin_numpy(monkeypatch):
+    """Los cortes de bloque no dependen de NumPy"""
+    import random
+    data = random.Random(3).randbytes(300000)
+    breakers = DTCAnalyzer().block_breakers()
+    esperado = analizador_dtc1b.content_blocks(data, breakers)
+    monkeypatch.setattr(analizador_dtc1b, 'np', None)
+    assert analizador_dtc1b.content_blocks(data, breakers) == esperado
+    assert esperado[0][0] == 0 and esperado[-1][1] == len(data) and len(esperado) > 3
+    assert all(breakers[data[end - 1]] for _, end in esperado)
+
+def test_servidor_local_con_progreso(tmp_path):
+    """El servidor responde rutas y subidas con progreso y el resultado de un escaneo normal"""
+    import json
+    import threading
+    import urllib.error
+    import urllib.request
+    data = _datos_con_cruces() * 20
+    (tmp_path / 'chunk.bin').write_bytes(data)
+    analyzer = DTCAnalyzer()
+    esperado = analyzer.scan_data(data).record('chunk.bin').to_dict()
+
+    server = analizador_dtc1b.AnalysisServer(analyzer, port=0, jobs=2, root=str(tmp_path),
+                                             window_size=4096).start()
+    try:
+        base = 'http://%s:%d' % server.address
+
+        def analizar(consulta='', cuerpo=b''):
+            with urllib.request.urlopen(base + '/analyze' + consulta, data=cuerpo) as respuesta:
+                return [json.loads(linea) for linea in respuesta]
+
+        respuestas = {}
+        hilos = [threading.Thread(target=lambda: respuestas.update(ruta=analizar('?path=chunk.bin&filename=chunk.bin'))),
+                 threading.Thread(target=lambda: respuestas.update(subida=analizar('?filename=chunk.bin', data)))]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        for eventos in respuestas.values():
+            assert eventos[-1]['event'] == 'result'
+            assert eventos[-1]['result'] == esperado
+            assert [e['bytes'] for e in eventos[:-1]] == sorted(e['bytes'] for e in eventos[:-1])
+            assert len(eventos) > 2 and eventos[-2]['bytes'] == len(data)
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            analizar('?path=../fuera.bin')
+        assert error.value.code == 403
+        with urllib.request.urlopen(base + '/health') as respuesta:
+            assert json.load(respuesta) == {'status': 'ok', 'jobs': 2, 'requests': 2}
+    finally:
+        server.close()
+
+def test_cache_solo_reanaliza_chunks_modificados(tmp_path, monkeypatch):
+    """La segunda ejecución sale de la caché salvo el chunk que cambió"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 3):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 200])
+
+    analyzer = DTCAnalyzer()
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    primera = analyzer.analyze_all_chunks(5, cache=cache)
+    assert primera['summary']['cache']['misses'] == 3
+    cache.close()
+
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    segunda = analyzer.analyze_all_chunks(5, cache=cache)
+    assert segunda['summary']['cache'] == {'hits': 3, 'misses': 0, 'hit_rate': 100.0}
+    assert segunda['detailed_analysis'] == primera['detailed_analysis']
+    assert 'Caché: 3 aciertos' in analyzer.generate_report(segunda)
+
+    (tmp_path / 'decrypted_chunk_2.bin').write_bytes(data[:900])
+    tercera = analyzer.analyze_all_chunks(5, cache=cache)
+    assert (tercera['summary']['cache']['hits'], tercera['summary']['cache']['misses']) == (2, 1)
+
+    # Un chunk vacío sin cambios también sale de la caché
+    (tmp_path / 'decrypted_chunk_4.bin').write_bytes(b'')
+    cuarta = analyzer.analyze_all_chunks(5, cache=cache)
+    assert (cuarta['summary']['cache']['hits'], cuarta['summary']['cache']['misses']) == (3, 1)
+    quinta = analyzer.analyze_all_chunks(5, cache=cache)
+    assert quinta['summary']['cache'] == {'hits': 4, 'misses': 0, 'hit_rate': 100.0}
+    assert quinta['summary']['total_chunks_analyzed'] == 4
+    assert quinta['detailed_analysis'] == tercera['detailed_analysis']
+    cache.close()
+
+def test_cache_expulsa_los_menos_usados(tmp_path, monkeypatch):
+    """La caché respeta su tamaño máximo expulsando por LRU"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 3):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 300])
+
+    analyzer = DTCAnalyzer()
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'), max_bytes=2500)
+    analyzer.analyze_all_chunks(5, cache=cache)
+    total = cache.conn.execute("SELECT SUM(nbytes) FROM results").fetchone()[0]
+    assert total <= 2500
+
+    cache.hits = cache.misses = 0
+    analyzer.analyze_all_chunks(5, cache=cache)
+    assert cache.stats()['misses'] > 0
+    cache.close()
+
+def test_instrumentacion_por_etapa_y_progreso(tmp_path, monkeypatch):
+    """Con instrument=True cada chunk y el resumen incluyen tiempos y coincidencias"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 400])
+
+    sin_metricas = DTCAnalyzer().analyze_all_chunks(3)
+    eventos = []
+    analyzer = DTCAnalyzer(instrument=True)
+    for streaming in (False, True):
+        eventos.clear()
+        results = analyzer.analyze_all_chunks(3, streaming=streaming, progress=eventos.append)
+
+        for chunk_result, esperado in zip(results['detailed_analysis'], sin_metricas['detailed_analysis']):
+            metricas = chunk_result.pop('metrics')
+            assert chunk_result == esperado
+            assert set(metricas['stages']) == {'read', 'regex', 'histogram', 'fold', 'keywords'}
+            assert metricas['bytes'] == esperado['analysis']['file_size']
+            for name, entry in esperado['analysis']['patterns_found'].items():
+                assert metricas['patterns'][name]['matches'] == entry['count']
+
+        resumen = results['summary']['metrics']
+        assert resumen['bytes'] == 1200
+        assert resumen['patterns']['bank_codes']['matches'] == results['global_patterns']['bank_codes']
+        assert [(e['chunk_number'], e['completed'], e['total']) for e in eventos] == [(1, 1, 2), (2, 2, 2)]
+        assert 'RENDIMIENTO' in analyzer.generate_report(results)
+
+def test_salida_ndjson_y_reanudacion(tmp_path, monkeypatch):
+    """Un registro NDJSON por chunk; al reanudar solo se analizan los que faltan"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 4):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 300])
+    (tmp_path / 'decrypted_chunk_3.bin').write_bytes(b'')
+
+    analyzer = DTCAnalyzer()
+    en_memoria = analyzer.analyze_all_chunks(4)
+    salida = str(tmp_path / 'resultados.ndjson')
+    results = analyzer.analyze_all_chunks(4, output=salida)
+
+    registros = list(analyzer.iter_stream(salida))
+    assert [r['chunk_number'] for r in registros] == [1, 2, 3, 4]
+    assert registros[2] == {'chunk_number': 3, 'filename': 'decrypted_chunk_3.bin', 'empty': True}
+    assert [r for r in registros if not r.get('empty')] == en_memoria['detailed_analysis']
+    assert results['summary'] == en_memoria['summary']
+    assert results['global_patterns'] == en_memoria['global_patterns']
+
+    # Simular una interrupción a mitad del tercer registro escrito
+    lineas = open(salida, 'rb').read().splitlines(keepends=True)
+    with open(salida, 'wb') as f:
+        f.writelines(lineas[:2])
+        f.write(lineas[3][:20])
+
+    eventos = []
+    reanudado = analyzer.analyze_all_chunks(4, output=salida, resume=True, progress=eventos.append)
+    assert [e['chunk_number'] for e in eventos] == [3, 4]
+    assert open(salida, 'rb').read().splitlines(keepends=True) == lineas
+    assert reanudado['summary'] == en_memoria['summary']
+
+    reporte = analyzer.generate_report(stream=salida)
+    assert 'Chunks con datos válidos: 3' in reporte
+
+def test_resultados_compactos(tmp_path, monkeypatch):
+    """ChunkResult ocupa menos que el diccionario y convierte a la misma forma"""
+    import pickle
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 3):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 250])
+
+    analyzer = DTCAnalyzer()
+    dicts = analyzer.analyze_all_chunks(3)
+    compactos = analyzer.analyze_all_chunks(3, compact=True, jobs=2)
+    assert all(isinstance(r, ChunkResult) for r in compactos['detailed_analysis'])
+    assert [r.to_dict() for r in compactos['detailed_analysis']] == dicts['detailed_analysis']
+    assert compactos['global_patterns'] == dicts['global_patterns']
+    assert analyzer.generate_report(compactos)[100:] == analyzer.generate_report(dicts)[100:]
+
+    record = compactos['detailed_analysis'][2]
+    assert ChunkResult.from_dict(record.to_dict(), analyzer.result_layout()).to_dict() == record.to_dict()
+    assert pickle.loads(pickle.dumps(record)).layout is record.layout
+
+    tracemalloc.start()
+    en_dicts = [record.to_dict() for _ in range(200)]
+    pico_dicts = tracemalloc.get_traced_memory()[0]
+    del en_dicts
+    tracemalloc.stop()
+    tracemalloc.start()
+    en_records = [ChunkResult.from_dict(record.to_dict(), analyzer.result_layout()) for _ in range(200)]
+    pico_records = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(en_records) == 200
+    assert pico_records < pico_dicts * 0.7
+
+def test_indice_de_coincidencias_y_consultas(tmp_path, monkeypatch):
+    """El índice guarda cada coincidencia con su offset y responde sin releer los chunks"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 3):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 300])
+    (tmp_path / 'decrypted_chunk_2.bin').write_bytes(b'x' * 50 + b'HSBCGB2LXXX')
+
+    ruta = str(tmp_path / 'indice.sqlite')
+    analyzer = DTCAnalyzer()
+    for streaming, jobs in ((False, 1), (True, 2)):
+        results = analyzer.analyze_all_chunks(3, streaming=streaming, jobs=jobs, index=ruta)
+
+        indice = MatchIndex(ruta)
+        swift = indice.query(pattern='swift_codes', chunk=2)
+        assert swift == [{'chunk_number': 2, 'pattern': 'swift_codes', 'offset': 50,
+                          'length': 11, 'value': 'HSBCGB2LXXX'}]
+        assert indice.chunks_with('institutions', 'HSBC') == [1, 2, 3]
+        assert indice.chunks_with(value='Banco de España') == [1, 3]
+        for chunk in results['detailed_analysis']:
+            numero = chunk['chunk_number']
+            counts = indice.counts(numero)
+            for name, found in chunk['analysis']['patterns_found'].items():
+                assert counts[name] == found['count']
+            keywords = chunk['analysis']['potential_data'].get('financial_keywords', {})
+            assert counts.get('financial_keywords', 0) == sum(keywords.values())
+
+        contenido = open('decrypted_chunk_3.bin', 'rb').read()
+        for match in indice.query(chunk=3, start=100, end=400):
+            assert 100 <= match['offset'] < 400
+            valor = contenido[match['offset']:match['offset'] + match['length']]
+            if match['pattern'] in analyzer.patterns:
+                assert valor.decode('utf-8', errors='ignore') == match['value']
+        indice.close()
+
+def test_ndjson_con_cache_lee_cada_resultado_al_escribirlo(tmp_path, monkeypatch):
+    """Con caché y salida NDJSON los aciertos se leen uno a uno, no todos de antemano"""
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in (1, 2, 3, 4):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 200])
+
+    analyzer = DTCAnalyzer()
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    salida = str(tmp_path / 'resultados.ndjson')
+    primera = analyzer.analyze_all_chunks(4, cache=cache, output=salida)
+
+    leidos = []
+    original = cache.fetch
+    monkeypatch.setattr(cache, 'fetch', lambda key, version: leidos.append(key) or original(key, version))
+    pendientes = []
+    segunda = analyzer.analyze_all_chunks(4, cache=cache, output=salida,
+                                          progress=lambda e: pendientes.append(e['completed'] - len(leidos)))
+    assert pendientes == [0, 0, 0, 0]
+    assert segunda['summary']['cache']['hits'] == 4
+    assert segunda['detailed_analysis'] == primera['detailed_analysis']
+    cache.close()
+
+def test_indice_con_escritores_solapados(tmp_path, monkeypatch):
+    """Un chunk a medio escanear no bloquea el índice para los demás procesos"""
+    import time as time_module
+    monkeypatch.chdir(tmp_path)
+    data = _datos_con_cruces()
+    for i in range(1, 7):
+        (tmp_path / f'decrypted_chunk_{i}.bin').write_bytes(data[:i * 150])
+    ruta = str(tmp_path / 'indice.sqlite')
+
+    lento = MatchIndex(ruta)
+    lento.begin_chunk(1, 'decrypted_chunk_1.bin', 'v')
+    lento.add('swift_codes', 0, 11, b'HSBCGB2LXXX')
+
+    # Con el chunk 1 aún abierto, otros procesos indexan y confirman
+    empezado = time_module.monotonic()
+    DTCAnalyzer().analyze_all_chunks(6, jobs=3, index=ruta)
+    assert time_module.monotonic() - empezado < 30
+
+    lento.end_chunk()
+    lento.close()
+    indice = MatchIndex(ruta)
+    assert indice.chunks_with('swift_codes') == [1, 2, 3, 4, 5, 6]
+    assert indice.query(chunk=1) == [{'chunk_number': 1, 'pattern': 'swift_codes', 'offset': 0,
+                                      'length': 11, 'value': 'HSBCGB2LXXX'}]
+    indice.close()
+
+def test_vigilancia_analiza_cada_chunk_una_vez(tmp_path, monkeypatch):
+    """El modo vigilancia espera a que el chunk esté completo y no lo reanaliza"""
+    data = _datos_con_cruces()
+    analyzer = DTCAnalyzer()
+    llamadas = []
+    original = analyzer.analyze_chunk
+    monkeypatch.setattr(analyzer, 'analyze_chunk',
+                        lambda number, filename, *args: llamadas.append(number) or original(number, filename, *args))
+
+    watcher = ChunkWatcher(analyzer, str(tmp_path), settle=3600)
+    (tmp_path / 'decrypted_chunk_2.bin').write_bytes(data[:600])
+    (tmp_path / 'otro.bin').write_bytes(data)
+    assert watcher.poll() == []          # recién visto: aún puede estar escribiéndose
+    assert len(watcher.poll()) == 1      # estable entre dos sondeos
+    assert watcher.poll() == []          # ya analizado
+
+    (tmp_path / 'decrypted_chunk_10.bin').write_bytes(data[:300])
+    with open(tmp_path / 'decrypted_chunk_10.bin', 'ab') as f:
+        watcher.poll()
+        f.write(data[300:900])           # sigue creciendo: se espera otro sondeo
+    watcher.poll()
+    watcher.poll()
+    assert llamadas == [2, 10]
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'decrypted_chunk_10.bin').rename(tmp_path / 'decrypted_chunk_1.bin')
+    (tmp_path / 'decrypted_chunk_1.bin').write_bytes(data[:900])
+    esperado = DTCAnalyzer().analyze_all_chunks(2)
+    results = watcher.results()
+    assert results['global_patterns'] == esperado['global_patterns']
+    assert results['summary']['chunks_with_data'] == 2
+
+    # Un chunk reescrito sustituye su aportación a los totales; el
+    # renombrado deja de contar como decrypted_chunk_10 y se analiza de nuevo
+    (tmp_path / 'decrypted_chunk_2.bin').write_bytes(b'')
+    os.utime(tmp_path / 'decrypted_chunk_2.bin', ns=(0, 0))
+    watcher.poll()
+    watcher.poll()
+    results = watcher.results()
+    assert results['summary']['total_chunks_analyzed'] == 2
+    assert results['summary']['chunks_with_data'] == 1
+    assert results['global_patterns'] == DTCAnalyzer().analyze_all_chunks(1)['global_patterns']
+    assert [r['chunk_number'] for r in results['detailed_analysis']] == [1]
+
+def test_archivo_que_crece_solo_escanea_lo_anadido(tmp_path):
+    """Con puntos de control un archivo ampliado se escanea desde donde se quedó"""
+    import random
+    rnd = random.Random(13)
+    registro = 'HSBC Banco de España ACCOUNT: ABCD12345678 USD: 1,234.56 79927398713 '.encode()
+
+    def trozo():
+        # Termina a mitad de un IBAN que completa el trozo siguiente
+        return b''.join(rnd.randbytes(rnd.randint(0, 200)) + registro * rnd.randint(0, 2)
+                        for _ in range(1500)) + b' GB82WEST1234'
+
+    ruta = tmp_path / 'captura.bin'
+    ruta.write_bytes(trozo())
+    checkpoints = analizador_dtc1b.ScanCheckpoints(str(tmp_path / 'checkpoints.sqlite'))
+    analyzer = DTCAnalyzer(sampling='reservoir', sample_seed=3, validate=True)
+    for paso in range(3):
+        antes = checkpoints.stats()
+        record = analyzer.scan_appended(str(ruta), checkpoints, 1, window_size=32768, overlap=4096)
+        completo = analyzer.analyze_chunk(1, str(ruta), streaming=True, window_size=32768,
+                                          overlap=4096, compact=True)
+        assert record.to_dict() == completo.to_dict()
+        leidos = checkpoints.stats()['bytes_scanned'] - antes['bytes_scanned']
+        assert leidos <= (ruta.stat().st_size if paso == 0 else len(anadido) + 4096 + 64)
+        anadido = b'5698765432 ' + trozo()
+        with open(ruta, 'ab') as f:
+            f.write(anadido)
+    assert checkpoints.stats()['resumed'] == 2 and checkpoints.stats()['rescanned'] == 1
+
+    # Un archivo reescrito (o con otro solape) se escanea desde el principio
+    ruta.write_bytes(b'X' + ruta.read_bytes()[1:])
+    assert analyzer.scan_appended(str(ruta), checkpoints, 1, window_size=32768, overlap=4096).to_dict() == \
+        analyzer.analyze_chunk(1, str(ruta), streaming=True, window_size=32768, overlap=4096)
+    analyzer.scan_appended(str(ruta), checkpoints, 1, window_size=32768, overlap=8192)
+    assert checkpoints.stats()['rescanned'] == 3
+
+    # El modo vigilancia retoma los archivos que crecen
+    watcher = ChunkWatcher(DTCAnalyzer(), str(tmp_path), pattern='*.bin', settle=0,
+                           window_size=32768, checkpoints=checkpoints)
+    watcher.poll()
+    with open(ruta, 'ab') as f:
+        f.write(trozo())
+    os.utime(ruta, ns=(0, 0))
+    watcher.poll()
+    results = watcher.results()
+    assert results['summary']['checkpoints']['resumed'] == 3
+    assert dict(results['global_patterns']) == DTCAnalyzer().analyze_chunk(1, str(ruta), compact=True).pattern_counts()
+    assert 'Puntos de control' in DTCAnalyzer().generate_report(results)
+    checkpoints.close()
+
+def test_vigilancia_ndjson_y_numeros_unicos(tmp_path):
+    """Reescrituras y borrados sustituyen el registro NDJSON; cada ruta tiene su número"""
+    data = _datos_con_cruces()
+    analyzer = DTCAnalyzer()
+    salida = str(tmp_path / 'vigilancia.ndjson')
+    entrada = tmp_path / 'entrada'
+    entrada.mkdir()
+    watcher = ChunkWatcher(analyzer, str(entrada), pattern='*.bin', settle=0, output=salida)
+
+    (entrada / 'a_1.bin').write_bytes(data[:400])
+    (entrada / 'b_1.bin').write_bytes(data[:400])
+    (entrada / 'c.bin').write_bytes(b'HSBCGB2LXXX')
+    watcher.poll()
+    assert sorted(watcher.numbers.values()) == [1, 2, 3]
+
+    (entrada / 'b_1.bin').write_bytes(data[:800])
+    os.utime(entrada / 'b_1.bin', ns=(10 ** 9, 10 ** 9))
+    watcher.poll()
+    (entrada / 'c.bin').unlink()
+    watcher.poll()
+    watcher.close()
+
+    en_vivo = watcher.results()
+    releido = analyzer.summarize_stream(salida)
+    assert releido['summary'] == en_vivo['summary']
+    assert releido['global_patterns'] == en_vivo['global_patterns']
+    assert releido['summary']['total_chunks_analyzed'] == 2
+    assert sorted(r['analysis']['file_size'] for r in releido['detailed_analysis']) == [400, 800]
+    assert sorted(r['analysis']['file_size'] for r in en_vivo['detailed_analysis']) == [400, 800]
+
 def main():
     """Función principal de prueba"""
     print("🚀 INICIANDO PRUEBAS DEL ANALIZADOR DTC1B")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PRUEBAS DEL BENCHMARK DTC1B
+Generador de corpus reproducible y comparación contra línea base
+"""
+
+import pytest
+
+from analizador_dtc1b import DTCAnalyzer
+from benchmark_dtc1b import (compare, iter_corpus_blocks, measure, parse_size,
+                             write_chunk_set, write_corpus)
+
+def test_parse_size():
+    """Tamaños con unidades binarias"""
+    assert parse_size('512') == 512
+    assert parse_size('4K') == 4096
+    assert parse_size('1.5M') == 1572864
+    assert parse_size('2g') == 2 * 1024 ** 3
+
+def test_corpus_reproducible_y_con_densidad(tmp_path):
+    """La misma semilla da los mismos bytes y la densidad controla las coincidencias"""
+    a = b''.join(iter_corpus_blocks(300000, seed=7))
+    b = b''.join(iter_corpus_blocks(300000, seed=7))
+    c = b''.join(iter_corpus_blocks(300000, seed=8))
+    assert a == b and a != c
+    assert len(a) == 300000 and a.startswith(b'DTC1B')
+
+    analyzer = DTCAnalyzer()
+    baja = b''.join(iter_corpus_blocks(300000, seed=7, density=0.01, entropy_fraction=0))
+    alta = b''.join(iter_corpus_blocks(300000, seed=7, density=0.2, entropy_fraction=0))
+    cuenta = lambda data: analyzer.analyze_patterns(data, 'x')['patterns_found']['swift_codes']['count']
+    assert cuenta(alta) > 5 * cuenta(baja)
+
+    aleatorio = b''.join(iter_corpus_blocks(300000, seed=7, entropy_fraction=1.0, zero_fraction=0))
+    assert analyzer.calculate_entropy(aleatorio[64 * 1024:]) > 7.9
+
+    ruta = write_corpus(str(tmp_path / 'corpus.bin'), 300000, seed=7)
+    assert open(ruta, 'rb').read() == a
+
+def test_medida_y_comparacion(tmp_path):
+    """Una medida real produce MB/s y RSS, y compare detecta regresiones"""
+    ruta = write_corpus(str(tmp_path / 'corpus.bin'), 100000, seed=1)
+    resultado = measure('analyze_file_streaming', ruta, 100000, repeat=1)
+    assert resultado['mb_per_s'] > 0
+    assert resultado['peak_rss_bytes'] >= resultado['baseline_rss_bytes'] > 0
+
+    directorio = write_chunk_set(str(tmp_path / 'chunks'), 100000, 3, seed=1)
+    assert measure('analyze_all_chunks', directorio, 100000, repeat=1)['seconds'] > 0
+
+    base = {'results': [dict(resultado)]}
+    actual = {'results': [dict(resultado, mb_per_s=resultado['mb_per_s'] * 0.5)]}
+    assert compare(actual, base) == [('analyze_file_streaming', 100000, 'mb_per_s',
+                                      resultado['mb_per_s'], resultado['mb_per_s'] * 0.5)]
+    assert compare(base, base) == []
+
+def test_medida_falla_si_el_proceso_hijo_falla(tmp_path):
+    """Un error en el proceso hijo se informa en lugar de colgar la medida"""
+    with pytest.raises(RuntimeError):
+        measure('analyze_file_streaming', str(tmp_path / 'no_existe' / 'x.bin'), 1, repeat=1, timeout=60)
+    with pytest.raises(RuntimeError):
+        measure('no_existe', str(tmp_path), 1, repeat=1, timeout=60)